@@ -0,0 +1,52 @@
+'''
+Time the natural ordering of chromosome names for an assembly
+with many scaffolds.
+
+Usage: python benchmarks/chromsizes.py [num_contigs]
+'''
+import functools as ft
+import os.path as op
+import random
+import sys
+import time
+
+# benchmark the hgtiles in this checkout rather than an installed one
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+
+import hgtiles.bigwig as hgbi
+
+def make_chromosomes(num_contigs):
+    chromosomes = (['chr{}'.format(i) for i in range(1, 23)] +
+            ['chrX', 'chrY', 'chrM'] +
+            ['chr{}_random{}'.format(i % 22 + 1, i) for i in range(num_contigs // 10)] +
+            ['scaffold{}'.format(i) for i in range(num_contigs - num_contigs // 10)])
+
+    random.seed(0)
+    random.shuffle(chromosomes)
+    return chromosomes
+
+def time_sort(sort_function, chromosomes, repeats=3):
+    times = []
+    for i in range(repeats):
+        t1 = time.time()
+        result = sort_function(chromosomes)
+        times += [time.time() - t1]
+
+    return (min(times), result)
+
+def main():
+    num_contigs = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    chromosomes = make_chromosomes(num_contigs)
+
+    (key_time, key_sorted) = time_sort(hgbi.natsorted, chromosomes)
+    (cmp_time, cmp_sorted) = time_sort(
+            lambda c: sorted(c, key=ft.cmp_to_key(hgbi.natcmp)), chromosomes, repeats=1)
+
+    assert key_sorted == cmp_sorted
+
+    print('contigs: {}'.format(len(chromosomes)))
+    print('natsorted (key): {:.3f}s'.format(key_time))
+    print('sorted (cmp_to_key(natcmp)): {:.3f}s'.format(cmp_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Time hgtiles.dispatch.tiles with and without shared memory for
+requests returning more and more dense tile data.
+
+Usage:
+
+    python benchmarks/dispatch.py [--filetypes cooler,multivec]
+        [--sizes 1,4,16,64] [--repeats 10] [--num-workers 2]
+        [--scale 1] [--fixtures-dir dir]
+
+For each tile type and request size (the number of tiles per request),
+the median latency of both transports and the size of the returned
+tiles are printed as JSON.
+'''
+import argparse
+import json
+import numpy as np
+import sys
+import tempfile
+import tiles as bench
+import time
+
+def tile_ids(filetype, filepath, num_tiles):
+    '''
+    A request for num_tiles tiles at the deepest zoom level with
+    that many tiles.
+    '''
+    (make_fixture, dimensions, tileset_info, tiles, max_zoom, extent) = bench.filetypes[filetype]
+    tsinfo = tileset_info(filepath)
+
+    for zoom_level in range(max_zoom(tsinfo) + 1):
+        size = int(np.ceil(num_tiles ** (1 / dimensions)))
+        if extent(tsinfo, zoom_level) >= size:
+            break
+
+    return bench.viewport(zoom_level, 0, size, dimensions,
+            extent(tsinfo, zoom_level))[:num_tiles]
+
+def time_request(request, tileset, filepath, use_shared_memory, repeats):
+    import hgtiles.dispatch as hgdi
+
+    latencies = []
+    for i in range(repeats):
+        t1 = time.perf_counter()
+        returned = hgdi.tiles(request, {tileset: filepath},
+                use_shared_memory=use_shared_memory)
+        latencies += [time.perf_counter() - t1]
+
+    return (float(np.median(latencies) * 1000), returned)
+
+def main():
+    import hgtiles.dispatch as hgdi
+
+    parser = argparse.ArgumentParser(
+            description='Time dispatch.tiles with and without shared memory')
+    parser.add_argument('--filetypes', default='cooler,multivec',
+            help='A comma separated list of tile types')
+    parser.add_argument('--sizes', default='1,4,16,64',
+            help='A comma separated list of the number of tiles per request')
+    parser.add_argument('--repeats', type=int, default=10,
+            help='The number of times each request is repeated')
+    parser.add_argument('--num-workers', type=int, default=2,
+            help='The number of worker processes')
+    parser.add_argument('--scale', type=float, default=1,
+            help='A factor applied to the size of the synthetic tilesets')
+    parser.add_argument('--fixtures-dir', default=None,
+            help='Where to write the tilesets, which are reused if they '
+            'already exist (default: a temporary directory)')
+    args = parser.parse_args()
+
+    temp_dir = None
+    fixtures_dir = args.fixtures_dir
+
+    if fixtures_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        fixtures_dir = temp_dir.name
+
+    results = []
+
+    try:
+        hgdi.get_pool(args.num_workers)
+
+        for filetype in args.filetypes.split(','):
+            filepath = bench.get_fixture(filetype, fixtures_dir, args.scale)
+
+            for num_tiles in map(int, args.sizes.split(',')):
+                request = tile_ids(filetype, filepath, num_tiles)
+
+                # warm up the workers' caches
+                for i in range(args.num_workers):
+                    hgdi.tiles(request, {'a': filepath})
+
+                (pipe_ms, returned) = time_request(request, 'a', filepath, False, args.repeats)
+                (shm_ms, returned) = time_request(request, 'a', filepath, True, args.repeats)
+
+                result = {
+                    'filetype': filetype,
+                    'tiles': len(returned),
+                    'mb': sum(len(value.get(key, '')) for tile_id, value in returned
+                        if isinstance(value, dict) for key in hgdi.DENSE_KEYS) / 2 ** 20,
+                    'pipe_ms': pipe_ms,
+                    'shared_memory_ms': shm_ms,
+                }
+                results += [result]
+
+                print('{:10s} {:4d} tiles {:8.2f}MB  pipe {:8.2f}ms  shared memory {:8.2f}ms'.format(
+                    filetype, result['tiles'], result['mb'], pipe_ms, shm_ms), file=sys.stderr)
+    finally:
+        hgdi.shutdown()
+
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
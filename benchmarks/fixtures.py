@@ -0,0 +1,342 @@
+'''
+Synthetic tilesets for the benchmarks (see tiles.py), so that they
+don't depend on the downloaded test data (see get_test_data.sh).
+
+Every function writes one tileset into a directory and returns its
+path. The sizes are multiplied by a scale factor.
+'''
+import h5py
+import json
+import math
+import numpy as np
+import os.path as op
+import pandas as pd
+import sqlite3
+
+def make_chromsizes(scale=1):
+    '''
+    A few large chromosomes followed by many small scaffolds.
+    '''
+    rng = np.random.default_rng(0)
+
+    return ([('chr1', int(12e6 * scale)), ('chr2', int(8e6 * scale)),
+        ('chr3', int(5e6 * scale))] +
+        [('scaffold{}'.format(i), int(rng.integers(2000, 20000))) for i in range(50)])
+
+def make_signal(length, rng):
+    '''
+    A smooth, positive signal with a few gaps.
+    '''
+    signal = np.abs(np.cumsum(rng.normal(size=length))) + rng.exponential(size=length)
+    signal[rng.integers(0, length, length // 50)] = np.nan
+    return signal
+
+def write_cooler(grp, chromsizes, resolution, pixels, rng):
+    '''
+    Write a single resolution cooler into an HDF5 group.
+    '''
+    names = [c[0] for c in chromsizes]
+    lengths = [c[1] for c in chromsizes]
+
+    chrom_ids, starts, ends = [], [], []
+    chrom_offset = [0]
+    for cid, length in enumerate(lengths):
+        chrom_starts = np.arange(0, length, resolution)
+        chrom_ids += [np.full(len(chrom_starts), cid)]
+        starts += [chrom_starts]
+        ends += [np.minimum(chrom_starts + resolution, length)]
+        chrom_offset += [chrom_offset[-1] + len(chrom_starts)]
+
+    n_bins = chrom_offset[-1]
+    weights = rng.random(n_bins)
+    weights[::17] = np.nan
+
+    grp.create_dataset('chroms/name', data=np.array(names, dtype='S'))
+    grp.create_dataset('chroms/length', data=np.array(lengths, dtype=np.int32))
+    grp.create_dataset('bins/chrom', data=np.concatenate(chrom_ids).astype(np.int32))
+    grp.create_dataset('bins/start', data=np.concatenate(starts).astype(np.int32))
+    grp.create_dataset('bins/end', data=np.concatenate(ends).astype(np.int32))
+    grp.create_dataset('bins/weight', data=weights)
+
+    # aggregate the base resolution pixels to this resolution
+    bin_starts = np.concatenate(starts) + np.repeat(
+            np.r_[0, np.cumsum(lengths)[:-1]], np.diff(chrom_offset))
+    bin1 = np.searchsorted(bin_starts, pixels[0], side='right') - 1
+    bin2 = np.searchsorted(bin_starts, pixels[1], side='right') - 1
+    df = pd.DataFrame({'bin1_id': bin1, 'bin2_id': bin2, 'count': pixels[2]})
+    df = df.groupby(['bin1_id', 'bin2_id']).sum().reset_index()
+
+    grp.create_dataset('pixels/bin1_id', data=df['bin1_id'].values.astype(np.int64))
+    grp.create_dataset('pixels/bin2_id', data=df['bin2_id'].values.astype(np.int64))
+    grp.create_dataset('pixels/count', data=df['count'].values.astype(np.int32))
+    grp.create_dataset('indexes/chrom_offset', data=np.array(chrom_offset, dtype=np.int64))
+    grp.create_dataset('indexes/bin1_offset', data=np.searchsorted(
+        df['bin1_id'].values, np.arange(n_bins + 1)).astype(np.int64))
+
+    grp.attrs['format'] = 'HDF5::Cooler'
+    grp.attrs['format-version'] = 2
+    grp.attrs['bin-type'] = 'fixed'
+    grp.attrs['bin-size'] = resolution
+    grp.attrs['nchroms'] = len(names)
+    grp.attrs['nbins'] = n_bins
+    grp.attrs['nnz'] = len(df)
+
+def make_cooler(directory, scale=1, num_resolutions=8):
+    '''
+    A multi-resolution cooler with random contacts.
+    '''
+    rng = np.random.default_rng(0)
+    chromsizes = make_chromsizes(scale)
+    genome_length = sum(c[1] for c in chromsizes)
+    num_pixels = int(500000 * scale)
+
+    # genomic positions of the contacts, upper triangular
+    pos1 = rng.integers(0, genome_length, num_pixels)
+    pos2 = rng.integers(0, genome_length, num_pixels)
+    pixels = (np.minimum(pos1, pos2), np.maximum(pos1, pos2),
+            rng.integers(1, 10, num_pixels))
+
+    filename = op.join(directory, 'test.mcool')
+    with h5py.File(filename, 'w') as f:
+        for resolution in [1000 * 2 ** i for i in range(num_resolutions)]:
+            write_cooler(f.create_group('resolutions/{}'.format(resolution)),
+                    chromsizes, resolution, pixels, rng)
+
+    return filename
+
+def make_bigwig(directory, scale=1, span=100):
+    import pyBigWig
+
+    rng = np.random.default_rng(0)
+    filename = op.join(directory, 'test.bigWig')
+
+    bw = pyBigWig.open(filename, 'w')
+    bw.addHeader(make_chromsizes(scale))
+
+    for chrom, length in make_chromsizes(scale):
+        values = make_signal(length // span, rng)
+        keep = ~np.isnan(values)
+
+        bw.addEntries(chrom, (np.arange(len(values))[keep] * span).tolist(),
+                values=values[keep].tolist(), span=span)
+
+    bw.close()
+    return filename
+
+def make_hitile(directory, scale=1):
+    import hgtiles.hitile as hghi
+
+    filename = op.join(directory, 'test.hitile')
+    length = sum(c[1] for c in make_chromsizes(scale))
+
+    hghi.array_to_hitile(make_signal(length, np.random.default_rng(0)), filename)
+    return filename
+
+def make_multivec(directory, scale=1, num_rows=24, resolution=1000):
+    '''
+    A multivec file built from a wide TSV file with one line per bin.
+    '''
+    import hgtiles.multivec_build as hgmb
+
+    rng = np.random.default_rng(0)
+    chromsizes = make_chromsizes(scale)
+    tsv = op.join(directory, 'multivec.tsv')
+
+    with open(tsv, 'w') as f:
+        for chrom, length in chromsizes:
+            starts = np.arange(0, length, resolution)
+            values = np.stack([make_signal(len(starts), rng) for i in range(num_rows)], axis=1)
+
+            for start, row in zip(starts, values):
+                f.write('{}\t{}\t{}\t{}\n'.format(chrom, start, min(start + resolution, length),
+                    '\t'.join('{:.3f}'.format(v) for v in row)))
+
+    return hgmb.build(op.join(directory, 'test.multires.mv5'), [tsv], chromsizes,
+            resolution=resolution)
+
+def make_beddb(directory, scale=1, max_zoom=12, tile_size=1024):
+    '''
+    A gene annotation file with intervals spread over the genome.
+    '''
+    filename = op.join(directory, 'test.beddb')
+    max_width = 2 ** math.ceil(math.log2(sum(c[1] for c in make_chromsizes(scale))))
+
+    conn = sqlite3.connect(filename)
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        zoom_step INT, max_length INT, assembly text, chrom_names text,
+        chrom_sizes text, tile_size REAL, max_zoom INT, max_width REAL,
+        header text
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?,?,?)',
+            (1, max_width, 'test', 'chr1', str(max_width), tile_size,
+                max_zoom, max_width, ''))
+
+    conn.execute('''
+    CREATE TABLE intervals
+    (
+        id int PRIMARY KEY, zoomLevel int, importance real,
+        startPos int, endPos int, chrOffset int, uid text, fields text
+    )''')
+    conn.execute('CREATE VIRTUAL TABLE position_index USING rtree(id, rStartPos, rEndPos)')
+
+    for i in range(int(20000 * scale)):
+        start = (i * 7919) % (max_width - 5000)
+        end = start + 100 + (i * 31) % 4000
+
+        conn.execute('INSERT INTO intervals VALUES (?,?,?,?,?,?,?,?)',
+                (i, i % (max_zoom + 1), float(i), start, end, 0, 'uid{}'.format(i),
+                    'chr1\t{}\t{}\tgene{}'.format(start, start + 1, i)))
+        conn.execute('INSERT INTO position_index VALUES (?,?,?)', (i, start, end))
+
+    conn.commit()
+    conn.close()
+    return filename
+
+def make_bed2ddb(directory, scale=1, max_zoom=12, tile_size=256):
+    '''
+    A 2D annotation file (e.g. loops or domains) near the diagonal.
+    '''
+    rng = np.random.default_rng(0)
+    filename = op.join(directory, 'test.bed2ddb')
+    length = sum(c[1] for c in make_chromsizes(scale))
+    max_width = tile_size * 2 ** max_zoom
+
+    conn = sqlite3.connect(filename)
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        zoom_step INT, max_length INT, assembly text, chrom_names text,
+        chrom_sizes text, tile_size REAL, max_zoom INT, max_width REAL
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?,?)',
+            (1, length, 'test', 'chr1', str(length), tile_size, max_zoom, max_width))
+
+    conn.execute('''
+    CREATE TABLE intervals
+    (
+        id int PRIMARY KEY, zoomLevel int, importance real, fromX int,
+        toX int, fromY int, toY int, chrOffset int, uid text, fields text
+    )''')
+    conn.execute('CREATE VIRTUAL TABLE position_index USING rtree('
+            'id, rFromX, rToX, rFromY, rToY)')
+
+    num_intervals = int(20000 * scale)
+    from_x = rng.integers(0, length - 200000, num_intervals)
+    from_y = from_x + rng.integers(0, 100000, num_intervals)
+    widths = rng.integers(1000, 50000, num_intervals)
+
+    for i in range(num_intervals):
+        (x, y, w) = (int(from_x[i]), int(from_y[i]), int(widths[i]))
+        conn.execute('INSERT INTO intervals VALUES (?,?,?,?,?,?,?,?,?,?)',
+                (i, i % (max_zoom + 1), float(rng.random()), x, x + w, y, y + w, 0,
+                    'uid{}'.format(i), 'chr1\t{}\t{}\tchr1\t{}\t{}'.format(x, x + w, y, y + w)))
+        conn.execute('INSERT INTO position_index VALUES (?,?,?,?,?)', (i, x, x + w, y, y + w))
+
+    conn.commit()
+    conn.close()
+    return filename
+
+def make_geo(directory, scale=1, max_zoom=12):
+    '''
+    A geo db file with small polygons scattered over the world.
+    '''
+    rng = np.random.default_rng(0)
+    filename = op.join(directory, 'test.geodb')
+
+    conn = sqlite3.connect(filename)
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        zoom_step INT, tile_size INT, max_zoom INT, min_x REAL,
+        max_x REAL, min_y REAL, max_y REAL
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?)',
+            (1, 256, max_zoom, -180, 180, -90, 90))
+
+    conn.execute('''
+    CREATE TABLE intervals
+    (
+        id int PRIMARY KEY, zoomLevel int, importance real, minLng real,
+        maxLng real, maxLat real, minLat real, uid text, geometry text,
+        properties text
+    )''')
+    conn.execute('CREATE VIRTUAL TABLE position_index USING rtree('
+            'id, rMinLng, rMaxLng, rMinLat, rMaxLat)')
+
+    num_polygons = int(20000 * scale)
+    lngs = rng.uniform(-179, 179, num_polygons)
+    lats = rng.uniform(-80, 80, num_polygons)
+    sizes = rng.exponential(0.05, num_polygons)
+
+    for i in range(num_polygons):
+        (min_lng, min_lat) = (float(lngs[i]), float(lats[i]))
+        (max_lng, max_lat) = (min_lng + float(sizes[i]), min_lat + float(sizes[i]))
+
+        geometry = {'type': 'Polygon', 'coordinates': [[[min_lng, min_lat],
+            [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat], [min_lng, min_lat]]]}
+
+        conn.execute('INSERT INTO intervals VALUES (?,?,?,?,?,?,?,?,?,?)',
+                (i, i % (max_zoom + 1), float(rng.random()), min_lng, max_lng, max_lat,
+                    min_lat, 'uid{}'.format(i), json.dumps(geometry),
+                    json.dumps({'name': 'polygon{}'.format(i)})))
+        conn.execute('INSERT INTO position_index VALUES (?,?,?,?,?)',
+                (i, min_lng, max_lng, min_lat, max_lat))
+
+    conn.commit()
+    conn.close()
+    return filename
+
+def make_imtiles(directory, scale=1, max_zoom=5, tile_size=256, image_size=8192):
+    '''
+    An image tile pyramid with random bytes standing in for the images.
+    '''
+    rng = np.random.default_rng(0)
+    filename = op.join(directory, 'test.imtiles')
+    max_size = tile_size * 2 ** max_zoom
+
+    conn = sqlite3.connect(filename)
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        name text, description text, version text, attribution text,
+        min_zoom INT, tile_size INT, max_zoom INT, max_size INT,
+        width INT, height INT, dtype text
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+            ('test', '', '1', '', 0, tile_size, max_zoom, max_size,
+                max_size, max_size, 'uint8'))
+
+    conn.execute('CREATE TABLE tiles (z INT, y INT, x INT, image BLOB, '
+            'PRIMARY KEY (z, y, x))')
+
+    image_size = int(image_size * scale)
+    for z in range(max_zoom + 1):
+        for y in range(2 ** z):
+            for x in range(2 ** z):
+                conn.execute('INSERT INTO tiles VALUES (?,?,?,?)',
+                        (z, y, x, rng.bytes(image_size)))
+
+    conn.commit()
+    conn.close()
+    return filename
+
+def make_points(directory, scale=1):
+    '''
+    An HDF5 file with x and y columns of clustered points.
+    '''
+    rng = np.random.default_rng(0)
+    filename = op.join(directory, 'test.points.h5')
+
+    num_points = int(1000000 * scale)
+    centers = rng.uniform(0, 1e6, (100, 2))
+    points = centers[rng.integers(0, len(centers), num_points)] + rng.normal(
+            scale=2e4, size=(num_points, 2))
+
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('x', data=points[:, 0])
+        f.create_dataset('y', data=points[:, 1])
+        f.create_dataset('value', data=rng.random(num_points))
+
+    return filename
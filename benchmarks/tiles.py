@@ -0,0 +1,476 @@
+'''
+Time tileset_info and tiles for every tile type on synthetic tilesets
+(see fixtures.py).
+
+Usage:
+
+    python benchmarks/tiles.py [--filetypes cooler,bigwig,...] [--repeats 20]
+        [--scale 1] [--fixtures-dir dir] [--output results.json]
+        [--compare previous_results.json]
+
+Each tile type is timed on a few viewports:
+
+    single      one tile
+    bundle      a block of 4 tiles (4x4 for 2D tile types)
+    zoom_sweep  a 2 tile (2x2) viewport zooming in from zoom level 0
+    pan_sequence a 3 tile (3x3) viewport panning one tile at a time
+
+where every viewport is one request for all of its tiles. The results
+(latency percentiles, throughput and the peak RSS of the process timing
+each tile type) are written as JSON. With --compare, scenarios whose
+median latency grew by more than --threshold times are listed and the
+exit status is 1.
+'''
+import argparse
+import concurrent.futures as cf
+import datetime
+import json
+import math
+import multiprocessing as mp
+import numpy as np
+import os
+import os.path as op
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:
+    # python < 3.8
+    importlib_metadata = None
+
+# benchmark the hgtiles in this checkout rather than an installed one
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+
+import fixtures
+
+# the zoom level that points are benchmarked to, since points
+# tilesets don't have a maximum zoom level
+POINTS_MAX_ZOOM = 12
+
+# the loaded points tilesets, indexed by filename
+points_dataframes = {}
+
+def cooler_info(filepath):
+    import hgtiles.cooler as hgco
+    return hgco.tileset_info(filepath)
+
+def cooler_tiles(filepath, tile_ids):
+    import hgtiles.cooler as hgco
+    return hgco.tiles(filepath, tile_ids)
+
+def cooler_extent(tsinfo, zoom_level):
+    resolutions = sorted(tsinfo['resolutions'])[::-1]
+    return math.ceil(tsinfo['max_pos'][0] / (256 * resolutions[zoom_level]))
+
+def bigwig_info(filepath):
+    import hgtiles.bigwig as hgbi
+    return hgbi.tileset_info(filepath)
+
+def bigwig_tiles(filepath, tile_ids):
+    import hgtiles.bigwig as hgbi
+    return hgbi.tiles(filepath, tile_ids)
+
+def bigwig_extent(tsinfo, zoom_level):
+    length = sum(c[1] for c in tsinfo['chromsizes'])
+    return math.ceil(length / (tsinfo['max_width'] / 2 ** zoom_level))
+
+def hitile_info(filepath):
+    import hgtiles.hitile as hghi
+    return hghi.tileset_info(filepath)
+
+def hitile_tiles(filepath, tile_ids):
+    import hgtiles.hitile as hghi
+    return hghi.tiles(filepath, tile_ids)
+
+def multivec_info(filepath):
+    import hgtiles.multivec as hgmu
+    return hgmu.tileset_info(filepath)
+
+def multivec_tiles(filepath, tile_ids):
+    import hgtiles.multivec as hgmu
+    return hgmu.tiles(filepath, tile_ids)
+
+def multivec_extent(tsinfo, zoom_level):
+    return math.ceil(tsinfo['max_pos'][0] /
+            (tsinfo['tile_size'] * tsinfo['resolutions'][zoom_level]))
+
+def beddb_info(filepath):
+    import hgtiles.beddb as hgbe
+    return hgbe.tileset_info(filepath)
+
+def beddb_tiles(filepath, tile_ids):
+    import hgtiles.beddb as hgbe
+    return hgbe.tiles(filepath, tile_ids)
+
+def bed2ddb_info(filepath):
+    import hgtiles.bed2ddb as hgb2
+    return hgb2.get_2d_tileset_info(filepath)
+
+def bed2ddb_tiles(filepath, tile_ids):
+    import hgtiles.bed2ddb as hgb2
+
+    (zoom_level, x, y, width, height, positions) = tile_block(tile_ids)
+    tiles = hgb2.get_2D_tiles(filepath, zoom_level, x, y, width, height)
+
+    return [(tile_id, tiles[pos]) for tile_id, pos in zip(tile_ids, positions)]
+
+def geo_info(filepath):
+    import hgtiles.geo as hgge
+    return hgge.tileset_info(filepath)
+
+def geo_tiles(filepath, tile_ids):
+    import hgtiles.aio as hgai
+    return hgai.geo_tiles_by_id(filepath, tile_ids)
+
+def imtiles_info(filepath):
+    import hgtiles.imtiles as hgim
+    return hgim.get_tileset_info(filepath)
+
+def imtiles_tiles(filepath, tile_ids):
+    import hgtiles.imtiles as hgim
+    return hgim.get_tiles(filepath, tile_ids, raw=False)
+
+def imtiles_extent(tsinfo, zoom_level):
+    return math.ceil(tsinfo['width'] / (tsinfo['max_size'] / 2 ** zoom_level))
+
+def load_points(filepath):
+    import h5py
+    import pandas as pd
+
+    if filepath not in points_dataframes:
+        with h5py.File(filepath, 'r') as f:
+            points_dataframes[filepath] = pd.DataFrame({k: f[k][:] for k in f.keys()})
+
+    return points_dataframes[filepath]
+
+def points_info(filepath):
+    import hgtiles.points as hgpo
+    return hgpo.tileset_info(load_points(filepath), 'x', 'y')
+
+def points_tiles(filepath, tile_ids):
+    import hgtiles.points as hgpo
+
+    df = load_points(filepath)
+    (zoom_level, x, y, width, height, positions) = tile_block(tile_ids)
+    tiles = dict(hgpo.format_data(hgpo.tiles(df, 'x', 'y',
+        hgpo.tileset_info(df, 'x', 'y'), zoom_level, x, y, width, height)))
+
+    return [(tile_id, tiles[(zoom_level,) + pos]) for tile_id, pos in zip(tile_ids, positions)]
+
+def max_zoom_extent(tsinfo, zoom_level):
+    return math.ceil(tsinfo['max_pos'][0] / (tsinfo['max_width'] / 2 ** zoom_level))
+
+def world_extent(tsinfo, zoom_level):
+    return 2 ** zoom_level
+
+# for each tile type: the function that writes a tileset, the number of
+# dimensions of its tiles, its tileset_info and tiles functions, its
+# maximum zoom level and the number of tiles at a zoom level with data
+filetypes = {
+    'cooler': (fixtures.make_cooler, 2, cooler_info, cooler_tiles,
+        lambda tsinfo: len(tsinfo['resolutions']) - 1, cooler_extent),
+    'bigwig': (fixtures.make_bigwig, 1, bigwig_info, bigwig_tiles,
+        lambda tsinfo: tsinfo['max_zoom'], bigwig_extent),
+    'hitile': (fixtures.make_hitile, 1, hitile_info, hitile_tiles,
+        lambda tsinfo: tsinfo['max_zoom'], max_zoom_extent),
+    'multivec': (fixtures.make_multivec, 1, multivec_info, multivec_tiles,
+        lambda tsinfo: len(tsinfo['resolutions']) - 1, multivec_extent),
+    'beddb': (fixtures.make_beddb, 1, beddb_info, beddb_tiles,
+        lambda tsinfo: tsinfo['max_zoom'], max_zoom_extent),
+    'bed2ddb': (fixtures.make_bed2ddb, 2, bed2ddb_info, bed2ddb_tiles,
+        lambda tsinfo: tsinfo['max_zoom'], max_zoom_extent),
+    'geo': (fixtures.make_geo, 2, geo_info, geo_tiles,
+        lambda tsinfo: tsinfo['max_zoom'], world_extent),
+    'imtiles': (fixtures.make_imtiles, 2, imtiles_info, imtiles_tiles,
+        lambda tsinfo: tsinfo['max_zoom'], imtiles_extent),
+    'points': (fixtures.make_points, 2, points_info, points_tiles,
+        lambda tsinfo: POINTS_MAX_ZOOM, world_extent),
+}
+
+def tile_block(tile_ids):
+    '''
+    The zoom level and the bounding block of a list of 2D tile ids.
+
+    Returns
+    -------
+    (zoom_level, x, y, width, height, positions)
+    '''
+    positions = [tuple(map(int, tile_id.split('.')[1:4])) for tile_id in tile_ids]
+
+    xs = [p[1] for p in positions]
+    ys = [p[2] for p in positions]
+
+    return (positions[0][0], min(xs), min(ys), max(xs) - min(xs) + 1,
+            max(ys) - min(ys) + 1, [p[1:] for p in positions])
+
+def viewport(zoom_level, x, size, dimensions, extent):
+    '''
+    The tile ids of a viewport of size tiles (in each dimension)
+    starting at tile x (and y = x, e.g. on the diagonal of a matrix),
+    shifted to stay within the tiles with data.
+    '''
+    x = max(0, min(x, extent - size))
+    positions = range(x, x + min(size, extent))
+
+    if dimensions == 1:
+        return ['a.{}.{}'.format(zoom_level, i) for i in positions]
+
+    return ['a.{}.{}.{}'.format(zoom_level, i, j) for i in positions for j in positions]
+
+def make_scenarios(tsinfo, dimensions, max_zoom, extent, center=0.4, pan_steps=16):
+    '''
+    The requests (lists of tile ids) of each scenario.
+    '''
+    zoom_level = max_zoom * 2 // 3
+
+    def position(z, size=1):
+        return int(extent(tsinfo, z) * center) - size // 2
+
+    return {
+        'single': [viewport(zoom_level, position(zoom_level), 1, dimensions,
+            extent(tsinfo, zoom_level))],
+        'bundle': [viewport(zoom_level, position(zoom_level, 4), 4, dimensions,
+            extent(tsinfo, zoom_level))],
+        'zoom_sweep': [viewport(z, position(z, 2), 2, dimensions, extent(tsinfo, z))
+            for z in range(max_zoom + 1)],
+        'pan_sequence': [viewport(zoom_level, position(zoom_level, 3) + i, 3, dimensions,
+            extent(tsinfo, zoom_level)) for i in range(pan_steps)],
+    }
+
+def summarize(latencies, num_tiles=None):
+    '''
+    The percentiles of a list of latencies (in seconds) and the
+    throughput, in milliseconds and tiles per second.
+    '''
+    latencies = np.array(latencies)
+
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'mean_ms': float(latencies.mean() * 1000),
+    }
+
+    if num_tiles is not None:
+        summary['tiles'] = num_tiles
+        summary['tiles_per_s'] = float(num_tiles / latencies.sum())
+
+    return summary
+
+def peak_rss_mb():
+    '''
+    The peak resident set size of this process.
+    '''
+    # unlike ru_maxrss, the high water mark in /proc isn't inherited from
+    # the parent process that this one was started from
+    if op.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes on linux
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 2 ** 10
+
+def get_fixture(filetype, fixtures_dir, scale):
+    '''
+    Write the tileset for a tile type, unless it was already written
+    to fixtures_dir by a previous run.
+    '''
+    directory = op.join(fixtures_dir, '{}-{}'.format(filetype, scale))
+    done_path = op.join(directory, 'fixture')
+
+    if op.exists(done_path):
+        with open(done_path, 'r') as f:
+            return op.join(directory, f.read())
+
+    os.makedirs(directory, exist_ok=True)
+    filepath = filetypes[filetype][0](directory, scale)
+
+    with open(done_path, 'w') as f:
+        f.write(op.basename(filepath))
+
+    return filepath
+
+def time_filetype(filetype, filepath, repeats):
+    '''
+    Time one tile type. This runs in a fresh process (see `main`)
+    so that the peak RSS only covers this tile type.
+    '''
+    (make_fixture, dimensions, tileset_info, tiles, max_zoom, extent) = filetypes[filetype]
+
+    # the first call opens the file and fills any caches
+    t1 = time.perf_counter()
+    tsinfo = tileset_info(filepath)
+    first_ms = (time.perf_counter() - t1) * 1000
+
+    latencies = []
+    for i in range(repeats):
+        t1 = time.perf_counter()
+        tileset_info(filepath)
+        latencies += [time.perf_counter() - t1]
+
+    result = {
+        'tileset_info': dict(summarize(latencies), first_ms=first_ms),
+        'scenarios': {}
+    }
+
+    for name, requests in make_scenarios(tsinfo, dimensions, max_zoom(tsinfo),
+            extent).items():
+        latencies = []
+        num_tiles = 0
+
+        for i in range(repeats):
+            for tile_ids in requests:
+                t1 = time.perf_counter()
+                returned = tiles(filepath, tile_ids)
+                latencies += [time.perf_counter() - t1]
+                num_tiles += len(returned)
+
+        result['scenarios'][name] = summarize(latencies, num_tiles)
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def compare(results, previous, threshold):
+    '''
+    The scenarios whose median latency grew by more than threshold times.
+
+    Returns
+    -------
+    regressions: [(filetype, scenario, previous_p50_ms, p50_ms),...]
+    '''
+    regressions = []
+
+    for filetype, result in results['results'].items():
+        previous_result = previous['results'].get(filetype, {})
+
+        timings = dict(result.get('scenarios', {}), tileset_info=result.get('tileset_info'))
+        previous_timings = dict(previous_result.get('scenarios', {}),
+                tileset_info=previous_result.get('tileset_info'))
+
+        for name, timing in timings.items():
+            previous_timing = previous_timings.get(name)
+
+            if timing is None or previous_timing is None:
+                continue
+            if timing['p50_ms'] > previous_timing['p50_ms'] * threshold:
+                regressions += [(filetype, name, previous_timing['p50_ms'], timing['p50_ms'])]
+
+    return regressions
+
+def package_versions():
+    versions = {'python': platform.python_version()}
+
+    for package in ['hgtiles', 'numpy', 'pandas', 'h5py', 'pybbi']:
+        versions[package] = None
+
+        if importlib_metadata is not None:
+            try:
+                versions[package] = importlib_metadata.version(package)
+            except importlib_metadata.PackageNotFoundError:
+                pass
+
+    # the commit being benchmarked, when running from a checkout
+    try:
+        versions['git'] = subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                cwd=op.dirname(op.abspath(__file__)), stderr=subprocess.DEVNULL,
+                universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        versions['git'] = None
+
+    return versions
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Time tileset_info and tiles on synthetic tilesets')
+    parser.add_argument('--filetypes', default=','.join(filetypes),
+            help='A comma separated list of tile types (default: all of them)')
+    parser.add_argument('--repeats', type=int, default=20,
+            help='The number of times each scenario is repeated')
+    parser.add_argument('--scale', type=float, default=1,
+            help='A factor applied to the size of the synthetic tilesets')
+    parser.add_argument('--fixtures-dir', default=None,
+            help='Where to write the tilesets, which are reused if they '
+            'already exist (default: a temporary directory)')
+    parser.add_argument('-o', '--output', default=None,
+            help='The JSON results file (default: stdout)')
+    parser.add_argument('--compare', default=None,
+            help='A previous results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25,
+            help='The slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    temp_dir = None
+    fixtures_dir = args.fixtures_dir
+
+    if fixtures_dir is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        fixtures_dir = temp_dir.name
+
+    results = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'versions': package_versions(),
+        'repeats': args.repeats,
+        'scale': args.scale,
+        'results': {}
+    }
+
+    try:
+        for filetype in args.filetypes.split(','):
+            try:
+                t1 = time.perf_counter()
+                filepath = get_fixture(filetype, fixtures_dir, args.scale)
+                fixture_s = time.perf_counter() - t1
+            except ImportError as ex:
+                # e.g. pyBigWig, which is only needed to write bigWig files
+                print('Skipping {}: {}'.format(filetype, ex), file=sys.stderr)
+                results['results'][filetype] = {'skipped': str(ex)}
+                continue
+
+            with cf.ProcessPoolExecutor(max_workers=1,
+                    mp_context=mp.get_context('spawn')) as executor:
+                result = executor.submit(time_filetype, filetype, filepath,
+                        args.repeats).result()
+
+            result['fixture'] = {
+                'file': op.basename(filepath),
+                'bytes': os.path.getsize(filepath),
+                'build_s': fixture_s
+            }
+            results['results'][filetype] = result
+
+            print('{:10s} {}'.format(filetype, '  '.join('{} {:.2f}/{:.2f}ms'.format(
+                name, s['p50_ms'], s['p99_ms']) for name, s in result['scenarios'].items())),
+                file=sys.stderr)
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        for (filetype, name, previous_ms, ms) in regressions:
+            print('Regression: {} {} {:.2f}ms -> {:.2f}ms'.format(
+                filetype, name, previous_ms, ms), file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
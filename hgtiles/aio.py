@@ -0,0 +1,181 @@
+import asyncio
+import collections as col
+import concurrent.futures as cf
+import functools as ft
+import hgtiles.utils as hgut
+
+# the maximum number of threads that blocking tile
+# generation is pushed onto
+MAX_WORKERS = 8
+
+global executor
+executor = None
+
+def get_executor():
+    '''
+    Get the default executor for tile generation, creating it if necessary.
+    '''
+    global executor
+
+    if executor is None:
+        executor = cf.ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+    return executor
+
+async def run_in_executor(function, *args, executor=None):
+    '''
+    Run a blocking function (e.g. a `tileset_info` function) on an
+    executor without blocking the event loop.
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor or get_executor(),
+            ft.partial(function, *args))
+
+def group_tile_ids(tile_ids):
+    '''
+    Group tile ids into sets of adjacent tiles with the same zoom level
+    and any extra parts (e.g. a transform type or `|` options), so that
+    each group can be generated with one call to a tiles function.
+
+    Parameters
+    ----------
+    tile_ids: [str,...]
+        A list of tile ids (e.g. xyz.0.1 or xyz.0.1.2.default|cos:abc)
+
+    Returns
+    -------
+    tile_groups: [[str,...],...]
+        A list of tile id lists
+    '''
+    # tile ids without options, grouped by everything but their position
+    grouped_ids = col.OrderedDict()
+    # the original tile ids for each tile id without options
+    original_ids = col.defaultdict(list)
+
+    for tile_id in tile_ids:
+        tile_no_options = tile_id.split('|')[0]
+        options = tile_id.split('|')[1:]
+        parts = tile_no_options.split('.')
+
+        dimension = 0
+        while 2 + dimension < len(parts) and parts[2 + dimension].isdigit():
+            dimension += 1
+
+        key = (parts[0], parts[1], dimension,
+                tuple(parts[2 + dimension:]), tuple(options))
+        id_key = (key, tile_no_options)
+
+        if id_key not in original_ids:
+            grouped_ids.setdefault(key, []).append(tile_no_options)
+        original_ids[id_key].append(tile_id)
+
+    tile_groups = []
+    for key, ids in grouped_ids.items():
+        dimension = key[2]
+
+        if dimension == 0:
+            partitioned = [ids]
+        else:
+            partitioned = hgut.partition_by_adjacent_tiles(ids, dimension)
+
+        for partition in partitioned:
+            tile_groups += [[original_id for tile_id in partition
+                for original_id in original_ids[(key, tile_id)]]]
+
+    return tile_groups
+
+async def iter_tiles(tiles_function, filepath, tile_ids, executor=None):
+    '''
+    Generate tiles without blocking the event loop, yielding each tile
+    as soon as the group of adjacent tiles that it belongs to is done.
+
+    If the consumer stops iterating (e.g. because the task consuming the
+    tiles is cancelled when the browser abandons a viewport), tile groups
+    that haven't started yet are cancelled.
+
+    Parameters
+    ----------
+    tiles_function: function(filepath, tile_ids)
+        The blocking function that generates tiles
+        (e.g. `hgtiles.hitile.tiles`)
+    filepath: str
+        The file to generate tiles from
+    tile_ids: [str,...]
+        A list of tile ids
+    executor: concurrent.futures.Executor
+        The executor to generate tiles on. Defaults to a shared thread
+        pool with MAX_WORKERS threads.
+
+    Yields
+    ------
+    (tile_id, tile_value)
+    '''
+    loop = asyncio.get_running_loop()
+    executor = executor or get_executor()
+
+    futures = [loop.run_in_executor(executor, tiles_function, filepath, tile_group)
+            for tile_group in group_tile_ids(tile_ids)]
+
+    try:
+        for future in asyncio.as_completed(futures):
+            for tile in await future:
+                yield tile
+    finally:
+        for future in futures:
+            future.cancel()
+
+def cooler_tiles(filepath, tile_ids, executor=None):
+    import hgtiles.cooler as hgco
+
+    return iter_tiles(hgco.tiles, filepath, tile_ids, executor)
+
+def bigwig_tiles(bwpath, tile_ids, chromsizes_map={}, chromsizes=None,
+        envelope=False, executor=None):
+    import hgtiles.bigwig as hgbi
+
+    return iter_tiles(ft.partial(hgbi.tiles, chromsizes_map=chromsizes_map,
+        chromsizes=chromsizes, envelope=envelope), bwpath, tile_ids, executor)
+
+def hitile_tiles(filepath, tile_ids, executor=None):
+    import hgtiles.hitile as hghi
+
+    return iter_tiles(hghi.tiles, filepath, tile_ids, executor)
+
+def beddb_tiles(filepath, tile_ids, executor=None):
+    import hgtiles.beddb as hgbe
+
+    return iter_tiles(hgbe.tiles, filepath, tile_ids, executor)
+
+def multivec_tiles(filepath, tile_ids, rows=None, row_groups=None, executor=None):
+    import hgtiles.multivec as hgmu
+
+    return iter_tiles(ft.partial(hgmu.tiles, rows=rows, row_groups=row_groups),
+            filepath, tile_ids, executor)
+
+def imtiles_tiles(filepath, tile_ids, raw=False, executor=None):
+    import hgtiles.imtiles as hgim
+
+    return iter_tiles(ft.partial(hgim.get_tiles, raw=raw), filepath, tile_ids, executor)
+
+def geo_tiles(filepath, tile_ids, executor=None):
+    return iter_tiles(geo_tiles_by_id, filepath, tile_ids, executor)
+
+def geo_tiles_by_id(db_file, tile_ids):
+    '''
+    Retrieve a group of adjacent geo tiles (see `hgtiles.geo.get_tiles`)
+    by their tile ids.
+    '''
+    import hgtiles.geo as hgge
+
+    positions = [list(map(int, tile_id.split('.')[1:4])) for tile_id in tile_ids]
+
+    zoom = positions[0][0]
+    minx = min(p[1] for p in positions)
+    maxx = max(p[1] for p in positions)
+    miny = min(p[2] for p in positions)
+    maxy = max(p[2] for p in positions)
+
+    rows = hgge.get_tiles(db_file, zoom, minx, miny,
+            maxx - minx + 1, maxy - miny + 1)
+
+    return [(tile_id, rows[(p[1], p[2])]) for (tile_id, p) in zip(tile_ids, positions)]
@@ -1,6 +1,12 @@
 import collections as col
+import hgtiles.format as hgfo
+import numpy as np
 import sqlite3 
 
+# the numeric values of each interval, for columnar tiles
+# (see `hgtiles.format.format_columnar_tile`)
+COLUMNS = ('xStart', 'xEnd', 'yStart', 'yEnd', 'chrOffset', 'importance')
+
 def get_2d_tileset_info(db_file):
     conn = sqlite3.connect(db_file)
     c = conn.cursor()
@@ -22,7 +28,7 @@ def get_2d_tileset_info(db_file):
 
     return tileset_info
 
-def get_1D_tiles(db_file, tile_ids):
+def get_1D_tiles(db_file, zoom, tile_x_pos, numx=1):
     '''
     Retrieve a contiguous set of tiles from a 2D db tile file.
 
@@ -106,7 +112,7 @@ def get_1D_tiles(db_file, tile_ids):
 
     return new_rows
 
-def get_2D_tiles(db_file, zoom, tile_x_pos, tile_y_pos, numx=1, numy=1):
+def get_2D_tiles(db_file, zoom, tile_x_pos, tile_y_pos, numx=1, numy=1, columnar=False):
     '''
     Retrieve a contiguous set of tiles from a 2D db tile file.
 
@@ -124,6 +130,10 @@ def get_2D_tiles(db_file, zoom, tile_x_pos, tile_y_pos, numx=1, numy=1):
         The width of the block of tiles to retrieve
     numy: int
         The height of the block of tiles to retrieve
+    columnar: bool or 'binary'
+        Return each tile as parallel arrays rather than a list of
+        dicts (see `hgtiles.format.format_columnar_tile`). If 'binary',
+        the arrays are base64 encoded.
 
     Returns
     -------
@@ -163,6 +173,11 @@ def get_2D_tiles(db_file, zoom, tile_x_pos, tile_y_pos, numx=1, numy=1):
 
     rows = c.execute(query).fetchall()
 
+    if columnar:
+        conn.close()
+        return format_columnar_tiles(rows, tile_width, tile_x_pos, tile_y_pos,
+                numx, numy, binary=(columnar == 'binary'))
+
     new_rows = col.defaultdict(list)
 
     for r in rows:
@@ -203,3 +218,31 @@ def get_2D_tiles(db_file, zoom, tile_x_pos, tile_y_pos, numx=1, numy=1):
     conn.close()
 
     return new_rows
+
+def format_columnar_tiles(rows, tile_width, tile_x_pos, tile_y_pos, numx, numy,
+        binary=False):
+    '''
+    Format a block of tiles as parallel arrays (see
+    `hgtiles.format.format_columnar_rows`) directly from the rows
+    returned by the query in `get_2D_tiles`.
+    '''
+    (x_starts, x_ends, y_starts, y_ends, chr_offsets, importances, fields, uids) = (
+            zip(*rows) if rows else [()] * 8)
+
+    columns = dict(zip(COLUMNS, map(np.array,
+        [x_starts, x_ends, y_starts, y_ends, chr_offsets, importances])))
+
+    # the same overlap test as for tiles of dicts
+    tile_rows = {}
+    for i in range(tile_x_pos, tile_x_pos + numx):
+        in_x = ((columns['xStart'] < (i+1) * tile_width) &
+                (columns['xEnd'] >= i * tile_width))
+
+        for j in range(tile_y_pos, tile_y_pos + numy):
+            tile_rows[(i, j)] = np.flatnonzero(in_x &
+                    (columns['yStart'] < (j+1) * tile_width) &
+                    (columns['yEnd'] >= j * tile_width))
+
+    return hgfo.format_columnar_rows(tile_rows, columns,
+            [u.decode('utf-8') if isinstance(u, bytes) else u for u in uids],
+            fields=fields, binary=binary)
@@ -1,12 +1,60 @@
 import collections as col
-import math
+import hgtiles.cache as hgca
+import hgtiles.format as hgfo
+import hgtiles.utils as hgut
+import numpy as np
+import os.path as op
 import sqlite3
+import threading
+import urllib.request
 
-def tileset_info(db_file):
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
+# the maximum number of open connections, across all files and threads
+MAX_CONNECTIONS = 64
+
+# the number of bytes of each database file to memory map
+MMAP_SIZE = 256 * 1024 * 1024
+
+# the numeric values of each interval, for columnar tiles
+# (see `hgtiles.format.format_columnar_tile`)
+COLUMNS = ('xStart', 'xEnd', 'chrOffset', 'importance')
+
+def connect(key):
+    '''
+    Open a read-only connection to a db file.
+
+    Parameters
+    ----------
+    key: (str, int)
+        The filename of the sqlite db file and the id of the
+        thread that will use the connection
+    '''
+    db_file = key[0]
+    uri = 'file:{}?mode=ro&immutable=1'.format(
+            urllib.request.pathname2url(op.abspath(db_file)))
+
+    # the connection is only used by one thread at a time, but
+    # may be closed by another thread when it's evicted
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute('PRAGMA mmap_size={}'.format(int(MMAP_SIZE)))
+
+    return conn
+
+# open connections indexed by (filename, thread id)
+connections = hgca.HandleCache(connect, max_size=MAX_CONNECTIONS)
+
+def get_connection(db_file):
+    '''
+    Use this thread's connection to a db file, which won't be
+    closed until the block exits.
+
+    Usage: `with get_connection(db_file) as conn: ...`
+    '''
+    return connections.acquire((db_file, threading.get_ident()))
+
+def load_tileset_info(db_file):
+    with get_connection(db_file) as conn:
+        row = conn.execute("SELECT * from tileset_info").fetchone();
 
-    row = c.execute("SELECT * from tileset_info").fetchone();
     if row is not None and len(row) == 9:
         header = row[8]
     else:
@@ -25,58 +73,303 @@ def tileset_info(db_file):
             "max_pos": [row[1]],
             "header": header
             }
-    conn.close()
 
     return ts_info
 
-def tiles(filepath, tile_ids):
+# tileset info indexed by filename
+tileset_infos = hgca.HandleCache(load_tileset_info, max_size=MAX_CONNECTIONS)
+
+def tileset_info(db_file):
+    return dict(tileset_infos.get(db_file))
+
+def tiles(filepath, tile_ids, columnar=False, max_per_tile=None):
     '''
     Generate tiles from this dataset.
 
+    Tiles at the same zoom level with consecutive positions are
+    retrieved with a single query (see `get_tiles`).
+
     Parameters
     ----------
     filepath: str
         The filename of the sqlite db file
     tile_ids: [str...]
         A list of tile ids of the form
+    columnar: bool or 'binary'
+        Return each tile as parallel arrays rather than a list of
+        dicts (see `hgtiles.format.format_columnar_tile`). If 'binary',
+        the arrays are base64 encoded.
+    max_per_tile: int
+        Only return the most important intervals in each tile
 
     Returns
     -------
     tiles: [(tile_id, tile_value),...]
         A list of values indexed by the tile position
     '''
-    to_return = []
+    tile_positions = []
+    positions_by_zoom = col.defaultdict(list)
 
-    for  tile_id in tile_ids:
-        tile_option_parts = tile_id.split('|')[1:]
+    for tile_id in tile_ids:
         tile_no_options = tile_id.split('|')[0]
         parts = tile_no_options.split('.')
 
-        uuid = parts[0]
         zoom = int(parts[1])
         xpos = int(parts[2])
 
-        extra_zoom = 0
-        new_rows = {}
-        new_rows = []
+        tile_positions += [(zoom, xpos)]
+        positions_by_zoom[zoom] += [xpos]
 
-        for j in range(2 ** extra_zoom):
-            # the old rows are indexed by the higher
-            # resolution tile numbers
-            higher_xpos = 2 ** extra_zoom * xpos + j
-            old_rows = get_1D_tiles(filepath, 
-                    zoom + extra_zoom, 
-                    higher_xpos)
-            new_rows += old_rows
-                
-        # print("new_rows length", len(new_rows))
-        to_return += [(tile_id, new_rows)]
+    tile_values = {}
 
-    return to_return
+    for zoom, positions in positions_by_zoom.items():
+        for (tile_x_pos, num_tiles) in hgut.consecutive_runs(positions):
+            tile_rows = get_tiles(filepath, zoom, tile_x_pos, num_tiles,
+                    columnar, max_per_tile)
 
-def get_1D_tiles(db_file, zoom, tile_x_pos, num_tiles=1):
+            for xpos in range(tile_x_pos, tile_x_pos + num_tiles):
+                tile_values[(zoom, xpos)] = tile_rows[xpos]
+
+    return [(tile_id, tile_values[pos]) for (tile_id, pos) in zip(tile_ids, tile_positions)]
+
+def fetch_rows(db_file, zoom, start_pos, end_pos, max_entries=None):
     '''
-    Retrieve a contiguous set of tiles from a db tile file.
+    Retrieve the intervals visible at a zoom level which
+    overlap a region.
+
+    Parameters
+    ----------
+    db_file: str
+        The filename of the sqlite db file
+    zoom: int
+        The zoom level
+    start_pos: float
+        The start of the region
+    end_pos: float
+        The end of the region
+    max_entries: int
+        The maximum number of intervals to return. If given, the
+        most important intervals are returned first.
+
+    Returns
+    -------
+    rows: [tuple,...]
+        The (startPos, endPos, chrOffset, importance, fields, uid)
+        of each interval
+    '''
+    query = '''
+    SELECT startPos, endPos, chrOffset, importance, fields, uid
+    FROM intervals,position_index
+    WHERE
+        intervals.id=position_index.id AND
+        zoomLevel <= ? AND
+        rEndPos >= ? AND
+        rStartPos <= ?
+    '''
+    params = (zoom, start_pos, end_pos)
+
+    if max_entries is not None:
+        query += ' ORDER BY importance DESC LIMIT ?'
+        params += (max_entries,)
+
+    with get_connection(db_file) as conn:
+        return conn.execute(query, params).fetchall()
+
+def load_index_info(db_file):
+    '''
+    Check whether a db file has an importance index (see
+    `create_importance_index`) and count its intervals.
+    '''
+    with get_connection(db_file) as conn:
+        has_index = conn.execute('''
+        SELECT COUNT(*) FROM sqlite_master
+        WHERE type='index' AND name='intervals_importance'
+        ''').fetchone()[0] > 0
+
+        num_intervals = conn.execute('SELECT COUNT(*) FROM intervals').fetchone()[0]
+
+    return {'importance_index': has_index, 'num_intervals': num_intervals}
+
+# importance index info indexed by filename
+index_infos = hgca.HandleCache(load_index_info, max_size=MAX_CONNECTIONS)
+
+def fetch_top_rows(db_file, zoom, tile_width, tile_x_pos, max_entries):
+    '''
+    Retrieve the most important intervals in a tile.
+
+    Unlike `fetch_rows`, only intervals which overlap the tile by
+    the same test as `tile_ranges` are returned, so that none of
+    the max_entries are taken up by intervals outside the tile.
+
+    If the file has an importance index, wide tiles are retrieved by
+    scanning intervals in order of importance until max_entries are
+    found. Scanning the position index and sorting the intervals in
+    the tile is faster when the tile covers a fraction of the data
+    smaller than sqrt(max_entries / num_intervals).
+
+    Parameters
+    ----------
+    db_file: str
+        The filename of the sqlite db file
+    zoom: int
+        The zoom level
+    tile_width: float
+        The width of each tile
+    tile_x_pos: int
+        The position of the tile
+    max_entries: int
+        The maximum number of intervals to return
+
+    Returns
+    -------
+    rows: [tuple,...]
+        The (startPos, endPos, chrOffset, importance, fields, uid)
+        of each interval, in order of decreasing importance
+    '''
+    tile_start_pos = tile_x_pos * tile_width
+    tile_end_pos = (tile_x_pos + 1) * tile_width
+
+    index_info = index_infos.get(db_file)
+    fraction = tile_width / tileset_info(db_file)['max_width']
+
+    if (index_info['importance_index'] and
+            fraction ** 2 * index_info['num_intervals'] > max_entries):
+        intervals_table = 'intervals INDEXED BY intervals_importance'
+    else:
+        intervals_table = 'intervals'
+
+    query = '''
+    SELECT startPos, endPos, chrOffset, importance, fields, uid
+    FROM {},position_index
+    WHERE
+        intervals.id=position_index.id AND
+        zoomLevel <= ? AND
+        rEndPos >= ? AND
+        rStartPos <= ? AND
+        startPos < ? AND
+        endPos >= ?
+    ORDER BY importance DESC
+    LIMIT ?
+    '''.format(intervals_table)
+    params = (zoom, tile_start_pos, tile_end_pos, tile_end_pos,
+            tile_start_pos, max_entries)
+
+    with get_connection(db_file) as conn:
+        return conn.execute(query, params).fetchall()
+
+def create_importance_index(db_file):
+    '''
+    Index the intervals in a db file by importance, so that sqlite
+    can find the most important intervals in a region (see
+    `fetch_top_rows`) without sorting every interval in it. This
+    modifies the file, so it should be run once after the file
+    is written.
+
+    Parameters
+    ----------
+    db_file: str
+        The filename of the sqlite db file
+    '''
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS intervals_importance
+    ON intervals (importance)
+    ''')
+    conn.commit()
+    conn.close()
+
+def decode_uid(uid):
+    try:
+        return uid.decode('utf-8')
+    except AttributeError:
+        return uid
+
+def row_to_dict(r):
+    '''
+    Convert a row returned by `fetch_rows` into the dict returned
+    in tiles, with the fields split into a list.
+    '''
+    return {'xStart': r[0],
+            'xEnd': r[1],
+            'chrOffset': r[2],
+            'importance': r[3],
+            'uid': decode_uid(r[5]),
+            'fields': r[4].split('\t')}
+
+def query_rows(db_file, zoom, start_pos, end_pos, max_entries=None):
+    '''
+    Retrieve the intervals visible at a zoom level which overlap a
+    region (see `fetch_rows`) as dicts.
+    '''
+    return [row_to_dict(r) for r in
+            fetch_rows(db_file, zoom, start_pos, end_pos, max_entries)]
+
+def tile_ranges(rows, tile_width, tile_x_pos, num_tiles):
+    '''
+    Find the range of tiles that each interval overlaps.
+
+    Parameters
+    ----------
+    rows: [tuple,...]
+        The intervals, as returned by `fetch_rows`
+    tile_width: float
+        The width of each tile
+    tile_x_pos: int
+        The position of the first tile
+    num_tiles: int
+        The number of tiles
+
+    Returns
+    -------
+    (lo, hi): (np.array, np.array)
+        The first and last tile overlapped by each interval. Intervals
+        which don't overlap any of the tiles have lo > hi.
+    '''
+    starts = np.array([r[0] for r in rows], dtype=np.float64)
+    ends = np.array([r[1] for r in rows], dtype=np.float64)
+
+    # an interval overlaps tile i if
+    # start < (i+1) * tile_width and end >= i * tile_width
+    lo = np.floor(starts / tile_width).astype(np.int64)
+    hi = np.floor(ends / tile_width).astype(np.int64)
+
+    # correct for any rounding in the division so that the
+    # boundaries match the comparisons above
+    lo -= (lo * tile_width > starts)
+    lo += ((lo + 1) * tile_width <= starts)
+    hi += ((hi + 1) * tile_width <= ends)
+    hi -= (hi * tile_width > ends)
+
+    lo = np.maximum(lo, tile_x_pos)
+    hi = np.minimum(hi, tile_x_pos + num_tiles - 1)
+
+    return (lo, hi)
+
+def format_columnar_tiles(rows, lo, hi, tile_x_pos, num_tiles, binary=False):
+    '''
+    Format a set of tiles as parallel arrays (see
+    `hgtiles.format.format_columnar_rows`) directly from the
+    rows returned by `fetch_rows`, without creating a dict per row.
+    '''
+    (starts, ends, chr_offsets, importances, field_strings, uid_values) = (
+            zip(*rows) if rows else [()] * 6)
+
+    columns = {
+        'xStart': np.array(starts),
+        'xEnd': np.array(ends),
+        'chrOffset': np.array(chr_offsets),
+        'importance': np.array(importances),
+    }
+
+    return hgfo.format_columnar_rows({pos: np.flatnonzero((lo <= pos) & (hi >= pos))
+        for pos in range(tile_x_pos, tile_x_pos + num_tiles)}, columns,
+        [decode_uid(u) for u in uid_values], fields=field_strings, binary=binary)
+
+def get_tiles(db_file, zoom, tile_x_pos, num_tiles=1, columnar=False, max_per_tile=None):
+    '''
+    Retrieve a contiguous set of tiles from a db tile file using
+    a single query. Intervals which span more than one tile are only
+    parsed once and the same dict is included in every tile.
 
     Parameters
     ----------
@@ -88,6 +381,13 @@ def get_1D_tiles(db_file, zoom, tile_x_pos, num_tiles=1):
         The position of the first tile
     num_tiles: int
         The number of tiles to retrieve
+    columnar: bool or 'binary'
+        Return each tile in columnar format
+        (see `hgtiles.format.format_columnar_tile`)
+    max_per_tile: int
+        Only return the max_per_tile most important intervals in
+        each tile, in order of decreasing importance. Each tile is
+        then retrieved with its own query (see `fetch_top_rows`).
 
     Returns
     -------
@@ -95,57 +395,79 @@ def get_1D_tiles(db_file, zoom, tile_x_pos, num_tiles=1):
         A set of tiles, indexed by position
     '''
     ts_info = tileset_info(db_file)
-    conn = sqlite3.connect(db_file)
-
-    c = conn.cursor()
 
     tile_width = ts_info['max_width'] / 2 ** zoom
 
     tile_start_pos = tile_width * tile_x_pos
     tile_end_pos = tile_start_pos + num_tiles * tile_width
 
-    query = '''
-    SELECT startPos, endPos, chrOffset, importance, fields, uid
-    FROM intervals,position_index
-    WHERE
-        intervals.id=position_index.id AND
-        zoomLevel <= {} AND
-        rEndPos >= {} AND
-        rStartPos <= {}
-    '''.format(zoom, tile_start_pos, tile_end_pos)
+    if max_per_tile is not None:
+        rows = []
+        positions = []
+
+        for pos in range(tile_x_pos, tile_x_pos + num_tiles):
+            tile_rows = fetch_top_rows(db_file, zoom, tile_width, pos, max_per_tile)
+
+            rows += tile_rows
+            positions += [pos] * len(tile_rows)
+
+        lo = hi = np.array(positions, dtype=np.int64)
+    else:
+        rows = fetch_rows(db_file, zoom, tile_start_pos, tile_end_pos)
+        (lo, hi) = tile_ranges(rows, tile_width, tile_x_pos, num_tiles)
+
+    if columnar:
+        return format_columnar_tiles(rows, lo, hi, tile_x_pos, num_tiles,
+                binary=(columnar == 'binary'))
+
+    new_rows = col.defaultdict(list)
+
+    for (r, row_lo, row_hi) in zip(rows, lo.tolist(), hi.tolist()):
+        if row_lo > row_hi:
+            continue
+
+        row = row_to_dict(r)
+        for i in range(row_lo, row_hi + 1):
+            new_rows[i] += [row]
+
+    return new_rows
+
+def get_1D_tiles(db_file, zoom, tile_x_pos, num_tiles=1):
+    '''
+    Retrieve a contiguous set of tiles from a db tile file.
+
+    Parameters
+    ----------
+    db_file: str
+        The filename of the sqlite db file
+    zoom: int
+        The zoom level
+    tile_x_pos: int
+        The position of the first tile
+    num_tiles: int
+        The number of tiles to retrieve
+
+    Returns
+    -------
+    rows: [dict,...]
+        The intervals in the tiles. Intervals which span
+        more than one tile are repeated once per tile.
+    '''
+    ts_info = tileset_info(db_file)
+
+    tile_width = ts_info['max_width'] / 2 ** zoom
+
+    tile_start_pos = tile_width * tile_x_pos
+    tile_end_pos = tile_start_pos + num_tiles * tile_width
 
-    rows = c.execute(query).fetchall()
+    rows = fetch_rows(db_file, zoom, tile_start_pos, tile_end_pos)
+    (lo, hi) = tile_ranges(rows, tile_width, tile_x_pos, num_tiles)
 
     new_rows = []
 
-    for r in rows:
-        try:
-            uid = r[5].decode('utf-8')
-        except AttributeError:
-            uid = r[5]
-
-        tile_pos = (
-            tile_x_pos + math.floor((r[0] - tile_start_pos) / tile_width)
-        )
-
-        x_start = r[0]
-        x_end = r[1]
-
-        for i in range(tile_x_pos, tile_x_pos + num_tiles):
-            tile_x_start = i * tile_width
-            tile_x_end = (i+1) * tile_width
-            tile_pos = i
-
-            if x_start < tile_x_end and x_end >= tile_x_start:
-                new_rows += [
-                    # add the position offset to the returned values
-                    {'xStart': r[0],
-                     'xEnd': r[1],
-                     'chrOffset': r[2],
-                     'importance': r[3],
-                     'uid': uid,
-                     'fields': r[4].split('\t')}]
-    conn.close()
+    for (r, row_lo, row_hi) in zip(rows, lo.tolist(), hi.tolist()):
+        for i in range(row_lo, row_hi + 1):
+            new_rows += [row_to_dict(r)]
 
     return new_rows
 
@@ -162,47 +484,11 @@ def list_items(db_file, start, end, max_entries=None):
     end_pos: int
         The end position to get data
     max_entries: int
-        The maximum number of results to return
+        The maximum number of results to return. The most
+        important entries are returned first.
     '''
 
-    conn = sqlite3.connect(db_file)
-
-    c = conn.cursor()
-
     # some large number because we want to extract all entries
     zoom = 100000
 
-    query = '''
-    SELECT startPos, endPos, chrOffset, importance, fields, uid
-    FROM intervals,position_index
-    WHERE
-        intervals.id=position_index.id AND
-        zoomLevel <= {} AND
-        rEndPos >= {} AND
-        rStartPos <= {}
-    '''.format(zoom, start, end)
-
-    if max_entries is not None:
-        query += ' LIMIT {}'.format(max_entries)
-
-    rows = c.execute(query).fetchall()
-
-    new_rows = []
-
-    for r in rows:
-        try:
-            uid = r[5].decode('utf-8')
-        except AttributeError:
-            uid = r[5]
-
-        new_rows += [
-            # add the position offset to the returned values
-            {'xStart': r[0],
-             'xEnd': r[1],
-             'chrOffset': r[2],
-             'importance': r[3],
-             'uid': uid,
-             'fields': r[4].split('\t')}]
-    conn.close()
-
-    return new_rows
+    return query_rows(db_file, zoom, start, end, max_entries)
@@ -1,7 +1,11 @@
 import bbi
+import collections as col
 import cooler
 import functools as ft
+import hgtiles.bigwig_summary as hgbs
+import hgtiles.cache as hgca
 import hgtiles.format as hgfo
+import hgtiles.utils as hgut
 import logging
 import numpy as np
 import pandas as pd
@@ -10,6 +14,9 @@ import time
 
 TILE_SIZE = 1024
 
+# the number of bigWig files whose chromosome sizes are kept in memory
+MAX_CACHED_FILES = 256
+
 logger = logging.getLogger(__name__)
 
 def get_quadtree_depth(chromsizes):
@@ -60,23 +67,87 @@ def natcmp(x, y):
     else:
         return 0
 
+def natcmp_key(s, _NS_REGEX=re.compile(r'(\d+)', re.U)):
+    '''
+    A key function which orders chromosome names the same way as
+    `natcmp`, but splits each name only once.
+
+    The key is a flat tuple, which is much faster to compare than a
+    tuple of tuples: (is alternate contig, is chrM, type of the first
+    part, first part, type of the second part, second part...). Each
+    part is preceded by its type so that numbers and strings can be
+    compared (numbers first) where `natcmp` raises a TypeError
+    (e.g. '1' vs 'X').
+    '''
+    is_alt = s.find('_') >= 0
+    if is_alt:
+        # alternate contigs (chr1_random) come after the others
+        # and are ordered by the part after the first underscore
+        s = s.split('_')[1]
+
+    # chrM goes at the end of the non alternate contigs
+    if s == 'chrM':
+        return (is_alt, True)
+
+    key = [is_alt, False]
+    for x in _NS_REGEX.split(s):
+        if x.isdigit():
+            key += [0, int(x)]
+        elif x:
+            key += [1, x]
+
+    return tuple(key)
+
 def natsorted(iterable):
-    return sorted(iterable, key=ft.cmp_to_key(natcmp))
+    return sorted(iterable, key=natcmp_key)
+
+def load_chromsizes(bwpath):
+    '''
+    Read the chromosome sizes from a bigWig file, order them naturally
+    and calculate the absolute offset of each chromosome.
+
+    Parameters
+    ----------
+    bwpath: string
+        The path to the bigwig file
+
+    Returns
+    -------
+    (chromsizes, abs_chrom_offsets): (pd.Series, np.array)
+        The chromosome sizes indexed by chromosome name and the
+        absolute start position of each chromosome followed by the
+        total length of the genome
+    '''
+    chromsizes = bbi.chromsizes(bwpath)
+    chromosomes = natsorted(chromsizes.keys())
+    chrom_series = pd.Series(chromsizes)[chromosomes]
+    return (chrom_series, get_chrom_offsets(chrom_series))
+
+# naturally sorted chromsizes and chromosome offsets
+# indexed by filepath
+chromsizes_cache = hgca.HandleCache(load_chromsizes, max_size=MAX_CACHED_FILES)
 
 def get_chromsizes(bwpath):
     """
     TODO: replace this with negspy
     
     Also, return NaNs from any missing chromosomes in bbi.fetch
-    
+
+    The returned series is cached and shared between callers so
+    it shouldn't be modified.
     """
-    chromsizes = bbi.chromsizes(bwpath)
-    chromosomes = natsorted(chromsizes.keys())
-    chrom_series = pd.Series(chromsizes)[chromosomes]
-    return chrom_series
+    return chromsizes_cache.get(bwpath)[0]
 
-def abs2genomic(chromsizes, start_pos, end_pos):
-    abs_chrom_offsets = np.r_[0, np.cumsum(chromsizes.values)]
+def get_chrom_offsets(chromsizes):
+    '''
+    The absolute start position of each chromosome followed
+    by the total length of the genome.
+    '''
+    return np.r_[0, np.cumsum(chromsizes.values)]
+
+def abs2genomic(chromsizes, start_pos, end_pos, abs_chrom_offsets=None):
+    if abs_chrom_offsets is None:
+        abs_chrom_offsets = get_chrom_offsets(chromsizes)
     cid_lo, cid_hi = np.searchsorted(abs_chrom_offsets,
                                      [start_pos, end_pos],
                                      side='right') - 1
@@ -133,49 +204,227 @@ def tileset_info(bwpath, chromsizes=None):
     }
     return tileset_info
 
-def get_bigwig_tile(bwpath, zoom_level, start_pos, end_pos, chromsizes=None):
-    t1 = time.time()
+def fetch_summaries(bwfile, chrom, start, end, bins, summaries):
+    '''
+    Fetch several summaries of the same bins of a bigWig file.
+
+    bbi only returns one summary per fetch, so each summary is fetched
+    separately from the same open file and each region is read and
+    decompressed once per summary: an envelope tile takes 3-5 times
+    as long as a dense one. Summarizing a single read of the
+    intervals (`bbi.BBIFile.fetch_intervals`) instead is 3-5 times
+    slower still, since the intervals are converted to Python objects
+    before they can be binned. Tiles at the zoom levels stored in a
+    precomputed summary (see `hgtiles.bigwig_summary`) don't need to
+    be fetched at all.
+
+    Returns
+    -------
+    values: np.array
+        An array of shape (len(summaries), bins)
+    '''
+    return np.array([bwfile.fetch(chrom, start, end, bins=bins,
+        missing=np.nan, summary=summary) for summary in summaries])
+
+def fetch_bins(bwpath, bwfile, chrom, start, end, bins, summary):
+    '''
+    Fetch one summary (if summary is a string) or several summaries
+    (if it's a list, see `fetch_summaries`) of the bins in a region.
+    '''
+    if isinstance(summary, str):
+        if bwfile is None:
+            return bbi.fetch(bwpath, chrom, start, end, bins=bins,
+                    missing=np.nan, summary=summary)
+        return bwfile.fetch(chrom, start, end, bins=bins,
+                missing=np.nan, summary=summary)
+
+    if bwfile is None:
+        with bbi.open(bwpath) as bwfile:
+            return fetch_summaries(bwfile, chrom, start, end, bins, summary)
+    return fetch_summaries(bwfile, chrom, start, end, bins, summary)
+
+def empty_bins(bins, summary):
+    '''
+    NaN values for bins without any data.
+    '''
+    if isinstance(summary, str):
+        return np.full(bins, np.nan)
+    return np.full((len(summary), bins), np.nan)
+
+def get_bigwig_tile(bwpath, zoom_level, start_pos, end_pos, chromsizes=None,
+        abs_chrom_offsets=None, bwfile=None, summary='mean'):
+    '''
+    Get the values for the region between two absolute positions.
+
+    Parameters
+    ----------
+    bwpath: string
+        The path to the bigwig file from which to retrieve data
+    zoom_level: int
+        The zoom level, which determines the size of each bin
+    start_pos: int
+        The absolute start position of the region
+    end_pos: int
+        The absolute end position of the region
+    chromsizes: pd.Series
+        The chromosome sizes, indexed by chromosome name. Read from the
+        file if not provided.
+    abs_chrom_offsets: np.array
+        The absolute offsets of the chromosomes (see `get_chrom_offsets`).
+        Calculated from the chromsizes if not provided.
+    bwfile: bbi.BBIFile
+        An open bigwig file to fetch the data from. Otherwise the file
+        is opened for every chromosome in the region.
+    summary: string or [string,...]
+        How the values in each bin are summarized ('mean', 'min', 'max',
+        'cov' or 'std', see `bbi.fetch`), or a list of summaries to
+        retrieve together (see `fetch_summaries`)
+
+    Returns
+    -------
+    values: np.array
+        The values of the bins in this region, or an array of shape
+        (len(summary), num_bins) if a list of summaries was requested
+    '''
     if chromsizes is None:
-        chromsizes = get_chromsizes(bwpath)
-    t2 = time.time()
+        (chromsizes, abs_chrom_offsets) = chromsizes_cache.get(bwpath)
 
-    # print("chromosomes time:", t2 - t1)
     resolutions = get_zoom_resolutions(chromsizes)
     binsize = resolutions[zoom_level]
+
+    # the chromosomes that are actually in the file
+    file_chromsizes = chromsizes_cache.get(bwpath)[0]
    
     arrays = []
-    for cid, start, end in abs2genomic(chromsizes, start_pos, end_pos):
+    for cid, start, end in abs2genomic(chromsizes, start_pos, end_pos,
+            abs_chrom_offsets):
         n_bins = int(np.ceil((end - start) / binsize))
+
+        if cid < len(chromsizes):
+            chrom = chromsizes.index[cid]
+            clen = chromsizes.values[cid]
+
+            if chrom not in file_chromsizes.index:
+                # no need to fetch a chromosome that doesn't exist (e.g. chrM)
+                arrays.append(empty_bins(n_bins, summary))
+                continue
+
+            if n_bins == 1 and end == clen and clen % binsize != 0:
+                # the end of a contig smaller than one bin, whose only
+                # bin would be dropped below. Skipping the fetch saves
+                # thousands of them on zoomed out tiles of assemblies
+                # with many small scaffolds.
+                continue
+
         try:
             chrom = chromsizes.index[cid]
             clen = chromsizes.values[cid]
 
-            t1 = time.time()
             #print("fetching:", chrom, start, end, n_bins);
-            x = bbi.fetch(bwpath, chrom, start, end,
-                          bins=n_bins, missing=np.nan)
-            t2 = time.time()
+            x = fetch_bins(bwpath, bwfile, chrom, start, end, n_bins, summary)
 
             # drop the very last bin if it is smaller than the binsize
             if end == clen and clen % binsize != 0:
-                x = x[:-1]
+                x = x[..., :-1]
         except IndexError:
             # beyond the range of the available chromosomes
             # probably means we've requested a range of absolute
             # coordinates that stretch beyond the end of the genome
-            x = np.zeros(n_bins)
-            x[:] = np.nan
+            x = empty_bins(n_bins, summary)
         except KeyError:
             # probably requested a chromosome that doesn't exist (e.g. chrM)
-            x = np.zeros(n_bins)
-            x[:] = np.nan
+            x = empty_bins(n_bins, summary)
 
         arrays.append(x)
 
-    return np.concatenate(arrays)
+    return np.concatenate(arrays, axis=-1)
+
 
+def get_bigwig_tiles(bwpath, zoom_level, tile_x_pos, num_tiles, chromsizes=None,
+        abs_chrom_offsets=None, bwfile=None, summary='mean'):
+    '''
+    Get the values for a run of consecutive tiles.
+
+    Tiles that lie entirely within one chromosome are fetched together
+    with the other tiles in the run that lie in the same chromosome,
+    using a single fetch that is then split into tiles. Tiles that span
+    more than one chromosome are fetched individually so that their bins
+    are identical to those returned by `get_bigwig_tile`.
+
+    Parameters
+    ----------
+    bwpath: string
+        The path to the bigwig file from which to retrieve data
+    zoom_level: int
+        The zoom level of the tiles
+    tile_x_pos: int
+        The position of the first tile
+    num_tiles: int
+        The number of tiles to retrieve
+    chromsizes: pd.Series
+        The chromosome sizes, indexed by chromosome name. Read from the
+        file if not provided.
+    abs_chrom_offsets: np.array
+        The absolute offsets of the chromosomes (see `get_chrom_offsets`).
+    bwfile: bbi.BBIFile
+        An open bigwig file to fetch the data from
+    summary: string or [string,...]
+        How the values in each bin are summarized (see `get_bigwig_tile`)
 
-def tiles(bwpath, tile_ids, chromsizes_map={}, chromsizes=None):
+    Returns
+    -------
+    tiles: [np.array,...]
+        The values for each tile in the run
+    '''
+    if chromsizes is None:
+        (chromsizes, abs_chrom_offsets) = chromsizes_cache.get(bwpath)
+    elif abs_chrom_offsets is None:
+        abs_chrom_offsets = get_chrom_offsets(chromsizes)
+
+    max_depth = get_quadtree_depth(chromsizes)
+    tile_size = TILE_SIZE * 2 ** (max_depth - zoom_level)
+
+    tiles = [None] * num_tiles
+
+    # runs of tiles within a single chromosome: [cid, start, first tile, num tiles]
+    chrom_runs = []
+
+    for i in range(num_tiles):
+        start_pos = (tile_x_pos + i) * tile_size
+        end_pos = start_pos + tile_size
+
+        segments = list(abs2genomic(chromsizes, start_pos, end_pos,
+            abs_chrom_offsets))
+
+        if len(segments) == 1 and segments[0][0] < len(chromsizes):
+            (cid, start, end) = segments[0]
+
+            if (chrom_runs and chrom_runs[-1][0] == cid and
+                    chrom_runs[-1][2] + chrom_runs[-1][3] == i):
+                chrom_runs[-1][3] += 1
+            else:
+                chrom_runs += [[cid, start, i, 1]]
+        else:
+            tiles[i] = get_bigwig_tile(bwpath, zoom_level, start_pos, end_pos,
+                    chromsizes, abs_chrom_offsets, bwfile=bwfile, summary=summary)
+
+    for (cid, start, first_tile, run_length) in chrom_runs:
+        chrom = chromsizes.index[cid]
+
+        try:
+            x = fetch_bins(bwpath, bwfile, chrom, start,
+                    start + run_length * tile_size, run_length * TILE_SIZE, summary)
+        except KeyError:
+            # probably requested a chromosome that doesn't exist (e.g. chrM)
+            x = empty_bins(run_length * TILE_SIZE, summary)
+
+        for j in range(run_length):
+            tiles[first_tile + j] = x[..., j * TILE_SIZE:(j+1) * TILE_SIZE]
+
+    return tiles
+
+
+def tiles(bwpath, tile_ids, chromsizes_map={}, chromsizes=None, envelope=False):
     '''
     Generate tiles from a bigwig file.
 
@@ -193,15 +442,36 @@ def tiles(bwpath, tile_ids, chromsizes_map={}, chromsizes=None):
     chromsizes: [[chrom, size],...]
         A 2d array containing chromosome names and sizes. Overrides the 
         chromsizes in chromsizes_map
+    envelope: bool
+        Return the minimum, maximum and coverage of each bin as 'mins',
+        'maxs' and 'coverage' arrays alongside the mean (see
+        `hgtiles.format.format_envelope_tile`)
 
     Returns
     -------
     tile_list: [(tile_id, tile_data),...]
         A list of tile_id, tile_data tuples
     '''
-    import base64
     TILE_SIZE = 1024
     generated_tiles = []
+
+    if chromsizes:
+        chromnames = [c[0] for c in chromsizes]
+        chromlengths = [int(c[1]) for c in chromsizes]
+        chromsizes = pd.Series(chromlengths, index=chromnames)
+    else:
+        # the chromsizes stored in the file, which are only read if
+        # some tile doesn't come with its own chromsizes
+        chromsizes = None
+
+    # the absolute chromosome offsets for each set of chromsizes
+    # that has been used, indexed by the id of the chromsizes object
+    chrom_offsets = {}
+
+    # the requested tile ids, grouped by zoom level and chromsizes
+    # and then indexed by tile position
+    tile_groups = col.OrderedDict()
+
     for tile_id in tile_ids:
         tile_option_parts = tile_id.split('|')[1:]
         tile_no_options = tile_id.split('|')[0]
@@ -210,11 +480,8 @@ def tiles(bwpath, tile_ids, chromsizes_map={}, chromsizes=None):
 
         tile_options = dict([o.split(':') for o in tile_option_parts])
 
-        if chromsizes:
-            chromnames = [c[0] for c in chromsizes]
-            chromlengths = [int(c[1]) for c in chromsizes]
-            cs = np.array(chromsizes)
-            chromsizes_to_use = pd.Series(chromlengths, index=chromnames)
+        if chromsizes is not None:
+            chromsizes_to_use = chromsizes
         else:
             chromsizes_id = None
             if 'cos' in tile_options:
@@ -226,22 +493,76 @@ def tiles(bwpath, tile_ids, chromsizes_map={}, chromsizes=None):
 
         zoom_level = tile_position[0]
         tile_pos = tile_position[1]
-        
-        # this doesn't combine multiple consequetive ids, which
-        # would speed things up
-        if chromsizes_to_use is None:
-            chromsizes_to_use = get_chromsizes(bwpath)
-
-        max_depth = get_quadtree_depth(chromsizes_to_use)
-        tile_size = TILE_SIZE * 2 ** (max_depth - zoom_level)
-        start_pos = tile_pos * tile_size
-        end_pos = start_pos + tile_size
-        dense = get_bigwig_tile(bwpath, zoom_level, start_pos, end_pos, chromsizes_to_use)
 
-        tile_value = hgfo.format_dense_tile(dense)
+        if chromsizes_to_use is None:
+            (chromsizes_to_use, abs_chrom_offsets) = chromsizes_cache.get(bwpath)
+        else:
+            if id(chromsizes_to_use) not in chrom_offsets:
+                chrom_offsets[id(chromsizes_to_use)] = get_chrom_offsets(chromsizes_to_use)
+            abs_chrom_offsets = chrom_offsets[id(chromsizes_to_use)]
+
+        group_key = (zoom_level, id(chromsizes_to_use))
+        if group_key not in tile_groups:
+            tile_groups[group_key] = (chromsizes_to_use, abs_chrom_offsets,
+                    col.defaultdict(list))
+        tile_groups[group_key][2][tile_pos] += [tile_id]
+
+    tile_values = {}
+
+    # the summaries of each bin, in the order expected by
+    # `hgtiles.format.format_envelope_tile`
+    summary_types = ['mean', 'min', 'max', 'cov'] if envelope else ['mean']
+
+    # the precomputed low zoom level tiles, which can only be
+    # used with the chromosome order stored in the file
+    summary = hgbs.get_summary(bwpath)
+    if summary is not None:
+        file_chromsizes = chromsizes_cache.get(bwpath)[0]
+
+    # all of the tiles are fetched from a single open file and runs
+    # of consecutive tiles are fetched together
+    with bbi.open(bwpath) as bwfile:
+        for ((zoom_level, _), (chromsizes_to_use, abs_chrom_offsets, tile_ids_by_pos)) in tile_groups.items():
+            use_summary = (summary is not None and
+                    chromsizes_to_use is file_chromsizes and
+                    zoom_level < summary['header']['num_zoom_levels'] and
+                    all(s in summary['header']['summaries'] for s in summary_types))
+
+            # tiles outside of the zoom level are empty
+            for tile_x_pos in tile_ids_by_pos.keys():
+                if tile_x_pos < 0 or tile_x_pos >= 2 ** zoom_level:
+                    store_tile(tile_values, tile_ids_by_pos[tile_x_pos],
+                            empty_bins(TILE_SIZE, summary_types), envelope)
+
+            for (tile_x_pos, num_tiles) in hgut.consecutive_runs([x for x in
+                    tile_ids_by_pos.keys() if 0 <= x < 2 ** zoom_level]):
+                if use_summary:
+                    tile_data = [np.array([hgbs.get_tile(summary, zoom_level,
+                        tile_x_pos + i, s) for s in summary_types])
+                            for i in range(num_tiles)]
+                else:
+                    tile_data = get_bigwig_tiles(bwpath, zoom_level, tile_x_pos,
+                            num_tiles, chromsizes_to_use, abs_chrom_offsets,
+                            bwfile=bwfile, summary=summary_types)
+
+                for i, values in enumerate(tile_data):
+                    store_tile(tile_values, tile_ids_by_pos[tile_x_pos + i],
+                            values, envelope)
+
+    return [(tile_id, tile_values[tile_id]) for tile_id in tile_ids]
+
+def store_tile(tile_values, tile_ids, values, envelope):
+    '''
+    Format the summaries of a tile (see `tiles`) and store
+    them under each of its tile ids.
+    '''
+    if envelope:
+        tile_value = hgfo.format_envelope_tile(*values)
+    else:
+        tile_value = hgfo.format_dense_tile(values[0])
 
-        generated_tiles += [(tile_id, tile_value)]
-    return generated_tiles
+    for tile_id in tile_ids:
+        tile_values[tile_id] = tile_value
 
 def chromsizes(filename):
     '''
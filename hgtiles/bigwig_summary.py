@@ -0,0 +1,238 @@
+'''
+Precomputed summaries of the low zoom levels of a bigWig file.
+
+A summary file (by default stored next to the bigWig file, see
+`get_summary_path`) contains the mean, min, max and coverage of every tile in the
+top zoom levels of the hgtiles quadtree, exactly as they would be
+returned by `hgtiles.bigwig.get_bigwig_tiles`. Tiles at those zoom
+levels can then be served by slicing a memory mapped array rather than
+summarizing the whole genome with bbi.
+
+Usage:
+
+    python -m hgtiles.bigwig_summary file.bigWig [--zoom-levels 9]
+
+The file layout is:
+
+    8 bytes     magic (MAGIC)
+    8 bytes     the length of the header (uint64)
+    header      a JSON object, padded with spaces to a multiple of 8 bytes
+    offsets     int64 [num_tiles + 1], where the values of the tile at
+                (zoom, x) are values[:, offsets[i]:offsets[i+1]] and
+                i = 2 ** zoom - 1 + x
+    values      float64 [len(summaries), offsets[-1]]
+'''
+import argparse
+import hgtiles.cache as hgca
+import json
+import logging
+import numpy as np
+import os
+import os.path as op
+
+MAGIC = b'HGBWSUM1'
+
+# the zoom levels that are summarized by default (0 to 8)
+NUM_ZOOM_LEVELS = 9
+
+# the summaries stored for each tile
+SUMMARIES = ('mean', 'min', 'max', 'cov')
+
+# the number of summary files kept open
+MAX_OPEN_SUMMARIES = 256
+
+logger = logging.getLogger(__name__)
+
+def get_summary_path(bwpath):
+    '''
+    The default location of the summary file for a bigWig file.
+    '''
+    return bwpath + '.hgsummary'
+
+def bigwig_version(bwpath):
+    '''
+    The size and modification time of a bigWig file, which are stored
+    in its summary file so that summaries of an older version of the
+    file are never used.
+    '''
+    st = os.stat(bwpath)
+    return [st.st_size, st.st_mtime_ns]
+
+def tile_index(zoom_level, tile_x_pos):
+    return 2 ** zoom_level - 1 + tile_x_pos
+
+def build(bwpath, summary_path=None, num_zoom_levels=NUM_ZOOM_LEVELS):
+    '''
+    Summarize the top zoom levels of a bigWig file.
+
+    Parameters
+    ----------
+    bwpath: string
+        The path to the bigWig file
+    summary_path: string
+        Where to write the summary file. Defaults to `get_summary_path(bwpath)`.
+    num_zoom_levels: int
+        The number of zoom levels to summarize, starting from zoom level 0.
+        Limited to the number of zoom levels in the tileset.
+
+    Returns
+    -------
+    summary_path: string
+        The path of the summary file that was written
+    '''
+    import bbi
+    import hgtiles.bigwig as hgbi
+
+    if summary_path is None:
+        summary_path = get_summary_path(bwpath)
+
+    version = bigwig_version(bwpath)
+    (chromsizes, abs_chrom_offsets) = hgbi.chromsizes_cache.get(bwpath)
+
+    num_zoom_levels = min(num_zoom_levels, hgbi.get_quadtree_depth(chromsizes) + 1)
+
+    # the values of each tile, as arrays of shape (len(SUMMARIES), num_bins)
+    tile_values = []
+
+    with bbi.open(bwpath) as bwfile:
+        for zoom_level in range(num_zoom_levels):
+            tile_values += hgbi.get_bigwig_tiles(bwpath, zoom_level, 0, 2 ** zoom_level,
+                chromsizes, abs_chrom_offsets, bwfile=bwfile, summary=list(SUMMARIES))
+
+    offsets = np.cumsum([0] + [t.shape[1] for t in tile_values]).astype(np.int64)
+    values = np.zeros((len(SUMMARIES), offsets[-1]), dtype=np.float64)
+
+    for i, tile_summaries in enumerate(tile_values):
+        values[:, offsets[i]:offsets[i+1]] = tile_summaries
+
+    header = json.dumps({
+        'tile_size': hgbi.TILE_SIZE,
+        'num_zoom_levels': num_zoom_levels,
+        'summaries': SUMMARIES,
+        'num_values': int(offsets[-1]),
+        'bigwig_version': version,
+        'chromsizes': [[chrom, int(size)] for chrom, size in chromsizes.items()]
+    }).encode('utf-8')
+    header += b' ' * (-len(header) % 8)
+
+    # write to a temporary file so that a summary file is never
+    # read while it's partially written
+    tmp_path = summary_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        f.write(offsets.tobytes())
+        f.write(values.tobytes())
+    os.replace(tmp_path, summary_path)
+
+    return summary_path
+
+def load(summary_path):
+    '''
+    Open a summary file.
+
+    Returns
+    -------
+    summary: {'header': dict, 'offsets': np.memmap, 'values': np.memmap}
+    '''
+    with open(summary_path, 'rb') as f:
+        if f.read(8) != MAGIC:
+            raise ValueError('Not a bigWig summary file: {}'.format(summary_path))
+
+        header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_length).decode('utf-8'))
+
+    num_tiles = tile_index(header['num_zoom_levels'], 0)
+    offset = 16 + header_length
+
+    offsets = np.memmap(summary_path, dtype=np.int64, mode='r',
+            offset=offset, shape=(num_tiles + 1,))
+    values = np.memmap(summary_path, dtype=np.float64, mode='r',
+            offset=offset + offsets.nbytes,
+            shape=(len(header['summaries']), header['num_values']))
+
+    return {'header': header, 'offsets': offsets, 'values': values}
+
+# open summary files indexed by their path
+summaries = hgca.HandleCache(load, max_size=MAX_OPEN_SUMMARIES)
+
+def get_summary(bwpath, summary_path=None):
+    '''
+    Get the summary of a bigWig file, if it has an up to date one.
+
+    Parameters
+    ----------
+    bwpath: string
+        The path to the bigWig file
+    summary_path: string
+        The path to the summary file. Defaults to `get_summary_path(bwpath)`.
+
+    Returns
+    -------
+    summary: dict or None
+        The summary (see `load`), or None if there is no summary file
+        or it was built from a different version of the bigWig file
+    '''
+    if summary_path is None:
+        summary_path = get_summary_path(bwpath)
+
+    if not op.exists(summary_path):
+        return None
+
+    summary = summaries.get(summary_path)
+
+    if summary['header']['bigwig_version'] != bigwig_version(bwpath):
+        logger.warning('Ignoring out of date bigWig summary: %s', summary_path)
+        return None
+
+    return summary
+
+def get_tile(summary, zoom_level, tile_x_pos, summary_type='mean'):
+    '''
+    The values of a tile in a summary.
+
+    Parameters
+    ----------
+    summary: dict
+        The summary (see `get_summary`)
+    zoom_level: int
+        The zoom level of the tile, which must be less than
+        summary['header']['num_zoom_levels']
+    tile_x_pos: int
+        The position of the tile, which must be in [0, 2 ** zoom_level)
+    summary_type: string
+        One of the summaries in the file (see SUMMARIES). Files written
+        by older versions may not contain every summary.
+
+    Returns
+    -------
+    values: np.array
+        The values of the bins in the tile
+    '''
+    if not 0 <= zoom_level < summary['header']['num_zoom_levels']:
+        raise ValueError('Zoom level {} is not in the summary'.format(zoom_level))
+    if not 0 <= tile_x_pos < 2 ** zoom_level:
+        raise ValueError('Tile position {} is outside of zoom level {}'.format(
+            tile_x_pos, zoom_level))
+
+    i = tile_index(zoom_level, tile_x_pos)
+    (start, end) = summary['offsets'][i:i+2]
+
+    return np.array(summary['values'][
+        summary['header']['summaries'].index(summary_type), start:end])
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Summarize the top zoom levels of a bigWig file')
+    parser.add_argument('bwpath', help='The bigWig file')
+    parser.add_argument('-o', '--output', default=None,
+            help='The summary file (default: <bwpath>.hgsummary)')
+    parser.add_argument('-z', '--zoom-levels', type=int, default=NUM_ZOOM_LEVELS,
+            help='The number of zoom levels to summarize')
+    args = parser.parse_args()
+
+    print(build(args.bwpath, args.output, args.zoom_levels))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import collections as col
+import contextlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+def file_fingerprint(filepath):
+    '''
+    Identify the version of a file on disk. A file that is rewritten in
+    place gets a new mtime and a file that is replaced (e.g. by a rename)
+    gets a new inode, so either change produces a different fingerprint.
+
+    Parameters
+    ----------
+    filepath: str
+        The path of the file
+
+    Returns
+    -------
+    fingerprint: (int, int)
+        The (inode, mtime in nanoseconds) of the file
+    '''
+    st = os.stat(filepath)
+    return (st.st_ino, st.st_mtime_ns)
+
+def key_path(key):
+    '''
+    The path of the file that a cache key refers to. Keys are either
+    a path or a tuple whose first element is a path.
+    '''
+    if isinstance(key, tuple):
+        return key[0]
+    return key
+
+class _Entry(object):
+    __slots__ = ('value', 'fingerprint', 'nbytes', 'users', 'evicted')
+
+    def __init__(self, value, fingerprint, nbytes):
+        self.value = value
+        self.fingerprint = fingerprint
+        self.nbytes = nbytes
+        self.users = 0
+        self.evicted = False
+
+class HandleCache(object):
+    '''
+    A bounded, thread-safe LRU cache for values that are expensive to open
+    or load from a file (file handles, parsed headers, bin tables...).
+
+    Entries are invalidated when the file they were loaded from changes
+    on disk (see `file_fingerprint`). When the cache grows beyond
+    `max_size` entries or `max_bytes` bytes, the least recently used
+    entries are evicted and closed. An entry that is in use (see
+    `acquire`) is only closed once its last user releases it.
+
+    Parameters
+    ----------
+    opener: function(key) -> value
+        Load the value for a key
+    closer: function(value)
+        Release the resources held by a value. Defaults to calling
+        `value.close()` if it exists.
+    sizer: function(value) -> int
+        The number of bytes a value counts against `max_bytes`
+    max_size: int
+        The maximum number of entries to keep
+    max_bytes: int or None
+        The maximum number of bytes to keep. None means no byte budget.
+    '''
+    def __init__(self, opener, closer=None, sizer=None, max_size=64, max_bytes=None):
+        self.opener = opener
+        self.closer = closer
+        self.sizer = sizer
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._entries = col.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        '''
+        Use the value for this key, opening it if necessary. The value
+        will not be closed by an eviction until the block exits.
+        '''
+        entry = self._checkout(key)
+        try:
+            yield entry.value
+        finally:
+            self._release(entry)
+
+    def get(self, key):
+        '''
+        Return the value for this key, opening it if necessary. The value
+        is not protected from being closed by a later eviction, so use
+        `acquire` when holding on to a file handle.
+        '''
+        entry = self._checkout(key)
+        self._release(entry)
+        return entry.value
+
+    def invalidate(self, key):
+        '''
+        Drop the entry for this key, if present.
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+
+    def clear(self):
+        '''
+        Drop all entries.
+        '''
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._discard(key)
+
+    def configure(self, max_size=None, max_bytes=None):
+        '''
+        Change the limits of this cache, evicting entries if it is now
+        over budget.
+        '''
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self):
+        '''
+        Return the counters for this cache.
+
+        Returns
+        -------
+        stats: {'hits': int, 'misses': int, 'evictions': int,
+                'invalidations': int, 'size': int, 'bytes': int}
+        '''
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'bytes': self._nbytes
+            }
+
+    def _lookup(self, key, fingerprint):
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        if entry.fingerprint != fingerprint:
+            # the file changed on disk since we opened it
+            self.invalidations += 1
+            self._discard(key)
+            return None
+
+        self._entries.move_to_end(key)
+        entry.users += 1
+        return entry
+
+    def _checkout(self, key):
+        fingerprint = file_fingerprint(key_path(key))
+
+        with self._lock:
+            entry = self._lookup(key, fingerprint)
+            if entry is not None:
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # only one thread opens any given key, other threads
+        # asking for the same key wait for it to be loaded
+        with key_lock:
+            with self._lock:
+                entry = self._lookup(key, fingerprint)
+                if entry is not None:
+                    return entry
+
+            try:
+                value = self.opener(key)
+            except Exception:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+                raise
+
+            nbytes = self.sizer(value) if self.sizer is not None else 0
+            entry = _Entry(value, fingerprint, nbytes)
+            entry.users += 1
+
+            with self._lock:
+                self._entries[key] = entry
+                self._nbytes += nbytes
+                self._key_locks.pop(key, None)
+                self._evict()
+
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.users -= 1
+
+            if entry.evicted and entry.users == 0:
+                self._close(entry)
+
+    def _over_budget(self):
+        if len(self._entries) > self.max_size:
+            return True
+        if self.max_bytes is not None and self._nbytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self):
+        # always keep the most recently used entry, even if it
+        # exceeds the byte budget on its own
+        while len(self._entries) > 1 and self._over_budget():
+            key = next(iter(self._entries))
+            self.evictions += 1
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        entry.evicted = True
+
+        if entry.users == 0:
+            self._close(entry)
+
+    def _close(self, entry):
+        try:
+            if self.closer is not None:
+                self.closer(entry.value)
+            elif hasattr(entry.value, 'close'):
+                entry.value.close()
+        except Exception as ex:
+            logger.warning('Error closing cached value: %s', ex)
@@ -1,19 +1,19 @@
 import base64
 import collections as col
 import cooler
+import hgtiles.cache as hgca
 import hgtiles.format as hgfo
 import hgtiles.utils as hgut
 import h5py
+import concurrent.futures as cf
 import itertools as it
 import numpy as np
 import pandas as pd
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
-global mats
-mats = {}
-
 transform_descriptions = {}
 transform_descriptions['weight'] = {'name': 'ICE', 'value': 'weight'}
 transform_descriptions['KR'] = {'name': 'KR', 'value': 'KR'}
@@ -22,27 +22,13 @@ transform_descriptions['VC_SQRT'] = {'name': 'VC_SQRT', 'value': 'VC_SQRT'}
 
 TILE_SIZE = 256
 
-def abs_coord_2_bin(c, abs_pos, chroms, chrom_cum_lengths, chrom_sizes):
-    """Get bin ID from absolute coordinates.
-
-    Args:
-        c (Cooler): Cooler instance of a .cool file.
-        abs_pos (int): Absolute coordinate to be translated.
-
-    Returns:
-        int: Bin number.
-    """
-
-    try:
-        chr_id = np.flatnonzero(chrom_cum_lengths > abs_pos)[0] - 1
-    except IndexError:
-        return c.info['nbins']
-
-    chrom = chroms[chr_id]
-    rel_pos = abs_pos - chrom_cum_lengths[chr_id]
-
-    return c.offset((chrom, rel_pos, chrom_sizes[chrom]))
+# limits for the cache of open cooler files (see `mats`)
+MAX_OPEN_FILES = 64
+MAX_OPEN_BYTES = 512 * 1024 * 1024
 
+# limits for the cache of bin tables (see `bin_tables`)
+MAX_BIN_TABLES = 128
+MAX_BIN_TABLE_BYTES = 1024 * 1024 * 1024
 
 def get_chromosome_names_cumul_lengths(c):
     '''
@@ -62,98 +48,271 @@ def get_chromosome_names_cumul_lengths(c):
     return chrom_names, chrom_sizes, chrom_cum_lengths
 
 
-def get_data(f, start_pos_1, end_pos_1, start_pos_2, end_pos_2, transform='default', resolution=None):
-    """Get balanced pixel data.
+def get_transform_column(f, transform):
+    '''
+    Get the column of the bin table that holds the
+    normalization vector for a transform.
 
-    Args:
-        f: h5py.File
-            An HDF5 Group that contains the cooler for this resolution
-        start_pos_1 (int): Test.
-        end_pos_1 (int): Test.
-        start_pos_2 (int): Test.
-        end_pos_2 (int): Test.
+    Parameters
+    ----------
+    f: h5py.Group
+        An HDF5 Group that contains the cooler for this resolution
+    transform: str
+        The requested transform (e.g. 'default', 'weight', 'KR')
 
-    Returns:
-        DataFrame: Annotated cooler pixels.
-    """
+    Returns
+    -------
+    column: str or None
+        The name of the column or None if no transform should be applied
+    '''
+    if (transform == 'default' and 'weight' in f['bins']) or transform == 'weight':
+        return 'weight'
+    elif transform in ('KR', 'VC', 'VC_SQRT'):
+        return transform
+
+    return None
+
+
+def read_bin_column(dset):
+    '''
+    Read a column of the bin table. Columns that are stored contiguously
+    and uncompressed are memory-mapped instead of being read into memory.
+    '''
+    if dset.chunks is None and dset.compression is None:
+        offset = dset.id.get_offset()
 
-    c = cooler.Cooler(f)
+        if offset is not None:
+            return np.memmap(dset.file.filename, mode='r', dtype=dset.dtype,
+                    offset=offset, shape=dset.shape)
 
-    (chroms, chrom_sizes, chrom_cum_lengths) = get_chromosome_names_cumul_lengths(c)
+    return dset[:]
 
-    i0 = abs_coord_2_bin(c, start_pos_1, chroms, chrom_cum_lengths, chrom_sizes)
-    i1 = abs_coord_2_bin(c, end_pos_1, chroms, chrom_cum_lengths, chrom_sizes)
 
-    j0 = abs_coord_2_bin(c, start_pos_2, chroms, chrom_cum_lengths, chrom_sizes)
-    j1 = abs_coord_2_bin(c, end_pos_2, chroms, chrom_cum_lengths, chrom_sizes)
+def load_bin_table(key):
+    '''
+    Load the bin positions and weights of one resolution of a cooler.
+
+    Parameters
+    ----------
+    key: (str, str, str)
+        The filename, the name of the HDF5 group containing the cooler
+        for this resolution and the column holding the weights (or None)
 
-    matrix = c.matrix(as_pixels=True, balance=False, max_chunk=np.inf)
+    Returns
+    -------
+    bin_table: {'chrom_cum_lengths': np.array, 'chrom': np.array,
+                'genome_start': np.array, 'genome_end': np.array,
+                'weight': np.array or None}
+    '''
+    (filename, group_name, weight_column) = key
+
+    with h5py.File(filename, 'r') as f:
+        grp = f[group_name]
+
+        chrom_cum_lengths = np.r_[0, np.cumsum(grp['chroms']['length'][:])]
+        chrom = grp['bins']['chrom'][:]
+
+        bin_table = {
+            'chrom_cum_lengths': chrom_cum_lengths,
+            'chrom': chrom,
+            'genome_start': chrom_cum_lengths[chrom] + grp['bins']['start'][:],
+            'genome_end': chrom_cum_lengths[chrom] + grp['bins']['end'][:],
+            'weight': None
+        }
 
-    if i0 >= matrix.shape[0] or j0 >= matrix.shape[1]:
+        if weight_column is not None:
+            bin_table['weight'] = read_bin_column(grp['bins'][weight_column])
+
+    return bin_table
+
+
+def bin_table_nbytes(bin_table):
+    '''
+    The number of bytes of memory used by the (not memory-mapped)
+    arrays in a bin table.
+    '''
+    return sum(a.nbytes for a in bin_table.values()
+            if a is not None and not isinstance(a, np.memmap))
+
+# bin positions and weights indexed by
+# (filename, resolution group name, weight column)
+bin_tables = hgca.HandleCache(load_bin_table,
+        closer=lambda bin_table: None,
+        sizer=bin_table_nbytes,
+        max_size=MAX_BIN_TABLES,
+        max_bytes=MAX_BIN_TABLE_BYTES)
+
+
+def get_bin_table(f, transform='default'):
+    '''
+    Get the (cached) bin positions and weights for one resolution
+    of a cooler.
+
+    Parameters
+    ----------
+    f: h5py.Group
+        An HDF5 Group that contains the cooler for this resolution
+    transform: str
+        The requested transform (e.g. 'default', 'weight', 'KR')
+
+    Returns
+    -------
+    bin_table: dict
+        See `load_bin_table`
+    '''
+    return bin_tables.get((f.file.filename, f.name, get_transform_column(f, transform)))
+
+
+def get_pixels(f, i0, i1, j0, j1):
+    '''
+    Read the stored pixels in the rectangle [i0, i1) x [j0, j1) of the
+    contact matrix straight from the HDF5 datasets. Like the cooler
+    API's `matrix(as_pixels=True)`, only the pixels that are stored
+    (i.e. the upper triangle of symmetric matrices) are returned.
+
+    Parameters
+    ----------
+    f: h5py.Group
+        An HDF5 Group that contains the cooler for this resolution
+    i0, i1: int
+        The range of rows (bin1 ids) to return
+    j0, j1: int
+        The range of columns (bin2 ids) to return
+
+    Returns
+    -------
+    (bin1, bin2, count): (np.array, np.array, np.array)
+        The row, column and value of every nonzero pixel
+    '''
+    offsets = f['indexes']['bin1_offset'][i0:i1+1]
+
+    bin1 = np.repeat(np.arange(i0, i1), np.diff(offsets))
+    bin2 = f['pixels']['bin2_id'][offsets[0]:offsets[-1]]
+    count = f['pixels']['count'][offsets[0]:offsets[-1]]
+
+    mask = (bin2 >= j0) & (bin2 < j1)
+
+    return (bin1[mask], bin2[mask], count[mask])
+
+
+def get_data_arrays(f, start_pos_1, end_pos_1, start_pos_2, end_pos_2, transform='default'):
+    '''
+    Get balanced pixel data as numpy arrays. The pixels and bins are read
+    straight from the HDF5 datasets rather than through the cooler API.
+
+    Parameters
+    ----------
+    f: h5py.Group
+        An HDF5 Group that contains the cooler for this resolution
+    start_pos_1, end_pos_1: int
+        The absolute genomic range along the first axis
+    start_pos_2, end_pos_2: int
+        The absolute genomic range along the second axis
+    transform: str
+        The normalization to apply (e.g. 'default', 'weight', 'KR')
+
+    Returns
+    -------
+    (pixels, (bins1, bins2))
+        pixels: {'genome_start1': np.array, 'genome_start2': np.array,
+                 'balanced' or 'count': np.array}
+        bins1, bins2: {'genome_start': np.array, 'genome_end': np.array,
+                       'weight': np.array,...} or None
+            The bins along each axis or None if no transform is applied
+    '''
+    bin_table = get_bin_table(f, transform)
+    chrom_cum_lengths = bin_table['chrom_cum_lengths']
+    genome_start = bin_table['genome_start']
+    n_bins = len(genome_start)
+
+    # the bins containing each position, or n_bins for
+    # positions beyond the end of the genome
+    (i0, i1, j0, j1) = np.searchsorted(genome_start,
+            [start_pos_1, end_pos_1, start_pos_2, end_pos_2], side='right') - 1
+    (i0, i1, j0, j1) = [int(b) if p < chrom_cum_lengths[-1] else n_bins
+            for (b, p) in zip((i0, i1, j0, j1), (start_pos_1, end_pos_1, start_pos_2, end_pos_2))]
+
+    if i0 >= n_bins or j0 >= n_bins:
         # query beyond the bounds of the matrix
         # return an empty matrix
-        i0,i1,j0,j1 = 0,0,0,0
-
-        return (pd.DataFrame(columns=['genome_start1', 'genome_start2', 'balanced']),
-                (pd.DataFrame({'genome_start': [],
-                               'genome_end': [],
-                               'weight': []}),
-                pd.DataFrame({'genome_start': [],
-                               'genome_end': [],
-                               'weight': []})))
+        empty_bins = {'genome_start': np.array([]),
+                      'genome_end': np.array([]),
+                      'weight': np.array([])}
+        return ({'genome_start1': np.array([]),
+                 'genome_start2': np.array([]),
+                 'balanced': np.array([])}, (empty_bins, dict(empty_bins)))
     else:
         # limit the range of the query to be within bounds
-        i1 = min(i1, matrix.shape[0]-1)
-        j1 = min(j1, matrix.shape[1]-1)
+        i1 = min(i1, n_bins-1)
+        j1 = min(j1, n_bins-1)
 
-    pixels = matrix[i0:i1+1, j0:j1+1]
+    (bin1, bin2, count) = get_pixels(f, i0, i1+1, j0, j1+1)
 
-    '''
-    if not len(pixels):
-        return (pd.DataFrame(columns=['genome_start1', 'genome_start2', 'balanced']), (None, None))
-    '''
+    transform_column = get_transform_column(f, transform)
 
-    # select bin columns to extract
-    cols = ['chrom', 'start', 'end']
-    if (transform == 'default' and 'weight' in c.bins()) or transform == 'weight':
-        cols.append('weight')
-    elif transform in ('KR', 'VC', 'VC_SQRT'):
-        cols.append(transform)
+    def read_bins(lo, hi):
+        chrom = bin_table['chrom'][lo:hi]
+        bins = {
+            'chrom': chrom,
+            'genome_start': bin_table['genome_start'][lo:hi],
+            'genome_end': bin_table['genome_end'][lo:hi]
+        }
+        bins['start'] = bins['genome_start'] - chrom_cum_lengths[chrom]
+        bins['end'] = bins['genome_end'] - chrom_cum_lengths[chrom]
 
-    bins = c.bins(convert_enum=False)[cols]
-    pixels = cooler.annotate(pixels, bins)
+        if transform_column is not None:
+            bins[transform_column] = np.asarray(bin_table['weight'][lo:hi])
+            bins['weight'] = bins[transform_column]
 
-    pixels['genome_start1'] = chrom_cum_lengths[pixels['chrom1']] + pixels['start1']
-    pixels['genome_start2'] = chrom_cum_lengths[pixels['chrom2']] + pixels['start2']
+        return bins
 
-    bins1 = bins[i0:i1+1]
-    bins2 = bins[j0:j1+1]
+    bins1 = read_bins(i0, i1+1)
+    bins2 = read_bins(j0, j1+1)
 
+    # all of the pixels are within the bin ranges we just read
+    pixels = {
+        'genome_start1': bins1['genome_start'][bin1 - i0],
+        'genome_start2': bins2['genome_start'][bin2 - j0]
+    }
 
-    bins1['genome_start'] = chrom_cum_lengths[bins1['chrom']] + bins1['start']
-    bins2['genome_start'] = chrom_cum_lengths[bins2['chrom']] + bins2['start']
+    # apply transform
+    if transform_column == 'weight':
+        pixels['balanced'] = count * bins1['weight'][bin1 - i0] * bins2['weight'][bin2 - j0]
+        return (pixels, (bins1, bins2))
+    elif transform_column is not None:
+        pixels['balanced'] = count / bins1['weight'][bin1 - i0] / bins2['weight'][bin2 - j0]
+        return (pixels, (bins1, bins2))
+    else:
+        pixels['count'] = count
+        return (pixels, (None, None))
 
-    bins1['genome_end'] = chrom_cum_lengths[bins1['chrom']] + bins1['end']
-    bins2['genome_end'] = chrom_cum_lengths[bins2['chrom']] + bins2['end']
 
-    # apply transform
-    if (transform == 'default' and 'weight' in c.bins()) or transform == 'weight':
-        pixels['balanced'] = (
-            pixels['count'] * pixels['weight1'] * pixels['weight2']
-        )
+def get_data(f, start_pos_1, end_pos_1, start_pos_2, end_pos_2, transform='default', resolution=None):
+    """Get balanced pixel data.
 
-        return (pixels[['genome_start1', 'genome_start2', 'balanced']], (bins1, bins2))
-    elif transform in ('KR', 'VC', 'VC_SQRT'):
-        pixels['balanced'] = (
-            pixels['count'] / pixels[transform+'1'] / pixels[transform+'2']
-        )
+    This wraps the arrays returned by `get_data_arrays` in DataFrames.
+
+    Args:
+        f: h5py.File
+            An HDF5 Group that contains the cooler for this resolution
+        start_pos_1 (int): Test.
+        end_pos_1 (int): Test.
+        start_pos_2 (int): Test.
+        end_pos_2 (int): Test.
 
-        bins1['weight'] = bins1[transform]
-        bins2['weight'] = bins2[transform]
+    Returns:
+        DataFrame: Annotated cooler pixels.
+    """
+    (pixels, (bins1, bins2)) = get_data_arrays(f, start_pos_1, end_pos_1,
+            start_pos_2, end_pos_2, transform)
 
-        return (pixels[['genome_start1', 'genome_start2', 'balanced']], (bins1, bins2))
-    else:
-        return (pixels[['genome_start1', 'genome_start2', 'count']], (None, None))
+    columns = ['genome_start1', 'genome_start2', 'balanced' if 'balanced' in pixels else 'count']
+    pixels = pd.DataFrame(pixels, columns=columns)
+
+    if bins1 is None:
+        return (pixels, (None, None))
+
+    return (pixels, (pd.DataFrame(bins1), pd.DataFrame(bins2)))
 
 
 def get_info(file_path):
@@ -278,94 +437,73 @@ def make_tiles(hdf_for_resolution, resolution, x_pos, y_pos, transform_type='def
     #print('start1:', start1, end1)
     #print('start2:', start2, end2)
 
-    c = cooler.Cooler(hdf_for_resolution)
-    (chroms, chrom_sizes, chrom_cum_lengths) = get_chromosome_names_cumul_lengths(c)
+    total_length = int(get_bin_table(hdf_for_resolution, transform_type)['chrom_cum_lengths'][-1])
 
-    total_length = sum(chrom_sizes.values())
-
-    (data, (bins1, bins2)) = get_data(
+    (data, (bins1, bins2)) = get_data_arrays(
         hdf_for_resolution, start1, end1 - 1, start2, end2- 1,
-        transform_type, resolution=resolution
+        transform_type
     )
 
 
-    #print('start1', start1, 'end1', end1, 'weight', len(weight1), 'end1 - start1 / tile_size', (end1 - start1) / resolution)
-
-    #print("data:", data)
+    binsize = resolution
 
-    # print("x_width:", x_width)
-    # print("y_width:", y_width)
-    # split out the individual tiles
-    data_by_tilepos = {}
-
-    for x_offset in range(0, x_width):
-        for y_offset in range(0, y_width):
-
-            start1 = (x_pos + x_offset) * tile_size
-            end1 = (x_pos + x_offset+ 1) * tile_size
-            start2 = (y_pos + y_offset) * tile_size
-            end2 = (y_pos + y_offset + 1) * tile_size
+    # all of the tiles are rasterized into one block
+    # indexed by (x_offset, y_offset, row, column)
+    out = np.zeros((x_width, y_width, BINS_PER_TILE, BINS_PER_TILE), dtype=np.float32)
 
-            i0 = x_offset * BINS_PER_TILE
-            i1 = i0 + BINS_PER_TILE + 1
-            j0 = y_offset * BINS_PER_TILE
-            j1 = j0 + BINS_PER_TILE + 1
+    genome_start1 = data['genome_start1']
+    genome_start2 = data['genome_start2']
 
-            #print("resolution:", resolution)
-            #print("tile_size", tile_size)
-            #print("x_pos:", x_pos, "x_offset", x_offset)
-            #print("start1", start1, 'end1', end1)
-            #print("start2", start2, 'end2', end2)
-
-            df = data[data['genome_start1'] >= start1]
-            df = df[df['genome_start1'] < end1]
-
-            df = df[df['genome_start2'] >= start2]
-            df = df[df['genome_start2'] < end2]
+    if 'balanced' in data:
+        values = data['balanced']
+    else:
+        values = data['count']
 
-            binsize = resolution
+    in_bounds = ((genome_start1 >= start1) & (genome_start1 < end1) &
+                 (genome_start2 >= start2) & (genome_start2 < end2))
 
-            j = ((df['genome_start1'].values - start1) // binsize).astype(int)
-            i = ((df['genome_start2'].values - start2) // binsize).astype(int)
+    genome_start1 = genome_start1[in_bounds]
+    genome_start2 = genome_start2[in_bounds]
 
-            if 'balanced' in df:
-                v = np.nan_to_num(df['balanced'].values)
-            else:
-                v = np.nan_to_num(df['count'].values)
+    # the tile each pixel is in and its position within that tile
+    tx = ((genome_start1 - start1) // tile_size).astype(int)
+    ty = ((genome_start2 - start2) // tile_size).astype(int)
 
-            out = np.zeros((256, 256), dtype=np.float32)
-            out[i, j] = v
+    j = ((genome_start1 - (x_pos + tx) * tile_size) // binsize).astype(int)
+    i = ((genome_start2 - (y_pos + ty) * tile_size) // binsize).astype(int)
 
-            if bins1 is not None and bins2 is not None:
-                sub_bins1 = bins1[bins1['genome_start'] >= start1]
-                sub_bins2 = bins2[bins2['genome_start'] >= start2]
+    out[tx, ty, i, j] = np.nan_to_num(values[in_bounds])
 
-                sub_bins1 = sub_bins1[sub_bins1['genome_start'] < end1]
-                sub_bins2 = sub_bins2[sub_bins2['genome_start'] < end2]
+    if bins1 is not None and bins2 is not None:
+        # mask the rows and columns of bins which have no weight
+        nan_starts1 = bins1['genome_start'][np.isnan(bins1['weight'])]
+        nan_starts2 = bins2['genome_start'][np.isnan(bins2['weight'])]
 
-                # print("sub_bins1:", sub_bins1)
+        # as well as the bins beyond the end of the genome
+        end_starts1 = np.arange(total_length, int(end1), int(resolution))
+        end_starts2 = np.arange(total_length, int(end2), int(resolution))
 
-                nan_bins1 = sub_bins1[np.isnan(sub_bins1['weight'])]
-                nan_bins2 = sub_bins2[np.isnan(sub_bins2['weight'])]
+        nan_starts1 = np.r_[nan_starts1, end_starts1]
+        nan_starts2 = np.r_[nan_starts2, end_starts2]
 
-                bi = ((nan_bins1['genome_start'].values - start1) // binsize).astype(int)
-                bj = ((nan_bins2['genome_start'].values - start2) // binsize).astype(int)
+        nan_starts1 = nan_starts1[(nan_starts1 >= start1) & (nan_starts1 < end1)]
+        nan_starts2 = nan_starts2[(nan_starts2 >= start2) & (nan_starts2 < end2)]
 
-                bend1 = ((np.array(range(total_length, int(end1), int(resolution))) - start1) // binsize).astype(int)
-                bend2 = ((np.array(range(total_length, int(end2), int(resolution))) - start2) // binsize).astype(int)
+        btx = ((nan_starts1 - start1) // tile_size).astype(int)
+        bty = ((nan_starts2 - start2) // tile_size).astype(int)
 
-                bend1 = bend1[bend1 >= 0]
-                bend2 = bend2[bend2 >= 0]
+        bi = ((nan_starts1 - (x_pos + btx) * tile_size) // binsize).astype(int)
+        bj = ((nan_starts2 - (y_pos + bty) * tile_size) // binsize).astype(int)
 
-                out[:, bi] = np.nan
-                out[bj,:] = np.nan
+        out[btx, :, :, bi] = np.nan
+        out[:, bty, bj, :] = np.nan
 
-                out[:, bend1] = np.nan
-                out[bend2, :] = np.nan
+    # split out the individual tiles
+    data_by_tilepos = {}
 
-            #print('sum(isnan1)', isnan1-1)
-            #print('out.ravel()', sum(np.isnan(out.ravel())), len(out.ravel()))
-            data_by_tilepos[(x_pos + x_offset, y_pos + y_offset)] = out.ravel()
+    for x_offset in range(0, x_width):
+        for y_offset in range(0, y_width):
+            data_by_tilepos[(x_pos + x_offset, y_pos + y_offset)] = out[x_offset, y_offset].ravel()
 
     return data_by_tilepos
 
@@ -459,7 +597,6 @@ def make_mats(filepath):
         # this file contains raw resolutions so it'll return a different
         # sort of tileset info
         info = {"resolutions": tuple(sorted(map(int, list(f['resolutions'].keys())))) }
-        mats[filepath] = [f, info]
 
         # see which transforms are available, a transform has to be
         # available at every available resolution in order for it to
@@ -500,9 +637,49 @@ def make_mats(filepath):
     if "transforms" in info:
         info["transforms"] = list(info["transforms"])
 
-    mats[filepath] = [f, info]
     return (f, info)
 
+def handle_nbytes(file_and_info):
+    '''
+    The number of bytes that an open cooler file counts against
+    the byte budget of the handle cache: the size of its HDF5 raw
+    data chunk cache.
+    '''
+    (f, info) = file_and_info
+    return f.id.get_access_plist().get_cache()[2]
+
+# open cooler files along with their tileset info,
+# indexed by filepath
+mats = hgca.HandleCache(make_mats,
+        closer=lambda file_and_info: file_and_info[0].close(),
+        sizer=handle_nbytes,
+        max_size=MAX_OPEN_FILES,
+        max_bytes=MAX_OPEN_BYTES)
+
+# the file handles of the threads that generate tiles (see
+# `generate_tiles`), indexed by (filepath, thread id)
+worker_files = hgca.HandleCache(lambda key: h5py.File(key[0], 'r'),
+        sizer=lambda f: handle_nbytes((f, None)),
+        max_size=MAX_OPEN_FILES,
+        max_bytes=MAX_OPEN_BYTES)
+
+# the thread pools that tiles are generated on, indexed by their number
+# of threads (see `get_executor`)
+executors = {}
+executors_lock = threading.Lock()
+
+def get_executor(num_workers):
+    '''
+    Get a thread pool that groups of tiles are generated on (see
+    `generate_tiles`), creating it if necessary. The threads are long
+    lived so that their file handles (see `worker_files`) are reused
+    between requests.
+    '''
+    with executors_lock:
+        if num_workers not in executors:
+            executors[num_workers] = cf.ThreadPoolExecutor(max_workers=num_workers)
+
+        return executors[num_workers]
 
 def tileset_info(filepath):
     '''
@@ -514,12 +691,7 @@ def tileset_info(filepath):
     filepath: str
         The location of the cooler file
     '''
-    if filepath in mats:
-        return mats[filepath][1]
-    else:
-        (f, info) = make_mats(filepath)
-
-        return info
+    return mats.get(filepath)[1]
 
 def add_transform_type(tile_id):
     '''
@@ -544,8 +716,25 @@ def add_transform_type(tile_id):
     new_tile_id = ".".join([tileset_uuid] + tile_position + [transform_type])
     return new_tile_id
 
-def tiles(filepath, tile_ids):
+def tiles(filepath, tile_ids, num_workers=1):
     '''
+    Generate tiles from a cooler file, returning them under the
+    tile ids they were requested with.
+
+    Parameters
+    ----------
+    filepath: str
+        The location of the cooler file
+    tile_ids: [str,...]
+        A list of tile_ids (e.g. xyx.0.0.1) identifying the tiles
+        to be retrieved
+    num_workers: int
+        The number of threads to generate tiles with (see `generate_tiles`)
+
+    Returns
+    -------
+    generated_tiles: [(tile_id, tile_data),...]
+        A list of tile_id, tile_data tuples
     '''
     transform_id_to_original_id = {}
 
@@ -556,7 +745,7 @@ def tiles(filepath, tile_ids):
         transform_id_to_original_id[new_tile_id] = tile_id
         new_tile_ids += [new_tile_id]
 
-    generated_tiles = generate_tiles(filepath, new_tile_ids)
+    generated_tiles = generate_tiles(filepath, new_tile_ids, num_workers=num_workers)
 
     tiles_to_return = []
     for tile_id, tile_value in generated_tiles:
@@ -568,16 +757,20 @@ def tiles(filepath, tile_ids):
     return tiles_to_return
 
 
-def generate_tiles(filepath, tile_ids):
+def generate_tile_group(tileset_file, tileset_info, tile_group):
     '''
-    Generate tiles from a cooler file.
+    Generate a group of adjacent tiles with the same zoom level
+    and transform type.
+
     Parameters
     ----------
-    tileset: tilesets.models.Tileset object
-        The tileset that the tile ids should be retrieved from
-    tile_ids: [str,...]
-        A list of tile_ids (e.g. xyx.0.0.1) identifying the tiles
-        to be retrieved
+    tileset_file: h5py.File
+        The open cooler file
+    tileset_info: dict
+        The tileset info for this file (see `make_mats`)
+    tile_group: [str,...]
+        A list of adjacent tile_ids (e.g. xyx.0.0.1.default)
+
     Returns
     -------
     generated_tiles: [(tile_id, tile_data),...]
@@ -585,67 +778,103 @@ def generate_tiles(filepath, tile_ids):
     '''
     BINS_PER_TILE = 256
 
-    if filepath not in mats:
-        # check if this tileset is open
-        make_mats(filepath)
+    zoom_level = int(tile_group[0].split('.')[1])
+    tileset_id = tile_group[0].split('.')[0]
+    transform_type = get_transform_type(tile_group[0])
 
-    tileset_file_and_info = mats[filepath]
+    if 'resolutions' in tileset_info:
+        sorted_resolutions = sorted([int(r) for r in tileset_info['resolutions']], reverse=True)
+        if zoom_level > len(sorted_resolutions):
+            # this tile has too high of a zoom level specified
+            return []
 
-    tile_ids_by_zoom_and_transform = bin_tiles_by_zoom_level_and_transform(tile_ids).values()
-    partitioned_tile_ids = list(it.chain(*[hgut.partition_by_adjacent_tiles(t)
-        for t in tile_ids_by_zoom_and_transform]))
-
-    generated_tiles = []
+        resolution = sorted_resolutions[zoom_level]
+        hdf_for_resolution = tileset_file['resolutions'][str(resolution)]
+    else:
+        if zoom_level > tileset_info['max_zoom']:
+            # this tile has too high of a zoom level specified
+            return []
+        hdf_for_resolution = tileset_file[str(zoom_level)]
+        resolution = (tileset_info['max_width'] / 2**zoom_level) / BINS_PER_TILE
 
-    for tile_group in partitioned_tile_ids:
-        zoom_level = int(tile_group[0].split('.')[1])
-        tileset_id = tile_group[0].split('.')[0]
-        transform_type = get_transform_type(tile_group[0])
-        tileset_info = tileset_file_and_info[1]
-        tileset_file = tileset_file_and_info[0]
+    tile_positions = [[int(x) for x in t.split('.')[2:4]] for t in tile_group]
 
-        if 'resolutions' in tileset_info:
-            sorted_resolutions = sorted([int(r) for r in tileset_info['resolutions']], reverse=True)
-            if zoom_level > len(sorted_resolutions):
-                # this tile has too high of a zoom level specified
-                continue
+    # filter for tiles that are in bounds for this zoom level
+    tile_positions = list(filter(lambda x: x[0] < tileset_info['max_pos'][0]+1, tile_positions))
+    tile_positions = list(filter(lambda x: x[1] < tileset_info['max_pos'][1]+1, tile_positions))
 
-            resolution = sorted_resolutions[zoom_level]
-            hdf_for_resolution = tileset_file['resolutions'][str(resolution)]
-        else:
-            if zoom_level > tileset_info['max_zoom']:
-                # this tile has too high of a zoom level specified
-                continue
-            hdf_for_resolution = tileset_file[str(zoom_level)]
-            resolution = (tileset_info['max_width'] / 2**zoom_level) / BINS_PER_TILE
+    if len(tile_positions) == 0:
+        # no in bounds tiles
+        return []
 
-        tile_positions = [[int(x) for x in t.split('.')[2:4]] for t in tile_group]
+    minx = min([t[0] for t in tile_positions])
+    maxx = max([t[0] for t in tile_positions])
 
-        # filter for tiles that are in bounds for this zoom level
-        tile_positions = list(filter(lambda x: x[0] < tileset_info['max_pos'][0]+1, tile_positions))
-        tile_positions = list(filter(lambda x: x[1] < tileset_info['max_pos'][1]+1, tile_positions))
+    miny = min([t[1] for t in tile_positions])
+    maxy = max([t[1] for t in tile_positions])
 
-        if len(tile_positions) == 0:
-            # no in bounds tiles
-            continue
+    tile_data_by_position = make_tiles(hdf_for_resolution,
+            resolution,
+            minx, miny,
+            transform_type,
+            maxx-minx+1, maxy-miny+1)
 
-        minx = min([t[0] for t in tile_positions])
-        maxx = max([t[0] for t in tile_positions])
+    return [(".".join(map(str, [tileset_id] + [zoom_level] + list(position) + [transform_type])),
+        hgfo.format_dense_tile(tile_data))
+            for (position, tile_data) in tile_data_by_position.items()]
 
-        miny = min([t[1] for t in tile_positions])
-        maxy = max([t[1] for t in tile_positions])
 
-        tile_data_by_position = make_tiles(hdf_for_resolution,
-                resolution,
-                minx, miny,
-                transform_type,
-                maxx-minx+1, maxy-miny+1)
+def generate_tiles(filepath, tile_ids, num_workers=1):
+    '''
+    Generate tiles from a cooler file.
+    Parameters
+    ----------
+    tileset: tilesets.models.Tileset object
+        The tileset that the tile ids should be retrieved from
+    tile_ids: [str,...]
+        A list of tile_ids (e.g. xyx.0.0.1) identifying the tiles
+        to be retrieved
+    num_workers: int
+        The number of threads used to generate tiles. Each group of
+        adjacent tiles is generated by one thread, so groups from
+        different zoom levels or different parts of the matrix are
+        generated concurrently. Each thread reads through its own
+        (cached) file handle. h5py holds its global lock for the whole
+        of every HDF5 read, decompression included, so the reads are
+        serialized and only the numpy and pandas work done on the
+        arrays they return runs in parallel.
+    Returns
+    -------
+    generated_tiles: [(tile_id, tile_data),...]
+        A list of tile_id, tile_data tuples, in the order the
+        tiles were requested
+    '''
+    tile_ids_by_zoom_and_transform = bin_tiles_by_zoom_level_and_transform(tile_ids).values()
+    partitioned_tile_ids = list(it.chain(*[hgut.partition_by_adjacent_tiles(t)
+        for t in tile_ids_by_zoom_and_transform]))
 
-        tiles = [(".".join(map(str, [tileset_id] + [zoom_level] + list(position) + [transform_type])),
-            hgfo.format_dense_tile(tile_data))
-                for (position, tile_data) in tile_data_by_position.items()]
+    # keep the file open (i.e. not evicted from the cache)
+    # until all the tiles have been generated
+    with mats.acquire(filepath) as (tileset_file, tileset_info):
+        if num_workers > 1 and len(partitioned_tile_ids) > 1:
+            def generate_worker_tile_group(tile_group):
+                # the thread ids are stable since the threads are long
+                # lived, and every thread has its own handle
+                with worker_files.acquire((filepath, threading.get_ident())) as worker_file:
+                    return generate_tile_group(worker_file, tileset_info, tile_group)
+
+            tile_groups = list(get_executor(num_workers).map(
+                generate_worker_tile_group, partitioned_tile_ids))
+        else:
+            tile_groups = [generate_tile_group(tileset_file, tileset_info, tile_group)
+                    for tile_group in partitioned_tile_ids]
 
+    generated_tiles = dict(it.chain(*tile_groups))
 
-        generated_tiles += tiles
+    # return the tiles in the order that they were requested
+    tile_order = {}
+    for tile_id in tile_ids:
+        tile_order.setdefault(add_transform_type(tile_id), len(tile_order))
 
-    return generated_tiles
+    return sorted(generated_tiles.items(),
+            key=lambda tile: tile_order.get(tile[0], len(tile_order)))
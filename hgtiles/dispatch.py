@@ -0,0 +1,339 @@
+import collections as col
+import concurrent.futures as cf
+import hgtiles.utils as hgut
+import importlib
+import logging
+import multiprocessing as mp
+
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python < 3.8
+    shared_memory = None
+
+logger = logging.getLogger(__name__)
+
+# the module and function that generate tiles for each filetype, all of
+# which are called as function(filepath, tile_ids). Modules are only
+# imported when they are first used so that missing optional dependencies
+# (e.g. pybbi) only affect their own filetype.
+#
+# bed2ddb, geodb and imtiles files can't be recognized by their name (see
+# `hgtiles.utils.infer_filetype`), so their filetype has to be passed to
+# `tiles`. Points tilesets aren't files (their tiles are generated from a
+# dataframe) and time interval files have no tiles, so neither is here.
+handlers = {
+    'cooler': ('hgtiles.cooler', 'tiles'),
+    'bigwig': ('hgtiles.bigwig', 'tiles'),
+    'hitile': ('hgtiles.hitile', 'tiles'),
+    'beddb': ('hgtiles.beddb', 'tiles'),
+    'multivec': ('hgtiles.multivec', 'tiles'),
+    'imtiles': ('hgtiles.dispatch', 'imtiles_tiles'),
+    'bed2ddb': ('hgtiles.dispatch', 'bed2ddb_tiles'),
+    'geodb': ('hgtiles.dispatch', 'geodb_tiles'),
+}
+
+# the keys of tile values containing (potentially large)
+# base64 encoded arrays
+DENSE_KEYS = ('dense', 'mins', 'maxs', 'coverage')
+
+global pool
+pool = None
+
+def imtiles_tiles(filepath, tile_ids):
+    import hgtiles.imtiles as hgim
+
+    return hgim.get_tiles(filepath, tile_ids, raw=False)
+
+def block_tiles(get_tiles, filepath, tile_ids):
+    '''
+    Generate 2D tiles with a function that retrieves a block of tiles
+    (e.g. `hgtiles.geo.get_tiles`), with one call per group of adjacent
+    tiles (see `hgtiles.aio.group_tile_ids`).
+    '''
+    import hgtiles.aio as hgai
+
+    tiles = []
+
+    for tile_group in hgai.group_tile_ids(tile_ids):
+        positions = [list(map(int, tile_id.split('|')[0].split('.')[1:4]))
+                for tile_id in tile_group]
+
+        zoom = positions[0][0]
+        minx = min(p[1] for p in positions)
+        miny = min(p[2] for p in positions)
+
+        block = get_tiles(filepath, zoom, minx, miny,
+                max(p[1] for p in positions) - minx + 1,
+                max(p[2] for p in positions) - miny + 1)
+
+        tiles += [(tile_id, block[(p[1], p[2])]) for (tile_id, p) in zip(tile_group, positions)]
+
+    return tiles
+
+def bed2ddb_tiles(filepath, tile_ids):
+    import hgtiles.bed2ddb as hgb2
+
+    return block_tiles(hgb2.get_2D_tiles, filepath, tile_ids)
+
+def geodb_tiles(filepath, tile_ids):
+    import hgtiles.geo as hgge
+
+    return block_tiles(hgge.get_tiles, filepath, tile_ids)
+
+def get_handler(filetype):
+    '''
+    Get the function that generates tiles for a filetype.
+
+    Parameters
+    ----------
+    filetype: str
+        The filetype (e.g. 'cooler')
+
+    Returns
+    -------
+    tiles_function: function(filepath, tile_ids)
+        The function that generates tiles for this filetype
+    '''
+    if filetype not in handlers:
+        raise ValueError('No tile handler for filetype: {}'.format(filetype))
+
+    (module_name, function_name) = handlers[filetype]
+    return getattr(importlib.import_module(module_name), function_name)
+
+def get_pool(num_workers=None):
+    '''
+    Get the process pool that tiles are generated on, creating it if
+    necessary. The worker processes are long lived, so the file handles
+    and metadata cached by each tile module stay warm between requests.
+
+    Workers are spawned rather than forked so that they never inherit
+    open file handles from the parent process.
+
+    Parameters
+    ----------
+    num_workers: int
+        The number of worker processes. Defaults to the number of CPUs.
+        Only used when the pool is created.
+    '''
+    global pool
+
+    if pool is None:
+        pool = cf.ProcessPoolExecutor(max_workers=num_workers,
+                mp_context=mp.get_context('spawn'))
+
+    return pool
+
+def shutdown():
+    '''
+    Stop the worker processes.
+    '''
+    global pool
+
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+def pack_dense(tiles):
+    '''
+    Move the encoded arrays of a list of tiles into a block of shared
+    memory so that they don't have to be pickled and sent through a pipe
+    back to the parent process.
+
+    Parameters
+    ----------
+    tiles: [(tile_id, tile_value),...]
+        A list of tile_id, tile_data tuples
+
+    Returns
+    -------
+    (tiles, shm_name): ([(tile_id, tile_value),...], str)
+        The tiles, where the packed values are replaced by (offset, length)
+        tuples pointing into the block of shared memory with the name shm_name
+    '''
+    payloads = []
+    packed_tiles = []
+
+    for tile_id, tile_value in tiles:
+        if isinstance(tile_value, dict):
+            tile_value = dict(tile_value)
+
+            for key in DENSE_KEYS:
+                if isinstance(tile_value.get(key), str):
+                    payloads += [(tile_value, key, tile_value[key].encode('ascii'))]
+
+        packed_tiles += [(tile_id, tile_value)]
+
+    if not payloads:
+        return (tiles, None)
+
+    shm = shared_memory.SharedMemory(create=True,
+            size=sum(len(p[2]) for p in payloads))
+
+    offset = 0
+    for (tile_value, key, data) in payloads:
+        shm.buf[offset:offset + len(data)] = data
+        tile_value[key] = (offset, len(data))
+        offset += len(data)
+
+    shm.close()
+
+    return (packed_tiles, shm.name)
+
+def unpack_dense(tiles, shm_name):
+    '''
+    Read the encoded arrays packed by `pack_dense` and free the
+    shared memory they were stored in.
+    '''
+    if shm_name is None:
+        return tiles
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        for tile_id, tile_value in tiles:
+            if isinstance(tile_value, dict):
+                for key in DENSE_KEYS:
+                    if isinstance(tile_value.get(key), tuple):
+                        (offset, length) = tile_value[key]
+                        tile_value[key] = bytes(shm.buf[offset:offset + length]).decode('ascii')
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return tiles
+
+def generate_tiles(filetype, filepath, tile_ids, use_shared_memory=False):
+    '''
+    Generate tiles for one tileset. This is what runs in the
+    worker processes.
+    '''
+    tiles = get_handler(filetype)(filepath, tile_ids)
+
+    if use_shared_memory:
+        return pack_dense(tiles)
+
+    return (tiles, None)
+
+def run_jobs(jobs, tile_values, num_workers=None, use_shared_memory=False):
+    '''
+    Generate the tiles of each (filetype, filepath, tile_ids) job on the
+    process pool, storing them in tile_values.
+
+    Returns
+    -------
+    (lost_jobs, error): ([(filetype, filepath, tile_ids),...], Exception)
+        The jobs that weren't run because the pool is broken (i.e. a
+        worker process died) and the first error raised by any other job
+    '''
+    executor = get_pool(num_workers)
+    futures = []
+    lost_jobs = []
+    error = None
+
+    for job in jobs:
+        try:
+            futures += [(job, executor.submit(generate_tiles, *job, use_shared_memory))]
+        except BrokenProcessPool:
+            lost_jobs += [job]
+
+    for (job, future) in futures:
+        # collect every result, even after an error, so that
+        # no shared memory is left behind
+        try:
+            (tileset_tiles, shm_name) = future.result()
+        except BrokenProcessPool:
+            lost_jobs += [job]
+            continue
+        except Exception as ex:
+            logger.error(ex)
+            error = error or ex
+            continue
+
+        for tile_id, tile_value in unpack_dense(tileset_tiles, shm_name):
+            tile_values[tile_id] = tile_value
+
+    return (lost_jobs, error)
+
+def tiles(tile_ids, tilesets, filetypes={}, num_workers=None, use_shared_memory=False):
+    '''
+    Generate tiles from any number of tilesets on a pool of
+    worker processes.
+
+    Parameters
+    ----------
+    tile_ids: [str,...]
+        A list of tile_ids (e.g. xyx.0.0.1). The part before the first
+        '.' identifies the tileset.
+    tilesets: {uuid: filepath}
+        The file that each tileset is stored in
+    filetypes: {uuid: filetype}
+        The filetypes of tilesets whose filetype can't be inferred
+        from their filename (see `hgtiles.utils.infer_filetype`)
+    num_workers: int
+        The number of worker processes, if the pool hasn't been
+        created yet (see `get_pool`)
+    use_shared_memory: bool
+        Return the encoded arrays of dense tiles through shared
+        memory rather than through a pipe. The arrays are still
+        copied in and out of the shared memory, so this is slower
+        for small requests and only pays off (by 10-15%) for requests
+        returning more than a few megabytes of dense tiles, e.g. 16 or
+        more cooler tiles (see benchmarks/dispatch.py).
+
+    Returns
+    -------
+    tile_list: [(tile_id, tile_data),...]
+        A list of tile_id, tile_data tuples in the order that
+        they were requested
+    '''
+    use_shared_memory = use_shared_memory and shared_memory is not None
+
+    tile_ids_by_tileset = col.OrderedDict()
+    for tile_id in tile_ids:
+        uuid = tile_id.split('.')[0]
+        tile_ids_by_tileset.setdefault(uuid, []).append(tile_id)
+
+    # check every tileset before submitting anything, so that no
+    # request is left running (and holding shared memory) on an error
+    jobs = []
+
+    for uuid, tileset_tile_ids in tile_ids_by_tileset.items():
+        if uuid not in tilesets:
+            raise ValueError('Unknown tileset: {}'.format(uuid))
+
+        filepath = tilesets[uuid]
+        filetype = filetypes.get(uuid, hgut.infer_filetype(filepath))
+
+        if filetype not in handlers:
+            raise ValueError('No tile handler for filetype {} ({})'.format(filetype, filepath))
+
+        jobs += [(filetype, filepath, tileset_tile_ids)]
+
+    tile_values = {}
+    (lost_jobs, error) = run_jobs(jobs, tile_values, num_workers, use_shared_memory)
+
+    if lost_jobs:
+        # a worker process died (e.g. it was killed for running out of
+        # memory), which breaks the whole pool, so start a new pool and
+        # try the lost tilesets once more
+        logger.warning('Worker process died, restarting the process pool')
+        shutdown()
+
+        (lost_jobs, retry_error) = run_jobs(lost_jobs, tile_values,
+                num_workers, use_shared_memory)
+        error = error or retry_error
+
+    if lost_jobs:
+        # don't leave a broken pool behind for the next request
+        shutdown()
+        error = error or BrokenProcessPool(
+                'Worker processes died while generating tiles')
+
+    if error is not None:
+        raise error
+
+    return [(tile_id, tile_values[tile_id]) for tile_id in tile_ids
+            if tile_id in tile_values]
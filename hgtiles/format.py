@@ -1,5 +1,6 @@
 import base64
 import numpy as np
+import pandas as pd
 
 def format_dense_tile(data):
     '''
@@ -56,3 +57,273 @@ def format_dense_tile(data):
 
     return tile_data
 
+
+def format_envelope_tile(dense, mins, maxs, coverage):
+    '''
+    Format the mean, minimum, maximum and coverage of each bin into a
+    dense tile (see `format_dense_tile`) with additional 'mins', 'maxs'
+    and 'coverage' arrays. All of the arrays are encoded using the
+    tile's dtype, which is only float16 if every array fits into it.
+
+    Parameters
+    ----------
+    dense: np.array
+        The mean of each bin
+    mins: np.array
+        The minimum of each bin
+    maxs: np.array
+        The maximum of each bin
+    coverage: np.array
+        The fraction of each bin that has data
+
+    Returns
+    -------
+    tile_data: {'dense': str, 'mins': str, 'maxs': str,
+                'coverage': str, 'dtype': str}
+    '''
+    tile_data = format_dense_tile(dense)
+    extra = (('mins', mins), ('maxs', maxs), ('coverage', coverage))
+
+    if tile_data['dtype'] == 'float16':
+        min_f16 = np.finfo('float16').min
+        max_f16 = np.finfo('float16').max
+
+        for key, data in extra:
+            if np.isnan(data).any() or not (
+                    np.all(data > min_f16) and np.all(data < max_f16)):
+                tile_data.update({
+                    'dense': base64.b64encode(dense.astype('float32')).decode('utf-8'),
+                    'dtype': 'float32'
+                })
+                break
+
+    for key, data in extra:
+        tile_data[key] = base64.b64encode(
+                data.astype(tile_data['dtype'])).decode('utf-8')
+
+    return tile_data
+
+
+def encode_array(values, dtype, binary):
+    if binary:
+        return base64.b64encode(np.asarray(values, dtype=dtype)).decode('utf-8')
+    return np.asarray(values, dtype=dtype).tolist()
+
+def decode_array(data, dtype, binary):
+    if binary:
+        return np.frombuffer(base64.b64decode(data), dtype=dtype)
+    return np.asarray(data, dtype=dtype)
+
+def column_dtype(values):
+    '''
+    The most compact dtype that can store a column of numbers exactly.
+    '''
+    arr = np.asarray(values)
+
+    if arr.dtype.kind in 'iub':
+        if len(arr) == 0 or (arr.min() >= np.iinfo('int32').min and
+                arr.max() <= np.iinfo('int32').max):
+            return 'int32'
+        return 'int64'
+
+    return 'float64'
+
+def format_columnar_tile(rows, columns, interned=('uid', 'fields'), binary=False):
+    '''
+    Format a list of row dicts (e.g. the intervals in a beddb tile)
+    as parallel arrays rather than one dict per row.
+
+    Strings in the interned keys are stored once, in a table of unique
+    values, and referred to by their index into that table. Interned
+    values can be strings or lists of strings (e.g. `fields`), in which
+    case the indices of all the rows are concatenated and
+    `offsets[key][i]:offsets[key][i+1]` are the indices of row i.
+
+    Parameters
+    ----------
+    rows: [dict,...]
+        The rows of the tile, all with the same keys
+    columns: [str,...]
+        The keys with numeric values
+    interned: [str,...]
+        The keys with string (or list of strings) values
+    binary: bool
+        Encode arrays as base64 strings rather than JSON lists
+
+    Returns
+    -------
+    tile_data: dict
+        {
+            'length': number of rows,
+            'binary': bool,
+            'columns': {key: array},
+            'dtypes': {key: dtype},
+            'tables': {key: [str,...]},
+            'offsets': {key: array}
+        }
+        Keys which are neither numeric nor interned are stored
+        in columns as plain lists.
+    '''
+    arrays = {}
+    tables = {}
+    offsets = {}
+
+    if rows:
+        for key in rows[0].keys():
+            values = [r[key] for r in rows]
+
+            if key in columns:
+                values = np.asarray(values, dtype=column_dtype(values))
+            elif key in interned:
+                table = {}
+
+                if isinstance(values[0], list):
+                    offsets[key] = np.cumsum([0] + [len(v) for v in values])
+                    values = [table.setdefault(s, len(table)) for v in values for s in v]
+                else:
+                    values = [table.setdefault(v, len(table)) for v in values]
+
+                values = np.asarray(values, dtype='uint32')
+                tables[key] = list(table.keys())
+
+            arrays[key] = values
+
+    return format_columnar_arrays(len(rows), arrays, tables, offsets, binary)
+
+def format_columnar_rows(tile_rows, columns, uids, fields=None, values=None, binary=False):
+    '''
+    Format a set of tiles as parallel arrays (see `format_columnar_tile`)
+    directly from the columns of all the rows they contain, without
+    creating a dict per row.
+
+    The uids and fields of all the rows are interned once and each
+    tile's table contains only the values that it uses.
+
+    Parameters
+    ----------
+    tile_rows: {pos: np.array}
+        The indices of the rows in each tile
+    columns: {key: np.array}
+        The numeric values of every row
+    uids: [str,...]
+        The uid of every row
+    fields: [str,...] or None
+        The tab separated fields of every row
+    values: {key: list} or None
+        Other values of every row, which are stored as is
+    binary: bool
+        Encode arrays as base64 strings rather than JSON lists
+
+    Returns
+    -------
+    tiles: {pos: tile_data}
+        The tiles, indexed by position
+    '''
+    (uid_ids, uid_table) = pd.factorize(list(uids))
+
+    if fields is not None:
+        field_counts = np.array([f.count('\t') + 1 for f in fields], dtype=np.int64)
+        field_starts = np.cumsum(field_counts) - field_counts
+        (field_ids, field_table) = pd.factorize(
+                '\t'.join(fields).split('\t') if len(fields) else [])
+
+    tiles = {}
+
+    for pos, idx in tile_rows.items():
+        tile_columns = {key: column[idx] for key, column in columns.items()}
+        tables = {}
+        offsets = {}
+
+        (tile_uids, tile_columns['uid']) = np.unique(uid_ids[idx], return_inverse=True)
+        tables['uid'] = uid_table[tile_uids].tolist()
+
+        if fields is not None:
+            # the positions of this tile's fields in field_ids
+            counts = field_counts[idx]
+            tile_offsets = np.cumsum(counts) - counts
+            field_pos = (np.repeat(field_starts[idx] - tile_offsets, counts) +
+                    np.arange(counts.sum()))
+
+            (tile_fields, tile_columns['fields']) = np.unique(
+                    field_ids[field_pos], return_inverse=True)
+            tables['fields'] = field_table[tile_fields].tolist()
+            offsets['fields'] = np.append(tile_offsets, counts.sum())
+
+        for key, column in (values or {}).items():
+            tile_columns[key] = [column[i] for i in idx]
+
+        tiles[pos] = format_columnar_arrays(len(idx), tile_columns,
+                tables=tables, offsets=offsets, binary=binary)
+
+    return tiles
+
+def format_columnar_arrays(length, columns, tables=None, offsets=None, binary=False):
+    '''
+    Encode a tile whose values have already been split into columns
+    and interned (see `format_columnar_tile`).
+
+    Parameters
+    ----------
+    length: int
+        The number of rows
+    columns: {key: np.array or list}
+        The values of each key. Arrays are encoded (interned keys are
+        indices into their table) and lists are stored as is.
+    tables: {key: [str,...]}
+        The unique values of each interned key
+    offsets: {key: np.array}
+        The boundaries of each row's indices, for interned keys whose
+        values are lists of strings
+    binary: bool
+        Encode arrays as base64 strings rather than JSON lists
+    '''
+    tables = tables or {}
+    offsets = offsets or {}
+
+    tile_data = {
+        'length': length,
+        'binary': binary,
+        'columns': {},
+        'dtypes': {},
+        'tables': {key: list(table) for key, table in tables.items()},
+        'offsets': {key: encode_array(o, 'uint32', binary) for key, o in offsets.items()}
+    }
+
+    for key, values in columns.items():
+        if isinstance(values, np.ndarray):
+            dtype = 'uint32' if key in tables else column_dtype(values)
+
+            tile_data['columns'][key] = encode_array(values, dtype, binary)
+            tile_data['dtypes'][key] = dtype
+        else:
+            tile_data['columns'][key] = values
+
+    return tile_data
+
+def columnar_tile_to_rows(tile_data):
+    '''
+    Convert a tile created by `format_columnar_tile` back into
+    a list of row dicts.
+    '''
+    binary = tile_data['binary']
+    columns = {}
+
+    for key, values in tile_data['columns'].items():
+        if key not in tile_data['dtypes']:
+            columns[key] = values
+            continue
+
+        values = decode_array(values, tile_data['dtypes'][key], binary).tolist()
+
+        if key in tile_data['tables']:
+            table = tile_data['tables'][key]
+            values = [table[i] for i in values]
+
+            if key in tile_data['offsets']:
+                offsets = decode_array(tile_data['offsets'][key], 'uint32', binary).tolist()
+                values = [values[offsets[i]:offsets[i+1]]
+                        for i in range(tile_data['length'])]
+
+        columns[key] = values
+
+    return [dict(zip(columns.keys(), row)) for row in zip(*columns.values())]
@@ -3,6 +3,12 @@ import math
 import os
 import sqlite3
 import collections as col
+import hgtiles.format as hgfo
+import numpy as np
+
+# the numeric values of each annotation, for columnar tiles
+# (see `hgtiles.format.format_columnar_tile`)
+COLUMNS = ('xStart', 'xEnd', 'yStart', 'yEnd', 'importance')
 
 
 def get_tile_box(zoom, x, y):
@@ -75,7 +81,7 @@ def tileset_info(filepath):
     return o
 
 
-def get_tiles(db_file, zoom, x, y, width=1, height=1):
+def get_tiles(db_file, zoom, x, y, width=1, height=1, columnar=False):
     '''
     Retrieve a contiguous set of tiles from a 2D db tile file.
 
@@ -93,6 +99,10 @@ def get_tiles(db_file, zoom, x, y, width=1, height=1):
         The width of the block of tiles to retrieve
     height: int
         The height of the block of tiles to retrieve
+    columnar: bool or 'binary'
+        Return each tile as parallel arrays rather than a list of
+        dicts (see `hgtiles.format.format_columnar_tile`). If 'binary',
+        the arrays are base64 encoded.
 
     Returns
     -------
@@ -132,6 +142,11 @@ def get_tiles(db_file, zoom, x, y, width=1, height=1):
         (zoom, lng_from, lng_to, lat_from, lat_to)
     ).fetchall()
 
+    if columnar:
+        conn.close()
+        return format_columnar_tiles(rows, zoom, x, y, width, height,
+                binary=(columnar == 'binary'))
+
     new_rows = col.defaultdict(list)
 
     for r in rows:
@@ -183,3 +198,47 @@ def get_tiles(db_file, zoom, x, y, width=1, height=1):
     conn.close()
 
     return new_rows
+
+def parse_json(value):
+    try:
+        return json.loads(value)
+    except Exception:
+        return None
+
+def decode(value):
+    try:
+        return value.decode('utf-8')
+    except AttributeError:
+        return value
+
+def format_columnar_tiles(rows, zoom, x, y, width=1, height=1, binary=False):
+    '''
+    Format a block of tiles as parallel arrays (see
+    `hgtiles.format.format_columnar_rows`) directly from the rows
+    returned by the query in `get_tiles`.
+    '''
+    (min_lngs, max_lngs, max_lats, min_lats, uids, importances, geometries,
+            properties, ids) = zip(*rows) if rows else [()] * 9
+
+    columns = dict(zip(COLUMNS, map(np.array,
+        [min_lngs, max_lngs, max_lats, min_lats, importances])))
+
+    # the tile positions of each annotation's corners
+    (x_starts, y_starts) = np.array([get_tile_pos_from_lng_lat(lng, lat, zoom)
+        for lng, lat in zip(min_lngs, max_lats)]).reshape(-1, 2).T
+    (x_ends, y_ends) = np.array([get_tile_pos_from_lng_lat(lng, lat, zoom)
+        for lng, lat in zip(max_lngs, min_lats)]).reshape(-1, 2).T
+
+    # the same overlap test as for tiles of dicts
+    tile_rows = {}
+    for i in range(x, x + width):
+        in_x = (x_starts < i + 1) & (x_ends >= i)
+
+        for j in range(y, y + height):
+            tile_rows[(i, j)] = np.flatnonzero(in_x & (y_starts < j + 1) & (y_ends >= j))
+
+    return hgfo.format_columnar_rows(tile_rows, columns, [decode(u) for u in uids],
+            values={'geometry': [parse_json(g) for g in geometries],
+                'properties': [parse_json(p) for p in properties],
+                'id': [decode(i) for i in ids]},
+            binary=binary)
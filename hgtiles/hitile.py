@@ -1,11 +1,25 @@
 import base64
+import collections as col
 import h5py
+import hgtiles.cache as hgca
+import hgtiles.utils as hgut
 import math
 import numpy as np
 import os
 import os.path as op
 import sys
 
+# the datasets stored for each zoom level
+DATASET_PREFIXES = ('values_', 'mins_', 'maxs_', 'nan_values_')
+
+# the number of hitile files kept open (see `files`)
+MAX_OPEN_FILES = 64
+
+# the version of the files written by `chunks_to_hitile`. Files without a
+# version were written before the values were sums of the non-NaN values
+# and before the NaN counts were filled in (see `get_tiles_data`)
+FORMAT_VERSION = 2
+
 def array_to_hitile(old_data, filename, zoom_step=8, chunks=(1e6,), agg_function=np.sum):
     '''
     Downsample a dataset so that it's compatible with HiGlass (filetype: hitile, datatype: vector)
@@ -13,98 +27,164 @@ def array_to_hitile(old_data, filename, zoom_step=8, chunks=(1e6,), agg_function
     Parameters
     ----------
     old_data: np.array
-        A numpy array containing the data to be downsampled
+        A numpy array (or a memmap, dask array or HDF5 dataset) containing
+        the data to be downsampled. It's read one chunk at a time.
     filename: string
         The output filename where the resulting multi-resolution
         data will be stored.
     zoom_step: int
         The number of zoom levels to skip when aggregating
+    chunks: (int,)
+        The number of values to read at a time
+    agg_function: function
+        How values are aggregated. Only sums are supported because they're
+        divided by the number of non-NaN values when tiles are retrieved.
     '''
-    import dask.array as da
+    if agg_function not in (np.sum, np.nansum):
+        raise ValueError('Only sums are supported as the agg_function')
 
+    chunk_size = int(chunks[0])
+
+    chunks_to_hitile((old_data[i:i + chunk_size]
+        for i in range(0, len(old_data), chunk_size)),
+        filename, len(old_data), zoom_step=zoom_step)
+
+def chunks_to_hitile(chunks, filename, length, zoom_step=8, tile_size=1024):
+    '''
+    Write a hitile file from consecutive chunks of data in a single pass.
+
+    Every stored zoom level is aggregated as the chunks are read, so only
+    one chunk (plus fewer than 2 ** zoom_step values per stored zoom level)
+    is ever held in memory. Each stored zoom level contains:
+
+        values_z        the sum of the non-NaN values in each bin
+                        (NaN if there are none)
+        mins_z          the minimum of the non-NaN values in each bin
+        maxs_z          the maximum of the non-NaN values in each bin
+        nan_values_z    the number of NaN values in each bin, where
+                        positions beyond the end of the data count as NaN
+
+    Parameters
+    ----------
+    chunks: iterator over np.array
+        Consecutive chunks of the data (e.g. read from a memmap)
+    filename: string
+        The output filename
+    length: int
+        The total length of the data
+    zoom_step: int
+        The number of zoom levels to skip when aggregating
+    tile_size: int
+        The number of values in each tile
+    '''
     if op.exists(filename):
         os.remove(filename)
-    
-    f_new = h5py.File(filename, 'w')
-    
-    tile_size = 1024
-    min_pos = 0
-    max_pos = len(old_data)
-
 
-    # we store every n'th zoom level
     zoom_factor = 2 ** zoom_step
-    
-    max_zoom = math.ceil(math.log(max_pos / tile_size) / math.log(2))
-        
-    meta = f_new.create_dataset('meta', (1,), dtype='f')
-    meta.attrs['tile-size'] = tile_size
-    meta.attrs['zoom-step'] = zoom_step
-    meta.attrs['max-length'] = max_pos
-    meta.attrs['max-zoom'] = max_zoom
-
-    meta.attrs['max-width'] = tile_size * 2 ** max_zoom
-
-    prev_length = max_pos  
-
-    min_data = da.from_array(old_data, chunks)
-    max_data = da.from_array(old_data, chunks)
-
-    for z in range(0, max_zoom, zoom_step):
-        dset_length = math.ceil(max_pos / 2 ** z)
-
-        values_dset = f_new.require_dataset('values_' + str(z), (len(old_data),), 
-                             dtype='f', compression='gzip' )
-
-        mins_dset = f_new.require_dataset('mins_' + str(z), (len(old_data),), 
-                             dtype='f', compression='gzip' )
-        maxs_dset = f_new.require_dataset('maxs_' + str(z), (len(old_data),), 
-                             dtype='f', compression='gzip' )
-
-        nan_values_dset = f_new.require_dataset('nan_values_' + str(z), (len(old_data),), 
-                             dtype='f', compression='gzip')
-
-        da.store(old_data, values_dset)
-        da.store(min_data, mins_dset)
-        da.store(max_data, maxs_dset)
-        # f_new['values_' + str(z)][:] = old_data
-
-        # see if we need to pad the end of the dataset
-        # if so, use the previous last value
-        if len(old_data) % zoom_factor != 0:
-            old_data = da.concatenate(
-                (old_data, [old_data[-1]] * ( zoom_factor - len(old_data) % zoom_factor )))
-            min_data = da.concatenate(
-                (min_data, [max_data[-1]] * ( zoom_factor - len(min_data) % zoom_factor )))
-            max_data = da.concatenate(
-                (max_data, [max_data[-1]] * ( zoom_factor - len(max_data) % zoom_factor )))
-
-        # aggregate the data by summing adjacent datapoints
-        # sys.stdout.write('summing...')
-        # sys.stdout.flush()
-        # print("fdsdsfs:", math.ceil(len(old_data) / zoom_factor), zoom_factor)
-        # print("chunks:", chunks, zoom_factor, 'len:', len(old_data))
-
-        old_data = old_data.rechunk(chunks)
-        min_data = old_data.rechunk(chunks)
-        max_data = old_data.rechunk(chunks)
-        # print('zoom_factor', zoom_factor, old_data.shape)
-
-        old_data = da.coarsen(agg_function, old_data, {0: zoom_factor})
-        min_data = da.coarsen(np.min, max_data, {0: zoom_factor})
-        max_data = da.coarsen(np.max, max_data, {0: zoom_factor})
-        
-        # reshape( (math.ceil(len(old_data) / zoom_factor), zoom_factor)).sum(axis=1)
-        #sys.stdout.write(' done\n')
-        #sys.stdout.flush()
-
-        '''
-        if len(old_data) < 10000:
-            plt.plot(old_data)
-        '''
-
-    #plt.plot(old_data) 
-    f_new.close()
+    max_zoom = max(0, math.ceil(math.log(max(length, 1) / tile_size) / math.log(2)))
+
+    with h5py.File(filename, 'w') as f_new:
+        meta = f_new.create_dataset('meta', (1,), dtype='f')
+        meta.attrs['tile-size'] = tile_size
+        meta.attrs['zoom-step'] = zoom_step
+        meta.attrs['max-length'] = length
+        meta.attrs['max-zoom'] = max_zoom
+
+        meta.attrs['max-width'] = tile_size * 2 ** max_zoom
+        meta.attrs['version'] = FORMAT_VERSION
+
+        # the stored zoom levels, including the one that zoom level 0
+        # (i.e. max_zoom levels up from the data) is aggregated from
+        levels = []
+        for z in range(0, max_zoom + 1, zoom_step):
+            dset_length = math.ceil(length / 2 ** z)
+
+            datasets = []
+            for prefix in DATASET_PREFIXES:
+                if z == 0 and prefix in ('mins_', 'maxs_'):
+                    # the minimum and maximum of a single value are the
+                    # value itself, so link to it rather than storing it
+                    # two more times
+                    f_new[prefix + str(z)] = f_new['values_' + str(z)]
+                    datasets += [None]
+                else:
+                    datasets += [f_new.create_dataset(prefix + str(z), (dset_length,),
+                        dtype='f', compression='gzip')]
+
+            levels += [{
+                'zoom': z,
+                'datasets': datasets,
+                'position': 0,
+                'carry': None
+            }]
+
+        num_values = 0
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=np.float64)
+            nans = np.isnan(chunk)
+
+            write_hitile_level(levels, 0,
+                    (np.where(nans, 0, chunk), chunk, chunk, nans.astype(np.float64)),
+                    zoom_factor)
+            num_values += len(chunk)
+
+        if num_values != length:
+            raise ValueError('Expected {} values but got {}'.format(length, num_values))
+
+        # write the last, partial bins of each zoom level
+        if len(levels) > 1:
+            write_hitile_level(levels, 1, None, zoom_factor, final=True)
+
+def write_hitile_level(levels, i, block, zoom_factor, final=False):
+    '''
+    Write a block of (sums, mins, maxs, nan_counts) from the previous stored
+    zoom level (or the data, if i == 0) to stored zoom level i and all of
+    the levels above it.
+
+    Values are aggregated in groups of zoom_factor. Values left over from
+    incomplete groups are carried over to the next block, unless this is
+    the final block, in which case the last group is padded with NaNs.
+    '''
+    level = levels[i]
+
+    if i > 0:
+        if block is None:
+            block = tuple(np.zeros(0) for prefix in DATASET_PREFIXES)
+        if level['carry'] is not None:
+            block = tuple(np.concatenate(x) for x in zip(level['carry'], block))
+            level['carry'] = None
+
+        if final and len(block[0]) % zoom_factor:
+            # the bins past the end of the data count as NaN
+            padding = zoom_factor - len(block[0]) % zoom_factor
+            bin_width = 2 ** levels[i - 1]['zoom']
+            block = tuple(np.concatenate((x, np.full(padding, fill)))
+                    for x, fill in zip(block, (0, np.nan, np.nan, bin_width)))
+
+        num_complete = len(block[0]) // zoom_factor * zoom_factor
+        if num_complete < len(block[0]):
+            level['carry'] = tuple(x[num_complete:] for x in block)
+
+        (sums, mins, maxs, nans) = (x[:num_complete].reshape((-1, zoom_factor))
+                for x in block)
+        block = (sums.sum(axis=1), np.fmin.reduce(mins, axis=1),
+                np.fmax.reduce(maxs, axis=1), nans.sum(axis=1))
+
+    (sums, mins, maxs, nans) = block
+    start = level['position']
+    end = start + len(sums)
+
+    if end > start:
+        values = np.where(nans == 2 ** level['zoom'], np.nan, sums)
+
+        for dset, x in zip(level['datasets'], (values, mins, maxs, nans)):
+            if dset is not None:
+                dset[start:end] = x
+
+        level['position'] = end
+
+    if i + 1 < len(levels):
+        write_hitile_level(levels, i + 1, block, zoom_factor, final)
 
 def aggregate(a, num_to_agg):
     if len(a) % num_to_agg != 0:
@@ -116,21 +196,86 @@ def aggregate_min(a, num_to_agg):
     if len(a) % num_to_agg != 0:
         a = np.concatenate((a, [a[-1]] * ( num_to_agg - len(a) % num_to_agg)))
 
-    return a.reshape((math.ceil(len(a) / num_to_agg), num_to_agg)).min(axis=1)
+    # NaNs are ignored unless every value is NaN
+    return np.fmin.reduce(a.reshape((math.ceil(len(a) / num_to_agg), num_to_agg)), axis=1)
 
 def aggregate_max(a, num_to_agg):
     if len(a) % num_to_agg != 0:
         a = np.concatenate((a, [a[-1]] * ( num_to_agg - len(a) % num_to_agg)))
 
-    return a.reshape((math.ceil(len(a) / num_to_agg), num_to_agg)).max(axis=1)
+    return np.fmax.reduce(a.reshape((math.ceil(len(a) / num_to_agg), num_to_agg)), axis=1)
+
+def read_range(dset, start_pos, end_pos, read_end=None, fill=np.nan):
+    '''
+    Read dset[start_pos:end_pos], filling the positions after read_end
+    (or past the end of the dataset) with a fill value.
+    '''
+    if read_end is None:
+        read_end = end_pos
+    read_end = min(read_end, len(dset))
+
+    a = np.full(end_pos - start_pos, fill, dtype=np.float64)
+    if read_end > start_pos:
+        a[:read_end - start_pos] = dset[start_pos:read_end]
+
+    return a
+
+def load_meta(hdf_file):
+    '''
+    Read the metadata of a hitile file.
+
+    Returns
+    -------
+    meta: dict
+        The attributes of the file's `meta` dataset, along with its
+        open datasets indexed by name
+    '''
+    d = hdf_file['meta']
+
+    tile_size = int(d.attrs['tile-size'])
+    max_zoom = int(d.attrs['max-zoom'])
+    max_width = tile_size * 2 ** max_zoom
+
+    return {
+        'tile_size': tile_size,
+        'zoom_step': int(d.attrs['zoom-step']),
+        'max_length': int(d.attrs['max-length']),
+        'max_zoom': max_zoom,
+        'max_width': max_width,
+        'min_pos': d.attrs['min-pos'] if 'min-pos' in d.attrs else 0,
+        'max_pos': d.attrs['max-pos'] if 'max-pos' in d.attrs else d.attrs['max-length'],
+        'max_position': int(d.attrs['max-position']) if 'max-position' in d.attrs else max_width,
+        'version': int(d.attrs['version']) if 'version' in d.attrs else 1,
+        'datasets': {name: hdf_file[name] for name in hdf_file if name != 'meta'}
+    }
+
+def open_hitile(filepath):
+    '''
+    Open a hitile file (read-only) and read its metadata.
+    '''
+    f = h5py.File(filepath, 'r')
+
+    try:
+        return (f, load_meta(f))
+    except Exception:
+        f.close()
+        raise
+
+# open hitile files along with their metadata, indexed by filepath.
+# Use `files.invalidate(filepath)` or `files.clear()` to close them.
+files = hgca.HandleCache(open_hitile,
+        closer=lambda file_and_meta: file_and_meta[0].close(),
+        max_size=MAX_OPEN_FILES)
 
-def get_data(hdf_file, z, x):
+def get_data(hdf_file, z, x, meta=None):
     '''
     Return a tile from an hdf_file.
 
     :param hdf_file: A file handle for an HDF5 file (h5py.File('...'))
     :param z: The zoom level
     :param x: The x position of the tile
+    :param meta: The metadata of the file (see `load_meta`), which is
+        read from the file if not provided
     '''
 
     # is the title within the range of possible tiles
@@ -141,25 +286,34 @@ def get_data(hdf_file, z, x):
         print("OUT OF LEFT RANGE")
         return ([],[],[])
 
-    d = hdf_file['meta'] 
-
-    tile_size = int(d.attrs['tile-size'])
-    zoom_step = int(d.attrs['zoom-step'])
-    max_length = int(d.attrs['max-length'])
-    max_zoom = int(d.attrs['max-zoom'])
+    (dense, mins, maxs) = get_tiles_data(hdf_file, z, x, 1, meta)
 
+    return (dense[0], mins[0], maxs[0])
 
-    if 'min-pos' in d.attrs:
-        min_pos = d.attrs['min-pos']
-    else:
-        min_pos = 0
+def get_tiles_data(hdf_file, z, x, num_tiles=1, meta=None):
+    '''
+    Return a run of adjacent tiles from an hdf_file. Each dataset is
+    read (and decompressed) once for the whole run and the tiles are
+    aggregated together.
 
-    max_width = tile_size * 2 ** max_zoom
+    :param hdf_file: A file handle for an HDF5 file (h5py.File('...'))
+    :param z: The zoom level
+    :param x: The x position of the first tile
+    :param num_tiles: The number of tiles
+    :param meta: The metadata of the file (see `load_meta`), which is
+        read from the file if not provided
+    :returns: (dense, mins, maxs), each an array of shape
+        (num_tiles, tile_size)
+    '''
+    if meta is None:
+        meta = load_meta(hdf_file)
 
-    if 'max-position' in d.attrs:
-        max_position = int(d.attrs['max-position'])
-    else:
-        max_position = max_width
+    tile_size = meta['tile_size']
+    zoom_step = meta['zoom_step']
+    max_zoom = meta['max_zoom']
+    max_width = meta['max_width']
+    max_position = meta['max_position']
+    datasets = meta['datasets']
 
     rz = max_zoom - z
     tile_width = max_width / 2**z
@@ -174,79 +328,64 @@ def get_data(hdf_file, z, x):
 
     # which positions we need to retrieve in order to dynamically aggregate
     start_pos = int((x * 2 ** zoom_offset * tile_size))
-    end_pos = int(start_pos + total_in_length)
+    end_pos = int(start_pos + total_in_length * num_tiles)
 
-    #print("max_position:", max_position)
     max_position = int(max_position / 2 ** next_stored_zoom)
-    #print("new max_position:", max_position)
-
-
-    #print("start_pos:", start_pos)
-    #print("end_pos:", end_pos)
-    #print("next_stored_zoom", next_stored_zoom)
-    #print("max_position:", int(max_position))
-    
-
-    f = hdf_file['values_' + str(int(next_stored_zoom))]
-    f_min = hdf_file['mins_' + str(int(next_stored_zoom))]
-    f_max = hdf_file['maxs_' + str(int(next_stored_zoom))]
-
 
-    if start_pos > max_position:
-        # we want a tile that's after the last bit of data
-        a = np.zeros(end_pos - start_pos)
-        a.fill(np.nan)
+    f = datasets['values_' + str(int(next_stored_zoom))]
+    f_min = datasets['mins_' + str(int(next_stored_zoom))]
+    f_max = datasets['maxs_' + str(int(next_stored_zoom))]
 
-        a_min = np.zeros(end_pos - start_pos)
-        a_min.fill(np.nan)
+    # positions after max_position and past the end of the stored
+    # data are NaN
+    read_end = min(max_position + 1, end_pos)
 
-        # umm, I don't think this needs to be here since
-        # everything should be nan
-        ret_array = aggregate(a, int(num_to_agg))
-        min_array = aggregate_min(a_min, int(num_to_agg))
-        max_array = aggregate_max(a_max, int(num_to_agg))
-    elif start_pos < max_position and max_position < end_pos:
-        a = f[start_pos:end_pos][:]
-        a[max_position+1:end_pos] = np.nan
+    # datasets that are linked to each other (e.g. the mins and maxs
+    # of the unaggregated data) are only read once
+    reads = {}
+    def read(dset, fill=np.nan):
+        if dset.id not in reads:
+            reads[dset.id] = read_range(dset, start_pos, end_pos, read_end, fill)
+        return reads[dset.id]
 
-        a_min = f_min[start_pos:end_pos][:]
-        a_min[max_position+1:end_pos] = np.nan
+    a = read(f)
+    a_min = read(f_min)
+    a_max = read(f_max)
 
-        a_max = f_max[start_pos:end_pos][:]
-        a_max[max_position+1:end_pos] = np.nan
-
-        ret_array = aggregate(a, int(num_to_agg))
-        min_array = aggregate_min(a_min, int(num_to_agg))
-        max_array = aggregate_max(a_max, int(num_to_agg))
-    else:
-        ret_array = aggregate(f[start_pos:end_pos], int(num_to_agg))
-        min_array = aggregate_min(f_min[start_pos:end_pos], int(num_to_agg))
-        max_array = aggregate_max(f_max[start_pos:end_pos], int(num_to_agg))
-
-
-    #print("ret_array:", f[start_pos:end_pos])
-    #print('ret_array:', ret_array)
-    
-    #print('nansum', np.nansum(ret_array))
+    shape = (num_tiles, tile_size)
+    min_array = aggregate_min(a_min, int(num_to_agg)).reshape(shape)
+    max_array = aggregate_max(a_max, int(num_to_agg)).reshape(shape)
 
     # check to see if we counted the number of NaN values in the given
     # interval
 
-    f_nan = None
-    if "nan_values_" + str(int(next_stored_zoom)) in hdf_file:
-        f_nan = hdf_file['nan_values_' + str(int(next_stored_zoom))]
-        nan_array = aggregate(f_nan[start_pos:end_pos], int(num_to_agg))
+    if "nan_values_" + str(int(next_stored_zoom)) in datasets:
+        f_nan = datasets['nan_values_' + str(int(next_stored_zoom))]
+
+        # every stored value past the end covers 2 ** next_stored_zoom
+        # positions without any data
+        nan_array = aggregate(read(f_nan, fill=2 ** next_stored_zoom), int(num_to_agg))
         num_aggregated = 2 ** (max_zoom - z)
 
-        num_vals_array = np.zeros(len(nan_array))
-        num_vals_array.fill(num_aggregated)
-        num_summed_array = num_vals_array - nan_array
+        num_summed_array = num_aggregated - nan_array
+
+        if meta['version'] >= 2:
+            # the sums skip bins that are entirely NaN
+            sum_array = np.nansum(a.reshape((-1, int(num_to_agg))), axis=1)
+        else:
+            # older files store sums that NaN values propagate through
+            # and NaN counts that are all 0, so any NaN makes the
+            # average NaN
+            sum_array = aggregate(a, int(num_to_agg))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages_array = sum_array / num_summed_array
 
-        averages_array = ret_array / num_summed_array
+        averages_array[num_summed_array <= 0] = np.nan
 
-        return (averages_array, min_array, max_array)
+        return (averages_array.reshape(shape), min_array, max_array)
 
-    return (ret_array, min_array, max_array)
+    return (aggregate(a, int(num_to_agg)).reshape(shape), min_array, max_array)
 
 def tileset_info(hitile_path):
     '''
@@ -265,19 +404,10 @@ def tileset_info(hitile_path):
                     'max_zoom': 7
                     }
     '''
-    hdf_file = h5py.File(hitile_path, 'r')
+    meta = files.get(hitile_path)[1]
 
-    d = hdf_file['meta']
-
-    if "min-pos" in d.attrs:
-        min_pos = d.attrs['min-pos']
-    else:
-        min_pos = 0
-
-    if "max-pos" in d.attrs:
-        max_pos = d.attrs['max-pos']
-    else:
-        max_pos = d.attrs['max-length']
+    min_pos = meta['min_pos']
+    max_pos = meta['max_pos']
 
     return {
                 "max_pos": [int(max_pos)],
@@ -286,8 +416,8 @@ def tileset_info(hitile_path):
                     math.log(max_pos - min_pos
                     ) / math.log(2)
                 ),
-                "max_zoom": int(d.attrs['max-zoom']),
-                "tile_size": int(d.attrs['tile-size'])
+                "max_zoom": meta['max_zoom'],
+                "tile_size": meta['tile_size']
             }
 
 def tiles(filepath, tile_ids):
@@ -307,51 +437,45 @@ def tiles(filepath, tile_ids):
     tile_list: [(tile_id, tile_data),...]
         A list of tile_id, tile_data tuples
     '''
-    generated_tiles = []
+    tile_positions = []
+    positions_by_zoom = col.defaultdict(list)
 
     for tile_id in tile_ids:
         tile_id_parts = tile_id.split('.')
-        tile_position = list(map(int, tile_id_parts[1:3]))
+        (zoom, xpos) = map(int, tile_id_parts[1:3])
 
-        (dense, mins, maxs) = get_data(
-            h5py.File(filepath),
-            tile_position[0],
-            tile_position[1]
-        )
+        tile_positions += [(zoom, xpos)]
+        positions_by_zoom[zoom] += [xpos]
 
-        if len(dense):
-            max_dense = max(dense)
-            min_dense = min(dense)
-        else:
-            max_dense = 0
-            min_dense = 0
-
-        min_f16 = np.finfo('float16').min
-        max_f16 = np.finfo('float16').max
-
-        has_nan = len([d for d in dense if np.isnan(d)]) > 0
-
-        '''
-        if (
-            not has_nan and
-            max_dense > min_f16 and max_dense < max_f16 and
-            min_dense > min_f16 and min_dense < max_f16
-        ):
-            tile_value = {
-                'dense': base64.b64encode(dense.astype('float16')).decode('utf-8'),
-                'mins': base64.b64encode(mins.astype('float16')).decode('utf-8'),
-                'maxs': base64.b64encode(mins.astype('float16')).decode('utf-8'),
-                'dtype': 'float16'
-            }
-        else:
-        '''
-        tile_value = {
-            'dense': base64.b64encode(dense.astype('float32')).decode('utf-8'),
-            'mins': base64.b64encode(mins.astype('float32')).decode('utf-8'),
-            'maxs': base64.b64encode(maxs.astype('float32')).decode('utf-8'),
-            'dtype': 'float32'
-        }
+    tile_values = {}
+
+    # all of the tiles share one open file, which isn't closed
+    # (e.g. by an eviction) until they've been generated
+    with files.acquire(filepath) as (hdf_file, meta):
+        for zoom, positions in positions_by_zoom.items():
+            # runs of adjacent tiles are read together
+            for (tile_x_pos, num_tiles) in hgut.consecutive_runs(
+                    [x for x in positions if 0 <= x <= 2 ** zoom]):
+                (dense, mins, maxs) = get_tiles_data(hdf_file, zoom,
+                        tile_x_pos, num_tiles, meta)
+
+                for i in range(num_tiles):
+                    tile_values[(zoom, tile_x_pos + i)] = format_tile(
+                            dense[i], mins[i], maxs[i])
 
-        generated_tiles += [(tile_id, tile_value)]
+    # tiles outside of the tileset are left out
+    return [(tile_id, tile_values[pos]) for (tile_id, pos) in zip(tile_ids, tile_positions)
+            if pos in tile_values]
 
-    return generated_tiles
+def format_tile(dense, mins, maxs):
+    '''
+    Encode the values of a tile.
+    '''
+    tile_value = {
+        'dense': base64.b64encode(dense.astype('float32')).decode('utf-8'),
+        'mins': base64.b64encode(mins.astype('float32')).decode('utf-8'),
+        'maxs': base64.b64encode(maxs.astype('float32')).decode('utf-8'),
+        'dtype': 'float32'
+    }
+
+    return tile_value
@@ -1,7 +1,12 @@
+import collections as col
 import h5py
-import math
+import hgtiles.cache as hgca
+import hgtiles.format as hgfo
+import hgtiles.utils as hgut
 import numpy as np
-import time
+
+# the number of multivec files kept open (see `files`)
+MAX_OPEN_FILES = 64
 
 def abs2genomic(chromsizes, start_pos, end_pos):
     '''
@@ -28,13 +33,74 @@ def abs2genomic(chromsizes, start_pos, end_pos):
       start = 0
     yield cid_hi, start, rel_pos_hi
 
-def get_tile(f, chromsizes, resolution, start_pos, end_pos, shape):
+def get_bin_offsets(chromsizes, resolution):
+    '''
+    Index the genome-wide bins of a resolution by chromosome.
+
+    Genome-wide bin i covers the absolute positions from i * resolution
+    to (i + 1) * resolution and its value is the value of the bin of the
+    chromosome that it starts in. Bins stay aligned with absolute
+    positions however many chromosomes come before them, so the last
+    bin of a chromosome is left out if no genome-wide bin starts in it.
+
+    Parameters:
+    -----------
+    chromsizes: [('chr1', 1000), ....]
+        An array listing the chromosome sizes
+    resolution: int
+        The size of each bin
+
+    Returns
+    -------
+    bin_offsets: np.array
+        The first genome-wide bin of each chromosome followed by the
+        number of genome-wide bins. Genome-wide bin j, where
+        bin_offsets[i] <= j < bin_offsets[i+1], is bin
+        j - bin_offsets[i] of chromosome i.
+    '''
+    chrom_offsets = np.r_[0, np.cumsum([c[1] for c in chromsizes])].astype(np.int64)
+
+    # the first genome-wide bin that starts in each chromosome
+    return -(-chrom_offsets // resolution)
+
+def tile_segments(bin_offsets, start_bin, end_bin):
+    '''
+    Find the bins of each chromosome in a range of genome-wide bins
+    (see `get_bin_offsets`).
+
+    Returns
+    -------
+    segments: [(cid, start_bin, end_bin, position),...]
+        The index of each chromosome in the range, its bins in the range
+        and where they start relative to the start of the range. Bins past
+        the end of the genome aren't in any segment.
+    '''
+    end_bin = min(end_bin, bin_offsets[-1])
+
+    if start_bin >= end_bin:
+        return []
+
+    cid_lo = np.searchsorted(bin_offsets, start_bin, side='right') - 1
+    cid_hi = np.searchsorted(bin_offsets, end_bin, side='left')
+
+    segments = []
+    for cid in range(cid_lo, cid_hi):
+        lo = max(start_bin, bin_offsets[cid])
+        hi = min(end_bin, bin_offsets[cid + 1])
+
+        if lo < hi:
+            segments += [(cid, int(lo - bin_offsets[cid]), int(hi - bin_offsets[cid]),
+                int(lo - start_bin))]
+
+    return segments
+
+def get_tile(f, chromsizes, resolution, start_pos, end_pos, shape, bin_offsets=None):
     '''
     Get the tile value given the start and end positions and
     chromosome positions. 
     
     Drop bins at the ends of chromosomes if those bins aren't
-    full.
+    full (see `get_bin_offsets`).
     
     Parameters:
     -----------
@@ -49,6 +115,9 @@ def get_tile(f, chromsizes, resolution, start_pos, end_pos, shape):
         The start_position of the interval to return
     end_pos: int
         The end position of the interval to return
+    bin_offsets: np.array
+        The index of the bins of each chromosome at this resolution,
+        if it has already been calculated (see `get_bin_offsets`)
         
     Returns
     -------
@@ -56,118 +125,156 @@ def get_tile(f, chromsizes, resolution, start_pos, end_pos, shape):
         A subset of the original genome-wide values containing
         the values for the portion of the genome that is visible.
     '''
-    binsize = resolution
-    # print('binsize:', binsize)
-    # print('start_pos:', start_pos, 'end_pos:', end_pos)
-    # print("length:", end_pos - start_pos)
-    # print('shape:', shape)
+    if bin_offsets is None:
+        bin_offsets = get_bin_offsets(chromsizes, resolution)
 
-    t0 = time.time()
-    arrays = []
-    count = 0
+    start_bin = start_pos // resolution
+    num_bins = min(shape[0], -(-(end_pos - start_pos) // resolution))
 
-    # keep track of how much data has been returned in bins
-    current_binned_data_position = 0
-    current_data_position = 0
-    
-    num_added = 0
-    total_length = 0
+    tile = np.zeros((num_bins, shape[1]))
 
-    for cid, start, end in abs2genomic([c[1] for c in chromsizes], start_pos, end_pos):
-        n_bins = int(np.ceil((end - start) / binsize))
-        total_length += end - start
-        #print('cid', cid, start, end, 'tl:', total_length)
-        
-        try:
-            t1 = time.time()
+    for cid, lo, hi, position in tile_segments(bin_offsets, start_bin, start_bin + num_bins):
+        read_bins(f['resolutions'][str(resolution)]['values'][chromsizes[cid][0]],
+                lo, hi, None, tile[position:position + hi - lo])
+
+    return tile
+
+def select_columns(num_rows, rows=None, row_groups=None):
+    '''
+    The columns of the stored values that are needed to return a
+    selection of rows or the means of groups of rows.
 
-            chrom = chromsizes[cid][0]
-            clen = chromsizes[cid][1]
+    Returns
+    -------
+    columns: [int,...] or None
+        The sorted column indices to read, or None if every column is needed
+    '''
+    if rows is not None and row_groups is not None:
+        raise ValueError('Only one of rows and row_groups can be given')
 
-            offset = current_binned_data_position - current_data_position
-            current_data_position += end - start
+    if rows is None and row_groups is None:
+        return None
 
-            count += 1
+    if rows is not None:
+        if len(rows) == 0:
+            raise ValueError('No rows selected')
 
-            start_pos = math.floor((start + offset) / binsize)
-            end_pos = math.ceil(end / binsize)
+        needed = set(rows)
+    else:
+        if len(row_groups) == 0 or any(len(group) == 0 for group in row_groups):
+            raise ValueError('Every row group needs at least one row')
 
-            if start_pos >= end_pos:
-                continue
+        needed = set(r for group in row_groups for r in group)
 
-            #print("start:", start, "end", end)
-            #print("sp", start_pos * binsize, end_pos * binsize)
-            #print('current_data_position:', current_data_position)
-            #print('current_binned_data_position:', current_binned_data_position)
-            #print('binsize:', binsize, 'resolution:', resolution)
-
-            '''
-            if start_pos == end_pos:
-                if current_data_position - current_binned_data_position > 0:
-                    # adding this data as a single bin even though it's not large
-                    # enough to cover one bin
-                    #print('catching up')
-                    end_pos += 1
-                else:
-                    #print('data smaller than the bin size', start, end, binsize)
-                    continue
-            '''
-            
-            # print("offset:", offset, "start_pos", start_pos, end_pos)
-            x = f['resolutions'][str(resolution)]['values'][chrom][start_pos:end_pos]
-            current_binned_data_position += binsize * (end_pos - start_pos)
-
-            # print("x:", x.shape)
-
-            # drop the very last bin if it is smaller than the binsize
-            '''
-            if len(x) > 1 and end == clen and clen % binsize != 0:
-                #print("dropping")
-                x = x[:-1]
-            '''
-
-            if len(x):
-                num_added += len(x)
-                # print('cid:', cid, end-start, total_length, 'num_added:', num_added, 'x:', sum(x))
-
-            t2 = time.time()
-
-            # print("time to fetch {}: {}".format(chrom, t2 - t1))
-        except IndexError:
-            # beyond the range of the available chromosomes
-            # probably means we've requested a range of absolute
-            # coordinates that stretch beyond the end of the genome
-            # print('zeroes')
-            x = np.zeros((n_bins, shape[1]))
-
-        arrays.append(x)
-
-    # print("total_length:", total_length)
-    # print('arrays:', len(np.concatenate(arrays)))
-    t3 = time.time()
-    # print("total fetch time:", t3 - t0)
-
-    return np.concatenate(arrays)[:shape[0]]
+    if any(r < 0 or r >= num_rows for r in needed):
+        raise ValueError('Row index out of range (the tileset has {} rows)'.format(num_rows))
 
-def tileset_info(filename):
+    return sorted(needed)
+
+def read_bins(dset, lo, hi, columns, out):
     '''
-    Return some information about this tileset that will
-    help render it in on the client.
+    Read dset[lo:hi], restricted to some columns, into an array (e.g.
+    part of a tile), using a single hyperslab if the columns are contiguous.
+    '''
+    if columns is None:
+        dset.read_direct(out, np.s_[lo:hi])
+    elif columns[-1] - columns[0] + 1 == len(columns):
+        dset.read_direct(out, np.s_[lo:hi, columns[0]:columns[-1] + 1])
+    else:
+        out[:] = dset[lo:hi, columns]
+
+def group_means(values, groups):
+    '''
+    The mean of the non-NaN values of each group of columns.
 
     Parameters
     ----------
-    filename: str
-      The filename of the h5py file containing the tileset info.
+    values: np.array
+        An array of shape (num_bins, num_columns)
+    groups: [[int,...],...]
+        The column indices in each group
 
     Returns
     -------
-    tileset_info: {}
-      A dictionary containing the information describing
-      this dataset
+    means: np.array
+        An array of shape (num_bins, len(groups))
+    '''
+    membership = np.zeros((values.shape[1], len(groups)))
+    for i, group in enumerate(groups):
+        membership[group, i] = 1
+
+    nans = np.isnan(values)
+    sums = np.where(nans, 0, values) @ membership
+    counts = (~nans) @ membership
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def get_tiles(f, info, zoom_level, tile_x_pos, num_tiles=1, rows=None, row_groups=None):
+    '''
+    Get the values of a run of adjacent tiles. The bins of each
+    chromosome in the run are read straight into one array, which is
+    split into the tiles, and only the columns needed for the requested
+    rows are read.
+
+    Parameters:
+    -----------
+    f: h5py.File
+        An open multivec file
+    info: dict
+        The metadata of the file (see `load_info`)
+    zoom_level: int
+        The zoom level of the tiles
+    tile_x_pos: int
+        The position of the first tile
+    num_tiles: int
+        The number of tiles
+    rows: [int,...]
+        Only return these rows, in this order. At least one row
+        must be given.
+    row_groups: [[int,...],...]
+        Return the mean of each group of rows rather than the rows
+        themselves (NaNs are ignored). Every group needs at least one row.
+
+    Returns
+    -------
+    tiles: [np.array,...]
+        The values of each tile (see `get_tile`), an array of shape
+        (tile_size, num_rows) where num_rows is the number of selected
+        rows or row groups. Bins past the end of the genome are 0.
+    '''
+    tsinfo = info['tileset_info']
+    resolution = tsinfo['resolutions'][zoom_level]
+    shape = tsinfo['shape']
+    tile_size = tsinfo['tile_size']
+
+    columns = select_columns(shape[1], rows, row_groups)
+    num_columns = shape[1] if columns is None else len(columns)
+
+    start_bin = tile_x_pos * tile_size
+    values = np.zeros((num_tiles * tile_size, num_columns))
+
+    for cid, lo, hi, position in tile_segments(info['bin_offsets'][resolution],
+            start_bin, start_bin + num_tiles * tile_size):
+        dset = get_dataset(f, info, resolution, info['chromsizes'][cid][0])
+        read_bins(dset, lo, hi, columns, values[position:position + hi - lo])
+
+    if columns is not None:
+        # the positions of the requested rows in the columns that were read
+        column_index = {c: i for i, c in enumerate(columns)}
+
+        if rows is not None:
+            values = values[:, [column_index[r] for r in rows]]
+        else:
+            values = group_means(values,
+                    [[column_index[r] for r in group] for group in row_groups])
+
+    return [values[i * tile_size:(i + 1) * tile_size] for i in range(num_tiles)]
+
+def load_tileset_info(f):
+    '''
+    Read the tileset info (see `tileset_info`) from an open multivec file.
     '''
-    t1 = time.time()
-    f = h5py.File(filename, 'r')
-    t2 = time.time()
     # a sorted list of resolutions, lowest to highest
     # awkward to write because a the numbers representing resolution
     # are datapoints / pixel so lower resolution is actually a higher
@@ -188,9 +295,6 @@ def tileset_info(filename):
     shape = list(f['resolutions'][str(resolutions[0])]['values'][first_chrom].shape)
     shape[0] = tile_size
 
-    t3 = time.time()
-    # print("tileset info time:", t3 - t2)
-
     tileset_info = {
       'resolutions': resolutions,
       'min_pos': min_pos,
@@ -203,6 +307,139 @@ def tileset_info(filename):
         row_infos = f['resolutions'][str(resolutions[0])].attrs['row_infos']
         tileset_info['row_infos'] = [r.decode('utf8') for r in row_infos]
 
-    f.close()
-
     return tileset_info
+
+def load_info(f):
+    '''
+    Read the metadata of an open multivec file.
+
+    Returns
+    -------
+    info: dict
+        The file's tileset info, its chromosome sizes, the index of
+        the bins of each resolution (see `get_bin_offsets`) and a cache
+        of its open datasets (see `get_dataset`)
+    '''
+    tileset_info = load_tileset_info(f)
+    chromsizes = list(zip(f['chroms']['name'][:], f['chroms']['length'][:]))
+
+    return {
+        'tileset_info': tileset_info,
+        'chromsizes': chromsizes,
+        'bin_offsets': {resolution: get_bin_offsets(chromsizes, resolution)
+            for resolution in tileset_info['resolutions']},
+        'datasets': {}
+    }
+
+def open_multivec(filepath):
+    '''
+    Open a multivec file (read-only) and read its metadata.
+    '''
+    f = h5py.File(filepath, 'r')
+
+    try:
+        return (f, load_info(f))
+    except Exception:
+        f.close()
+        raise
+
+# open multivec files along with their metadata, indexed by filepath
+files = hgca.HandleCache(open_multivec,
+        closer=lambda file_and_info: file_and_info[0].close(),
+        max_size=MAX_OPEN_FILES)
+
+def get_dataset(f, info, resolution, chrom):
+    '''
+    The values of a chromosome at a resolution, which are opened once
+    per file rather than being looked up for every tile.
+    '''
+    key = (resolution, chrom)
+
+    if key not in info['datasets']:
+        info['datasets'][key] = f['resolutions'][str(resolution)]['values'][chrom]
+
+    return info['datasets'][key]
+
+def tileset_info(filename):
+    '''
+    Return some information about this tileset that will
+    help render it in on the client.
+
+    Parameters
+    ----------
+    filename: str
+      The filename of the h5py file containing the tileset info.
+
+    Returns
+    -------
+    tileset_info: {}
+      A dictionary containing the information describing
+      this dataset
+    '''
+    return dict(files.get(filename)[1]['tileset_info'])
+
+def tiles(filepath, tile_ids, rows=None, row_groups=None):
+    '''
+    Generate tiles from a multivec file.
+
+    Parameters
+    ----------
+    filepath: str
+        The filename of the multivec file
+    tile_ids: [str,...]
+        A list of tile_ids (e.g. xyx.0.0) identifying the tiles
+        to be retrieved
+    rows: [int,...]
+        Only return these rows (e.g. the ones that are visible), in
+        this order
+    row_groups: [[int,...],...]
+        Return the mean of each group of rows (e.g. the rows of each
+        category in the tileset's row_infos) instead of the rows
+
+    Returns
+    -------
+    tile_list: [(tile_id, tile_data),...]
+        A list of tile_id, tile_data tuples. The values of each tile
+        are a (tile_size, num_rows) block (see `format_tile`).
+    '''
+    tile_positions = []
+    positions_by_zoom = col.defaultdict(list)
+
+    for tile_id in tile_ids:
+        tile_id_parts = tile_id.split('|')[0].split('.')
+        (zoom, xpos) = map(int, tile_id_parts[1:3])
+
+        tile_positions += [(zoom, xpos)]
+        positions_by_zoom[zoom] += [xpos]
+
+    tile_values = {}
+
+    # all of the tiles share one open file, which isn't closed
+    # (e.g. by an eviction) until they've been generated
+    with files.acquire(filepath) as (f, info):
+        num_zoom_levels = len(info['tileset_info']['resolutions'])
+
+        for zoom, positions in positions_by_zoom.items():
+            if zoom < 0 or zoom >= num_zoom_levels:
+                continue
+
+            # runs of adjacent tiles are read together
+            for (tile_x_pos, num_tiles) in hgut.consecutive_runs(
+                    [x for x in positions if x >= 0]):
+                for i, dense in enumerate(get_tiles(f, info, zoom, tile_x_pos,
+                        num_tiles, rows, row_groups)):
+                    tile_values[(zoom, tile_x_pos + i)] = format_tile(dense)
+
+    # tiles outside of the tileset are left out
+    return [(tile_id, tile_values[pos]) for (tile_id, pos) in zip(tile_ids, tile_positions)
+            if pos in tile_values]
+
+def format_tile(dense):
+    '''
+    Encode the values of a tile as a dense tile (see
+    `hgtiles.format.format_dense_tile`) along with its shape.
+    '''
+    tile_value = hgfo.format_dense_tile(dense.ravel())
+    tile_value['shape'] = list(dense.shape)
+
+    return tile_value
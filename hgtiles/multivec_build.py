@@ -0,0 +1,540 @@
+'''
+Build a multivec file from bigWig, bedGraph or wide TSV tracks.
+
+Usage:
+
+    python -m hgtiles.multivec_build out.multires.mv5 a.bw b.bw ...
+        [--chromsizes chromsizes.tsv] [--resolution 1000]
+
+Every bigWig or bedGraph file is one row of the multivec file and a
+wide TSV (chrom, start, end, value, value, ...) has one row for each of
+its value columns. The values are binned at the base resolution a chunk
+of bins at a time, and each chunk is aggregated into all of the coarser
+resolutions before the next one is read, so the memory that's needed
+depends on the chunk size and the number of rows rather than on the
+size of the genome.
+
+The file layout (see `hgtiles.multivec.tileset_info`) is:
+
+    chroms/name                             the chromosome names
+    chroms/length                           the chromosome lengths
+    info.attrs['tile-size']                 the number of bins in a tile
+    resolutions/<res>.attrs['row_infos']    the name of each row
+    resolutions/<res>/values/<chrom>        float32 [num_bins, num_rows]
+'''
+import argparse
+import hgtiles.chromsizes as hgch
+import math
+import numpy as np
+import os
+import os.path as op
+import pandas as pd
+
+# the number of bins in a tile
+TILE_SIZE = 256
+
+# the number of base resolution bins that are binned and aggregated at once
+CHUNK_BINS = 2 ** 14
+
+# the number of rows in each stored chunk, so that tiles
+# with a few rows selected don't need to decompress every row
+CHUNK_ROWS = 16
+
+# the number of lines of a bedGraph or TSV file that are parsed at once
+READ_LINES = 2 ** 20
+
+# how the values of a bin at a coarser resolution are calculated
+# from the base resolution bins that it contains
+AGGREGATIONS = ('mean', 'sum')
+
+BIGWIG_EXTENSIONS = ('.bw', '.bigwig')
+
+def is_bigwig(filepath):
+    return op.splitext(filepath)[1].lower() in BIGWIG_EXTENSIONS
+
+def get_resolutions(chromsizes, resolution, tile_size=TILE_SIZE):
+    '''
+    The base resolution followed by each coarser resolution (doubling
+    the bin size) until the whole genome fits into one tile.
+    '''
+    genome_length = sum(length for chrom, length in chromsizes)
+    resolutions = [resolution]
+
+    while resolutions[-1] * tile_size < genome_length:
+        resolutions += [resolutions[-1] * 2]
+
+    return resolutions
+
+def chunk_ranges(length, resolution, chunk_bins=CHUNK_BINS):
+    '''
+    Split the bins of a chromosome into chunks.
+
+    Returns
+    -------
+    ranges: [(start_bin, end_bin),...]
+    '''
+    num_bins = math.ceil(length / resolution)
+    return [(lo, min(lo + chunk_bins, num_bins)) for lo in range(0, num_bins, chunk_bins)]
+
+def bigwig_chunks(bwpath, chromsizes, resolution, chunk_bins=CHUNK_BINS):
+    '''
+    The mean value of each bin of a bigWig file.
+
+    Yields
+    ------
+    values: np.array
+        An array of shape (end_bin - start_bin, 1) for each chunk (see
+        `chunk_ranges`) of each chromosome, in order. Chromosomes that
+        aren't in the bigWig file are NaN.
+    '''
+    import bbi
+
+    with bbi.open(bwpath) as bwfile:
+        file_chromsizes = bwfile.chromsizes
+
+        for chrom, length in chromsizes:
+            for (lo, hi) in chunk_ranges(length, resolution, chunk_bins):
+                values = np.full((hi - lo, 1), np.nan)
+
+                if chrom not in file_chromsizes:
+                    yield values
+                    continue
+
+                # the last bin of a chromosome is shorter than the others
+                # so it's fetched separately
+                full_hi = min(hi, length // resolution)
+
+                if lo < full_hi and lo * resolution < file_chromsizes[chrom]:
+                    values[:full_hi - lo, 0] = bwfile.fetch(chrom, lo * resolution,
+                            full_hi * resolution, bins=full_hi - lo, missing=np.nan)
+                if full_hi < hi and full_hi * resolution < file_chromsizes[chrom]:
+                    values[-1, 0] = bwfile.fetch(chrom, full_hi * resolution, length,
+                            bins=1, missing=np.nan)[0]
+
+                yield values
+
+def is_interval(fields):
+    return len(fields) >= 3 and fields[1].isdigit()
+
+def interval_columns(filepath):
+    '''
+    The value columns of a bedGraph or wide TSV file.
+
+    Returns
+    -------
+    names: [str,...] or None
+        The names of the value columns, if the file has a header line
+        (e.g. chrom start end sample1 sample2), otherwise None
+    num_values: int
+        The number of value columns
+    '''
+    names = None
+
+    with open(filepath, 'rb') as f:
+        for line in f:
+            fields = line.split()
+
+            if is_interval(fields):
+                return (names, len(fields) - 3)
+
+            # a header line, which may be commented out, as opposed
+            # to a track or browser line
+            if not line.startswith((b'track', b'browser')):
+                fields = line.lstrip(b'#').split()
+                if len(fields) > 3:
+                    names = [n.decode('utf8') for n in fields[3:]]
+
+    raise ValueError('No intervals in {}'.format(filepath))
+
+def index_intervals(filepath):
+    '''
+    Find the lines of each chromosome in a bedGraph or TSV file, which
+    have to be grouped by chromosome (but not in any particular order).
+
+    Returns
+    -------
+    index: {chrom: (offset, num_lines)}
+        The position of the first line of each chromosome and the
+        number of lines it has
+    '''
+    index = {}
+    offset = 0
+    chrom = None
+
+    with open(filepath, 'rb') as f:
+        for line in f:
+            fields = line.split(None, 3)
+
+            if not is_interval(fields):
+                if chrom is not None and fields:
+                    raise ValueError('Header line after the intervals in {}'.format(
+                        filepath))
+                offset += len(line)
+                continue
+
+            if fields[0] != chrom:
+                chrom = fields[0]
+
+                if chrom.decode('utf8') in index:
+                    raise ValueError('The intervals in {} aren\'t grouped by '
+                            'chromosome ({})'.format(filepath, chrom.decode('utf8')))
+                index[chrom.decode('utf8')] = [offset, 0]
+
+            index[chrom.decode('utf8')][1] += 1
+            offset += len(line)
+
+    return {chrom: tuple(v) for chrom, v in index.items()}
+
+def interval_overlaps(intervals, length, resolution):
+    '''
+    Split intervals into the parts that overlap each bin.
+
+    Parameters
+    ----------
+    intervals: np.array
+        An array of [start, end, value, value, ...] rows
+    length: int
+        The length of the chromosome
+
+    Returns
+    -------
+    (bins, overlaps, values): (np.array, np.array, np.array)
+        The bin, the number of bases in the bin and the values
+        of each part
+    '''
+    starts = np.clip(intervals[:, 0].astype(np.int64), 0, length)
+    ends = np.clip(intervals[:, 1].astype(np.int64), 0, length)
+    values = intervals[:, 2:]
+
+    inside = ends > starts
+    (starts, ends, values) = (starts[inside], ends[inside], values[inside])
+
+    first_bins = starts // resolution
+    num_bins = (ends - 1) // resolution - first_bins + 1
+
+    parts = np.repeat(np.arange(len(starts)), num_bins)
+    bins = first_bins[parts] + np.arange(len(parts)) - np.repeat(
+            np.cumsum(num_bins) - num_bins, num_bins)
+
+    overlaps = (np.minimum(ends[parts], (bins + 1) * resolution) -
+            np.maximum(starts[parts], bins * resolution))
+
+    return (bins, overlaps, values[parts])
+
+def bin_overlaps(bins, overlaps, values, lo, hi):
+    '''
+    The mean of the values in each bin from lo to hi, weighted by how
+    much of the bin they cover. NaN values are ignored.
+    '''
+    (num_parts, num_values) = values.shape
+    means = np.full((hi - lo, num_values), np.nan)
+
+    for i in range(num_values):
+        weights = np.where(np.isnan(values[:, i]), 0, overlaps)
+        sums = np.bincount(bins - lo, weights * np.nan_to_num(values[:, i]),
+                minlength=hi - lo)
+        counts = np.bincount(bins - lo, weights, minlength=hi - lo)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means[:, i] = np.where(counts > 0, sums / counts, np.nan)
+
+    return means
+
+def bin_intervals(interval_blocks, length, resolution, num_values, chunk_bins=CHUNK_BINS):
+    '''
+    The mean value of each bin of a chromosome, weighted by how much of
+    the bin is covered by each interval.
+
+    Parameters
+    ----------
+    interval_blocks: iterable of np.array
+        Arrays of [start, end, value, value, ...] rows, sorted by start
+    length: int
+        The length of the chromosome
+    num_values: int
+        The number of values of each interval
+
+    Yields
+    ------
+    values: np.array
+        An array of shape (end_bin - start_bin, num_values) for each
+        chunk of the chromosome (see `chunk_ranges`), in order
+    '''
+    ranges = chunk_ranges(length, resolution, chunk_bins)
+    num_done = 0
+    last_start = -np.inf
+
+    # the parts of the intervals in the chunks that aren't finished yet
+    pending = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros((0, num_values)))
+
+    def finish_chunk():
+        nonlocal pending
+
+        (lo, hi) = ranges[num_done]
+        in_chunk = pending[0] < hi
+
+        values = bin_overlaps(*(x[in_chunk] for x in pending), lo, hi)
+        pending = tuple(x[~in_chunk] for x in pending)
+
+        return values
+
+    for intervals in interval_blocks:
+        if not len(intervals):
+            continue
+
+        starts = intervals[:, 0]
+        if starts[0] < last_start or np.any(starts[1:] < starts[:-1]):
+            raise ValueError('The intervals of each chromosome have to be sorted by start')
+        last_start = starts[-1]
+
+        pending = tuple(np.concatenate(x) for x in
+                zip(pending, interval_overlaps(intervals, length, resolution)))
+
+        # intervals that haven't been read yet start after
+        # the start of the last one
+        while num_done < len(ranges) and ranges[num_done][1] * resolution <= last_start:
+            yield finish_chunk()
+            num_done += 1
+
+    while num_done < len(ranges):
+        yield finish_chunk()
+        num_done += 1
+
+def interval_chunks(filepath, chromsizes, resolution, chunk_bins=CHUNK_BINS):
+    '''
+    The mean value of each bin of a bedGraph or wide TSV file
+    (see `bin_intervals`).
+
+    Yields
+    ------
+    values: np.array
+        An array of shape (end_bin - start_bin, num_values) for each
+        chunk (see `chunk_ranges`) of each chromosome, in order.
+        Chromosomes that aren't in the file are NaN.
+    '''
+    (names, num_values) = interval_columns(filepath)
+    index = index_intervals(filepath)
+
+    with open(filepath, 'rb') as f:
+        for chrom, length in chromsizes:
+            interval_blocks = []
+
+            if chrom in index:
+                (offset, num_lines) = index[chrom]
+                f.seek(offset)
+
+                interval_blocks = (df.values.astype(np.float64) for df in pd.read_csv(f,
+                    delim_whitespace=True, header=None, usecols=range(1, 3 + num_values),
+                    nrows=num_lines, chunksize=READ_LINES))
+
+            yield from bin_intervals(interval_blocks, length, resolution,
+                    num_values, chunk_bins)
+
+def write_level(levels, i, block, aggregation, final=False):
+    '''
+    Write a block of (sums, counts) of the non-NaN base resolution values
+    in each bin of the previous resolution (or of the base resolution,
+    if i == 0) to resolution i and all of the coarser resolutions.
+
+    Bins are aggregated in pairs. A bin left over from an incomplete
+    pair is carried over to the next block, unless this is the final
+    block, in which case it's aggregated on its own.
+    '''
+    level = levels[i]
+
+    if i > 0:
+        if level['carry'] is not None:
+            block = tuple(np.concatenate(x) for x in zip(level['carry'], block))
+            level['carry'] = None
+
+        if len(block[0]) % 2:
+            if final:
+                block = tuple(np.concatenate((x, np.zeros((1, x.shape[1])))) for x in block)
+            else:
+                level['carry'] = tuple(x[-1:] for x in block)
+                block = tuple(x[:-1] for x in block)
+
+        block = tuple(x.reshape((-1, 2, x.shape[1])).sum(axis=1) for x in block)
+
+    (sums, counts) = block
+    start = level['position']
+    end = start + len(sums)
+
+    if end > start:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if aggregation == 'mean':
+                values = np.where(counts > 0, sums / counts, np.nan)
+            else:
+                values = np.where(counts > 0, sums, np.nan)
+
+        level['dataset'][start:end] = values
+        level['position'] = end
+
+    if i + 1 < len(levels):
+        write_level(levels, i + 1, block, aggregation, final)
+
+def create_values(group, chrom, num_bins, num_rows, tile_size=TILE_SIZE):
+    '''
+    Create the dataset storing the values of a chromosome, chunked so
+    that a tile is stored in one chunk for every CHUNK_ROWS rows.
+    '''
+    return group.create_dataset('values/' + chrom, (num_bins, num_rows),
+            dtype='float32', fillvalue=np.nan,
+            chunks=(max(1, min(num_bins, tile_size)), max(1, min(num_rows, CHUNK_ROWS))),
+            compression='gzip', shuffle=True)
+
+def build(output_file, filepaths, chromsizes=None, resolution=1000, row_infos=None,
+        aggregation='mean', tile_size=TILE_SIZE, chunk_bins=CHUNK_BINS):
+    '''
+    Build a multivec file from bigWig, bedGraph or wide TSV files.
+
+    Parameters
+    ----------
+    output_file: string
+        Where to write the multivec file
+    filepaths: [string,...]
+        The input files. Files ending in .bw or .bigWig are read as
+        bigWig files and any other file as a bedGraph or wide TSV file,
+        whose intervals have to be grouped by chromosome and sorted by
+        start within each chromosome.
+    chromsizes: [(chrom, length),...]
+        The chromosomes to include, in order. Defaults to the (naturally
+        sorted) chromosomes of the first file, if it's a bigWig file.
+    resolution: int
+        The size of the bins at the highest resolution
+    row_infos: [string,...]
+        The name of each row. Defaults to the file names (or the column
+        names of a TSV file with a header).
+    aggregation: string
+        How the bins at coarser resolutions are calculated from the
+        bins at the base resolution (see AGGREGATIONS). NaN values are
+        ignored.
+    tile_size: int
+        The number of bins in a tile
+    chunk_bins: int
+        The number of base resolution bins to process at once
+
+    Returns
+    -------
+    output_file: string
+        The path of the multivec file that was written
+    '''
+    import h5py
+
+    if aggregation not in AGGREGATIONS:
+        raise ValueError('Unknown aggregation: {} (expected one of {})'.format(
+            aggregation, ', '.join(AGGREGATIONS)))
+
+    if chromsizes is None:
+        if not filepaths or not is_bigwig(filepaths[0]):
+            raise ValueError('chromsizes are needed unless the first file is a bigWig file')
+
+        import hgtiles.bigwig as hgbi
+        chromsizes = list(hgbi.get_chromsizes(filepaths[0]).items())
+
+    chromsizes = [(str(chrom), int(length)) for chrom, length in chromsizes]
+
+    sources = []
+    names = []
+
+    for filepath in filepaths:
+        basename = op.basename(filepath)
+
+        if is_bigwig(filepath):
+            sources += [bigwig_chunks(filepath, chromsizes, resolution, chunk_bins)]
+            names += [basename]
+            continue
+
+        (column_names, num_values) = interval_columns(filepath)
+        sources += [interval_chunks(filepath, chromsizes, resolution, chunk_bins)]
+
+        if column_names is not None:
+            names += column_names
+        elif num_values == 1:
+            names += [basename]
+        else:
+            names += ['{}:{}'.format(basename, i) for i in range(num_values)]
+
+    if row_infos is None:
+        row_infos = names
+    elif len(row_infos) != len(names):
+        raise ValueError('There are {} row_infos for {} rows'.format(
+            len(row_infos), len(names)))
+
+    num_rows = len(row_infos)
+    resolutions = get_resolutions(chromsizes, resolution, tile_size)
+
+    # the chunks of all of the inputs, in order
+    chunks = zip(*sources)
+
+    # write to a temporary file so that a multivec file is never
+    # read while it's partially written
+    tmp_path = output_file + '.tmp'
+    with h5py.File(tmp_path, 'w') as f:
+        f.create_dataset('chroms/name',
+                data=np.array([chrom.encode('utf8') for chrom, length in chromsizes]))
+        f.create_dataset('chroms/length',
+                data=np.array([length for chrom, length in chromsizes]))
+        f.create_group('info').attrs['tile-size'] = tile_size
+
+        groups = []
+        for res in resolutions:
+            group = f.create_group('resolutions/{}'.format(res))
+            group.attrs['row_infos'] = np.array([r.encode('utf8') for r in row_infos])
+            groups += [group]
+
+        for chrom, length in chromsizes:
+            levels = [{
+                'dataset': create_values(group, chrom, math.ceil(length / res),
+                    num_rows, tile_size),
+                'position': 0,
+                'carry': None
+            } for res, group in zip(resolutions, groups)]
+
+            for (lo, hi) in chunk_ranges(length, resolution, chunk_bins):
+                values = np.concatenate(next(chunks), axis=1)
+                nans = np.isnan(values)
+
+                write_level(levels, 0, (np.where(nans, 0, values),
+                    (~nans).astype(np.float64)), aggregation)
+
+            empty = np.zeros((0, num_rows))
+            write_level(levels, 0, (empty, empty), aggregation, final=True)
+
+    os.replace(tmp_path, output_file)
+
+    return output_file
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Build a multivec file from bigWig, bedGraph or wide TSV files')
+    parser.add_argument('output', help='The multivec file')
+    parser.add_argument('filepaths', nargs='+',
+            help='The input files, each of which is one or more rows')
+    parser.add_argument('-c', '--chromsizes', default=None,
+            help='A chromsizes file (default: the chromosomes of the first bigWig file)')
+    parser.add_argument('-r', '--resolution', type=int, default=1000,
+            help='The size of the bins at the highest resolution')
+    parser.add_argument('--row-infos', default=None,
+            help='A file with the name of each row on a separate line')
+    parser.add_argument('--aggregation', choices=AGGREGATIONS, default='mean',
+            help='How bins are aggregated into coarser resolutions')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE,
+            help='The number of bins in a tile')
+    args = parser.parse_args()
+
+    chromsizes = None
+    if args.chromsizes is not None:
+        chromsizes = [(c[0], int(c[1])) for c in hgch.get_tsv_chromsizes(args.chromsizes)]
+
+    row_infos = None
+    if args.row_infos is not None:
+        with open(args.row_infos, 'r') as f:
+            row_infos = [line.rstrip('\n') for line in f if line.strip()]
+
+    print(build(args.output, args.filepaths, chromsizes, args.resolution,
+        row_infos, args.aggregation, args.tile_size))
+
+if __name__ == '__main__':
+    main()
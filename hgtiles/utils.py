@@ -61,6 +61,31 @@ def partition_by_adjacent_tiles(tile_ids, dimension=2):
 
     return tile_id_lists
 
+def consecutive_runs(positions):
+    '''
+    Split a set of 1D tile positions into runs of consecutive positions.
+
+    Parameters
+    ----------
+    positions: [int,...]
+        A list of tile positions, possibly unsorted and with duplicates
+
+    Returns
+    -------
+    runs: [(start, length),...]
+        The first position and number of positions in each run,
+        in ascending order
+    '''
+    runs = []
+
+    for position in sorted(set(positions)):
+        if runs and runs[-1][0] + runs[-1][1] == position:
+            runs[-1][1] += 1
+        else:
+            runs += [[position, 1]]
+
+    return [tuple(r) for r in runs]
+
 def infer_filetype(filename):
     _,ext = op.splitext(filename)
 
@@ -90,6 +115,8 @@ def infer_datatype(filetype):
         return 'vector'
     if filetype == 'beddb':
         return 'bedlike'
+    if filetype == 'multivec':
+        return 'multivec'
 
 def tiles_wrapper_2d(tile_ids, tiles_function):
     tile_values = []
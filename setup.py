@@ -10,7 +10,7 @@ install_requires = [
     'slugid',
     'numpy',
     'cooler',
-    'pybbi==0.1.3',
+    'pybbi>=0.2.0',
 ]
 
 setup(
@@ -0,0 +1,51 @@
+import asyncio
+import concurrent.futures as cf
+import cooler_test
+import hgtiles.aio as hgai
+import hgtiles.cooler as hgco
+import tempfile
+import time
+
+
+def test_group_tile_ids():
+    groups = hgai.group_tile_ids(['a.1.0', 'a.1.1', 'a.1.3', 'a.2.1|cos:x',
+        'a.2.2|cos:x', 'a.2.3', 'a.3.0.0.KR', 'a.3.0.1.KR', 'a.3.1.1'])
+
+    assert sorted(groups) == sorted([['a.1.0', 'a.1.1'], ['a.1.3'],
+        ['a.2.1|cos:x', 'a.2.2|cos:x'], ['a.2.3'],
+        ['a.3.0.0.KR', 'a.3.0.1.KR'], ['a.3.1.1']])
+
+def test_cooler_tiles():
+    async def get_tiles(filename, tile_ids):
+        return [tile async for tile in hgai.cooler_tiles(filename, tile_ids)]
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = cooler_test.make_mcool(td)
+        tile_ids = ['a.3.0.0', 'a.3.0.1', 'a.0.0.0', 'a.1.0.0.none']
+
+        tiles = asyncio.run(get_tiles(filename, tile_ids))
+
+        assert sorted(tiles) == sorted(hgco.tiles(filename, tile_ids))
+        hgco.mats.invalidate(filename)
+
+def test_cancel():
+    generated = []
+
+    def slow_tiles(filepath, tile_ids):
+        time.sleep(0.05)
+        generated.extend(tile_ids)
+        return [(tile_id, None) for tile_id in tile_ids]
+
+    async def get_first_tile(executor):
+        tiles = hgai.iter_tiles(slow_tiles, 'x', ['a.{}.0'.format(z) for z in range(10)],
+                executor=executor)
+        async for tile in tiles:
+            await tiles.aclose()
+            return tile
+
+    executor = cf.ThreadPoolExecutor(max_workers=1)
+    asyncio.run(get_first_tile(executor))
+    executor.shutdown(wait=True)
+
+    # the remaining groups were cancelled before they started
+    assert len(generated) < 10
@@ -0,0 +1,79 @@
+import hgtiles.bed2ddb as hgb2
+import hgtiles.format as hgfo
+import os.path as op
+import sqlite3
+import tempfile
+
+def make_bed2ddb(filename, num_intervals=500, max_zoom=4, tile_size=256):
+    '''
+    Write a bed2ddb file with intervals near the diagonal.
+    '''
+    max_width = tile_size * 2 ** max_zoom
+
+    conn = sqlite3.connect(filename)
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        zoom_step INT, max_length INT, assembly text, chrom_names text,
+        chrom_sizes text, tile_size REAL, max_zoom INT, max_width REAL
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?,?)',
+            (1, max_width, 'test', 'chr1', str(max_width), tile_size, max_zoom, max_width))
+
+    conn.execute('''
+    CREATE TABLE intervals
+    (
+        id int PRIMARY KEY, zoomLevel int, importance real, fromX int,
+        toX int, fromY int, toY int, chrOffset int, uid text, fields text
+    )''')
+    conn.execute('CREATE VIRTUAL TABLE position_index USING rtree('
+            'id, rFromX, rToX, rFromY, rToY)')
+
+    for i in range(num_intervals):
+        x = (i * 7919) % (max_width // 2)
+        y = x + (i * 31) % 500
+        w = 10 + (i * 13) % 300
+
+        conn.execute('INSERT INTO intervals VALUES (?,?,?,?,?,?,?,?,?,?)',
+                (i, i % (max_zoom + 1), float(i), x, x + w, y, y + w, 0,
+                    'uid{}'.format(i % 100), 'chr1\t{}\t{}\tchr1\t{}\t{}'.format(
+                        x, x + w, y, y + w % 7)))
+        conn.execute('INSERT INTO position_index VALUES (?,?,?,?,?)', (i, x, x + w, y, y + w))
+
+    conn.commit()
+    conn.close()
+
+def test_columnar_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.bed2ddb')
+        make_bed2ddb(filename)
+
+        # a block of tiles along the diagonal and past the data
+        tiles = hgb2.get_2D_tiles(filename, 3, 0, 0, 8, 8)
+
+        for columnar in [True, 'binary']:
+            columnar_tiles = hgb2.get_2D_tiles(filename, 3, 0, 0, 8, 8, columnar=columnar)
+            assert len(columnar_tiles) == 64
+
+            for pos, columnar_value in columnar_tiles.items():
+                assert columnar_value['binary'] == (columnar == 'binary')
+                assert hgfo.columnar_tile_to_rows(columnar_value) == tiles[pos]
+
+        assert tiles[(0, 0)] and not tiles[(7, 0)]
+
+def test_1D_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.bed2ddb')
+        make_bed2ddb(filename)
+
+        tiles = hgb2.get_1D_tiles(filename, 3, 0, 8)
+        tiles_2d = hgb2.get_2D_tiles(filename, 3, 0, 0, 8, 8)
+
+        # every interval overlapping a column of 2D tiles
+        for i in range(8):
+            expected = set(tuple(map(str, r.values())) for j in range(8)
+                    for r in tiles_2d[(i, j)])
+
+            assert set(tuple(map(str, r.values())) for r in tiles[i]) == expected
+
+        assert len(tiles[0]) > 0
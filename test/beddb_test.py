@@ -1,9 +1,161 @@
+import concurrent.futures as cf
 import hgtiles.beddb as hgbe
 import json
 import os.path as op
+import sqlite3
+import tempfile
+
+def make_beddb(filename, intervals, max_width=2 ** 20, max_zoom=4, tile_size=1024):
+    '''
+    Write a beddb file containing a list of
+    (zoomLevel, importance, startPos, endPos, uid, fields) intervals.
+    '''
+    conn = sqlite3.connect(filename)
+
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        zoom_step INT, max_length INT, assembly text, chrom_names text,
+        chrom_sizes text, tile_size REAL, max_zoom INT, max_width REAL,
+        header text
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?,?,?)',
+            (1, max_width, 'test', 'chr1', str(max_width), tile_size,
+                max_zoom, max_width, ''))
+
+    conn.execute('''
+    CREATE TABLE intervals
+    (
+        id int PRIMARY KEY, zoomLevel int, importance real,
+        startPos int, endPos int, chrOffset int, uid text, fields text
+    )''')
+    conn.execute('CREATE VIRTUAL TABLE position_index USING rtree(id, rStartPos, rEndPos)')
+
+    for i, (zoom_level, importance, start, end, uid, fields) in enumerate(intervals):
+        conn.execute('INSERT INTO intervals VALUES (?,?,?,?,?,?,?,?)',
+                (i, zoom_level, importance, start, end, 0, uid, fields))
+        conn.execute('INSERT INTO position_index VALUES (?,?,?)', (i, start, end))
+
+    conn.commit()
+    conn.close()
+
+def make_intervals(num_intervals=200, max_width=2 ** 20, max_zoom=4):
+    intervals = []
+    for i in range(num_intervals):
+        start = (i * 7919) % (max_width - 5000)
+        intervals += [(i % (max_zoom + 1), float(i), start, start + 100 + (i * 31) % 4000,
+            'uid{}'.format(i), 'chr1\t{}\t{}\tgene{}'.format(start, start + 1, i))]
+    return intervals
 
 def test_list_items():
     filename = op.join('data', 'gene_annotations.short.db')
 
     ret = hgbe.list_items(filename, 0, 100000000, max_entries=100)
     # print('ret:', ret)
+
+def test_pooled_connections():
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.beddb')
+        make_beddb(filename, make_intervals())
+
+        hgbe.connections.clear()
+        stats = hgbe.connections.stats()
+
+        tsinfo = hgbe.tileset_info(filename)
+        assert tsinfo['max_width'] == 2 ** 20
+        assert tsinfo['max_zoom'] == 4
+
+        tiles = hgbe.tiles(filename, ['a.2.0', 'a.2.1', 'a.2.2'])
+        assert [t[0] for t in tiles] == ['a.2.0', 'a.2.1', 'a.2.2']
+        assert len(tiles[1][1]) > 0
+
+        # one connection is opened and reused for every query
+        assert hgbe.connections.stats()['misses'] == stats['misses'] + 1
+        assert len(hgbe.connections) == 1
+
+        items = hgbe.list_items(filename, 0, 2 ** 20, max_entries=5)
+        assert len(items) == 5
+
+        # the connections are read only
+        with hgbe.get_connection(filename) as conn:
+            try:
+                conn.execute('DELETE FROM intervals')
+                assert False
+            except sqlite3.OperationalError:
+                pass
+
+        # each thread gets its own connection
+        with cf.ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda x: hgbe.tiles(filename, ['a.2.{}'.format(x)]),
+                range(4)))
+        assert [r[0][1] for r in results[:3]] == [t[1] for t in tiles]
+
+        hgbe.connections.clear()
+        hgbe.tileset_infos.clear()
+        hgbe.index_infos.clear()
+
+def test_batched_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.beddb')
+        make_beddb(filename, make_intervals(1000))
+
+        tile_ids = ['a.3.{}'.format(x) for x in [5, 0, 1, 2, 7, 6]]
+        tiles = hgbe.tiles(filename, tile_ids)
+        assert [t[0] for t in tiles] == tile_ids
+
+        # the batched tiles match the tiles retrieved one at a time
+        for tile_id, tile_value in tiles:
+            xpos = int(tile_id.split('.')[2])
+            assert tile_value == hgbe.get_1D_tiles(filename, 3, xpos)
+
+        tile_rows = hgbe.get_tiles(filename, 3, 0, 8)
+        assert sum(len(tile_rows[x]) for x in range(8)) == len(hgbe.get_1D_tiles(filename, 3, 0, 8))
+
+        hgbe.connections.clear()
+        hgbe.tileset_infos.clear()
+        hgbe.index_infos.clear()
+
+def test_columnar_tiles():
+    import hgtiles.format as hgfo
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.beddb')
+        make_beddb(filename, make_intervals(1000))
+
+        tile_ids = ['a.3.{}'.format(x) for x in range(8)]
+        tiles = hgbe.tiles(filename, tile_ids)
+
+        for columnar in [True, 'binary']:
+            columnar_tiles = hgbe.tiles(filename, tile_ids, columnar=columnar)
+
+            for (tile_id, tile_value), (_, columnar_value) in zip(tiles, columnar_tiles):
+                assert columnar_value['binary'] == (columnar == 'binary')
+                assert hgfo.columnar_tile_to_rows(columnar_value) == tile_value
+
+        hgbe.connections.clear()
+        hgbe.tileset_infos.clear()
+        hgbe.index_infos.clear()
+
+def test_max_per_tile():
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.beddb')
+        make_beddb(filename, make_intervals(1000))
+        hgbe.create_importance_index(filename)
+
+        tile_ids = ['a.2.{}'.format(x) for x in range(4)]
+        tiles = hgbe.tiles(filename, tile_ids)
+        top_tiles = hgbe.tiles(filename, tile_ids, max_per_tile=5)
+
+        for (tile_id, tile_value), (_, top_value) in zip(tiles, top_tiles):
+            expected = sorted(tile_value, key=lambda r: -r['importance'])[:5]
+            assert top_value == expected
+
+        columnar_tiles = hgbe.tiles(filename, tile_ids, columnar=True, max_per_tile=5)
+        assert columnar_tiles[0][1]['length'] == 5
+
+        items = hgbe.list_items(filename, 0, 2 ** 20, max_entries=3)
+        assert [i['importance'] for i in items] == [999., 998., 997.]
+
+        hgbe.connections.clear()
+        hgbe.tileset_infos.clear()
+        hgbe.index_infos.clear()
@@ -1,4 +1,5 @@
 import hgtiles.bigwig as hgbi
+import numpy as np
 import os.path as op
 
 def test_bigwig_tiles():
@@ -13,3 +14,167 @@ def test_tileset_info():
     tileset_info = hgbi.tileset_info(filename)
     # print('tileset_info', tileset_info)
 
+def test_cached_chromsizes():
+    filename = op.join('data', 'wgEncodeCaltechRnaSeqHuvecR1x75dTh1014IlnaPlusSignalRep2.bigWig')
+
+    chromsizes = hgbi.get_chromsizes(filename)
+    misses = hgbi.chromsizes_cache.stats()['misses']
+
+    tiles = hgbi.tiles(filename, ['x.0.0', 'x.1.0', 'x.1.1'])
+    assert len(tiles) == 3
+    assert hgbi.get_chromsizes(filename) is chromsizes
+    assert hgbi.chromsizes_cache.stats()['misses'] == misses
+
+def test_bundled_tiles():
+    filename = op.join('data', 'wgEncodeCaltechRnaSeqHuvecR1x75dTh1014IlnaPlusSignalRep2.bigWig')
+
+    chromsizes = hgbi.get_chromsizes(filename)
+    max_depth = hgbi.get_quadtree_depth(chromsizes)
+    zoom_level = 10
+    tile_size = hgbi.TILE_SIZE * 2 ** (max_depth - zoom_level)
+
+    bundled = hgbi.get_bigwig_tiles(filename, zoom_level, 200, 8)
+
+    for i, tile in enumerate(bundled):
+        start_pos = (200 + i) * tile_size
+        single = hgbi.get_bigwig_tile(filename, zoom_level, start_pos,
+                start_pos + tile_size)
+        assert np.allclose(tile, single, equal_nan=True)
+
+def test_natsorted():
+    import functools as ft
+    import random
+
+    chromosomes = (['chr{}'.format(i) for i in range(1, 23)] +
+        ['chrX', 'chrY', 'chrM', 'chr1_random', 'chr17_ctg5_hap1',
+         'chrUn_gl000220', 'chr2_KI270', 'chr10a', 'chr10b', 'chr_', 'x_chrM'] +
+        ['scaffold{}'.format(i) for i in range(2000)])
+    random.shuffle(chromosomes)
+
+    # the key-based sort matches the comparison-based sort
+    assert (hgbi.natsorted(chromosomes) ==
+            sorted(chromosomes, key=ft.cmp_to_key(hgbi.natcmp)))
+
+    # names that natcmp can't compare with each other
+    assert (hgbi.natsorted(['X', 'MT', '10', '2', 'GL000192.1', '1']) ==
+            ['1', '2', '10', 'GL000192.1', 'MT', 'X'])
+
+def test_small_contigs():
+    import bbi
+
+    filename = op.join('data', 'wgEncodeCaltechRnaSeqHuvecR1x75dTh1014IlnaPlusSignalRep2.bigWig')
+
+    chromsizes = hgbi.get_chromsizes(filename)
+    tsinfo = hgbi.tileset_info(filename)
+    binsize = hgbi.get_zoom_resolutions(chromsizes)[0]
+
+    class CountingFile:
+        def __init__(self, bwfile):
+            self.bwfile = bwfile
+            self.chroms = []
+
+        def fetch(self, chrom, *args, **kwargs):
+            self.chroms += [chrom]
+            return self.bwfile.fetch(chrom, *args, **kwargs)
+
+    with bbi.open(filename) as bwfile:
+        counting_file = CountingFile(bwfile)
+        values = hgbi.get_bigwig_tile(filename, 0, 0, tsinfo['max_width'],
+                bwfile=counting_file)
+
+    # contigs smaller than one bin aren't fetched
+    assert len(counting_file.chroms) == (chromsizes >= binsize).sum()
+    # and the region beyond the end of the genome is filled with NaNs
+    num_nans = int(np.ceil((tsinfo['max_width'] - chromsizes.sum()) / binsize))
+    assert len(values) == (chromsizes // binsize).sum() + num_nans
+
+def test_summary():
+    import hgtiles.bigwig_summary as hgbs
+    import tempfile
+
+    filename = op.join('data', 'wgEncodeCaltechRnaSeqHuvecR1x75dTh1014IlnaPlusSignalRep2.bigWig')
+
+    with tempfile.TemporaryDirectory() as td:
+        summary_path = op.join(td, 'test.hgsummary')
+        hgbs.build(filename, summary_path, num_zoom_levels=4)
+
+        summary = hgbs.get_summary(filename, summary_path)
+        assert summary['header']['num_zoom_levels'] == 4
+
+        for zoom_level in range(4):
+            for summary_type in hgbs.SUMMARIES:
+                tiles = hgbi.get_bigwig_tiles(filename, zoom_level, 0, 2 ** zoom_level,
+                        summary=summary_type)
+
+                for x, tile in enumerate(tiles):
+                    assert np.array_equal(hgbs.get_tile(summary, zoom_level, x, summary_type),
+                            tile, equal_nan=True)
+
+        # summaries of other versions of the bigWig file aren't used
+        other_filename = op.join(td, 'other.bigWig')
+        with open(other_filename, 'wb') as f:
+            f.write(b'x')
+        assert hgbs.get_summary(other_filename, summary_path) is None
+
+def test_summary_out_of_range():
+    import base64
+    import hgtiles.bigwig_summary as hgbs
+    import pytest
+    import shutil
+    import tempfile
+
+    filename = op.join('data', 'wgEncodeCaltechRnaSeqHuvecR1x75dTh1014IlnaPlusSignalRep2.bigWig')
+    # positions past either end of the summarized zoom levels
+    tile_ids = ['a.0.1', 'a.1.-1', 'a.1.3', 'a.2.4', 'a.3.8', 'a.3.-2']
+
+    with tempfile.TemporaryDirectory() as td:
+        summarized_filename = op.join(td, 'test.bigWig')
+        shutil.copy2(filename, summarized_filename)
+        hgbs.build(summarized_filename, num_zoom_levels=4)
+
+        summary = hgbs.get_summary(summarized_filename)
+        with pytest.raises(ValueError):
+            hgbs.get_tile(summary, 3, 8)
+        with pytest.raises(ValueError):
+            hgbs.get_tile(summary, 1, -1)
+
+        for envelope in [False, True]:
+            tiles = dict(hgbi.tiles(summarized_filename, tile_ids, envelope=envelope))
+            expected = dict(hgbi.tiles(filename, tile_ids, envelope=envelope))
+
+            for tile_id in tile_ids:
+                assert tiles[tile_id] == expected[tile_id]
+
+            # and they're empty
+            dtype = tiles['a.0.1']['dtype']
+            values = np.frombuffer(base64.b64decode(tiles['a.0.1']['dense']), dtype=dtype)
+            assert len(values) == hgbi.TILE_SIZE and np.isnan(values).all()
+
+def test_envelope():
+    import base64
+    import bbi
+
+    filename = op.join('data', 'wgEncodeCaltechRnaSeqHuvecR1x75dTh1014IlnaPlusSignalRep2.bigWig')
+    tile_ids = ['a.{}.{}'.format(z, x) for z in [0, 5, 10, 16] for x in range(3)]
+
+    dense_tiles = dict(hgbi.tiles(filename, tile_ids))
+    envelope_tiles = dict(hgbi.tiles(filename, tile_ids, envelope=True))
+
+    with bbi.open(filename) as bwfile:
+        for tile_id in tile_ids:
+            (zoom_level, x) = map(int, tile_id.split('.')[1:3])
+            tile = envelope_tiles[tile_id]
+            dtype = tile['dtype']
+
+            if dtype == dense_tiles[tile_id]['dtype']:
+                assert tile['dense'] == dense_tiles[tile_id]['dense']
+
+            # the same values as fetching each summary separately
+            for key, summary in [('dense', 'mean'), ('mins', 'min'),
+                    ('maxs', 'max'), ('coverage', 'cov')]:
+                expected = hgbi.get_bigwig_tiles(filename, zoom_level, 0, 3,
+                        bwfile=bwfile, summary=summary)[x]
+                values = np.frombuffer(base64.b64decode(tile[key]), dtype=dtype)
+
+                assert np.array_equal(values, expected.astype(dtype), equal_nan=True)
+
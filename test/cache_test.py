@@ -0,0 +1,81 @@
+import hgtiles.cache as hgca
+import os
+import os.path as op
+import tempfile
+
+
+class Handle:
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def make_files(td, n):
+    filenames = []
+    for i in range(n):
+        filename = op.join(td, 'file{}.txt'.format(i))
+        with open(filename, 'w') as f:
+            f.write(str(i))
+        filenames += [filename]
+
+    return filenames
+
+def test_lru_eviction():
+    with tempfile.TemporaryDirectory() as td:
+        filenames = make_files(td, 3)
+        cache = hgca.HandleCache(Handle, max_size=2)
+
+        h0 = cache.get(filenames[0])
+        h1 = cache.get(filenames[1])
+        assert cache.get(filenames[0]) is h0
+
+        # filenames[1] is now the least recently used
+        h2 = cache.get(filenames[2])
+        assert h1.closed
+        assert not h0.closed and not h2.closed
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 3
+        assert stats['evictions'] == 1
+        assert stats['size'] == 2
+
+def test_byte_budget():
+    with tempfile.TemporaryDirectory() as td:
+        filenames = make_files(td, 3)
+        cache = hgca.HandleCache(Handle, sizer=lambda h: 10, max_bytes=25)
+
+        handles = [cache.get(f) for f in filenames]
+        assert handles[0].closed
+        assert cache.stats()['bytes'] == 20
+
+def test_invalidation():
+    with tempfile.TemporaryDirectory() as td:
+        filename = make_files(td, 1)[0]
+        cache = hgca.HandleCache(Handle)
+
+        h0 = cache.get(filename)
+
+        # replace the file with a new one
+        other = op.join(td, 'other.txt')
+        with open(other, 'w') as f:
+            f.write('new')
+        os.replace(other, filename)
+
+        h1 = cache.get(filename)
+        assert h1 is not h0
+        assert h0.closed
+        assert cache.stats()['invalidations'] == 1
+
+def test_acquired_handles_stay_open():
+    with tempfile.TemporaryDirectory() as td:
+        filenames = make_files(td, 2)
+        cache = hgca.HandleCache(Handle, max_size=1)
+
+        with cache.acquire(filenames[0]) as h0:
+            cache.get(filenames[1])
+            # evicted but still in use
+            assert not h0.closed
+        assert h0.closed
@@ -1,7 +1,82 @@
+import h5py
 import hgtiles.cooler as hgco
 import json
 import numpy as np
 import os.path as op
+import pandas as pd
+import tempfile
+
+def write_cooler(grp, chromsizes, resolution, pixels):
+    '''
+    Write a single resolution cooler into an HDF5 group.
+    '''
+    names = [c[0] for c in chromsizes]
+    lengths = [c[1] for c in chromsizes]
+
+    chrom_ids, starts, ends = [], [], []
+    chrom_offset = [0]
+    for cid, length in enumerate(lengths):
+        chrom_starts = np.arange(0, length, resolution)
+        chrom_ids += [np.full(len(chrom_starts), cid)]
+        starts += [chrom_starts]
+        ends += [np.minimum(chrom_starts + resolution, length)]
+        chrom_offset += [chrom_offset[-1] + len(chrom_starts)]
+
+    n_bins = chrom_offset[-1]
+    weights = np.random.random(n_bins)
+    weights[::17] = np.nan
+
+    grp.create_dataset('chroms/name', data=np.array(names, dtype='S'))
+    grp.create_dataset('chroms/length', data=np.array(lengths, dtype=np.int32))
+    grp.create_dataset('bins/chrom', data=np.concatenate(chrom_ids).astype(np.int32))
+    grp.create_dataset('bins/start', data=np.concatenate(starts).astype(np.int32))
+    grp.create_dataset('bins/end', data=np.concatenate(ends).astype(np.int32))
+    grp.create_dataset('bins/weight', data=weights)
+
+    # aggregate the base resolution pixels to this resolution
+    bin_starts = np.concatenate(starts) + np.repeat(
+            np.r_[0, np.cumsum(lengths)[:-1]], np.diff(chrom_offset))
+    bin1 = np.searchsorted(bin_starts, pixels[0], side='right') - 1
+    bin2 = np.searchsorted(bin_starts, pixels[1], side='right') - 1
+    df = pd.DataFrame({'bin1_id': bin1, 'bin2_id': bin2, 'count': pixels[2]})
+    df = df.groupby(['bin1_id', 'bin2_id']).sum().reset_index()
+
+    grp.create_dataset('pixels/bin1_id', data=df['bin1_id'].values.astype(np.int64))
+    grp.create_dataset('pixels/bin2_id', data=df['bin2_id'].values.astype(np.int64))
+    grp.create_dataset('pixels/count', data=df['count'].values.astype(np.int32))
+    grp.create_dataset('indexes/chrom_offset', data=np.array(chrom_offset, dtype=np.int64))
+    grp.create_dataset('indexes/bin1_offset', data=np.searchsorted(
+        df['bin1_id'].values, np.arange(n_bins + 1)).astype(np.int64))
+
+    grp.attrs['format'] = 'HDF5::Cooler'
+    grp.attrs['format-version'] = 2
+    grp.attrs['bin-type'] = 'fixed'
+    grp.attrs['bin-size'] = resolution
+    grp.attrs['nchroms'] = len(names)
+    grp.attrs['nbins'] = n_bins
+    grp.attrs['nnz'] = len(df)
+
+def make_mcool(directory, chromsizes=(('chr1', 90000), ('chr2', 50500)),
+        resolutions=(1000, 2000, 4000, 8000), n_pixels=4000):
+    '''
+    Create a small multi-resolution cooler with random contacts.
+    '''
+    np.random.seed(0)
+    genome_length = sum(c[1] for c in chromsizes)
+
+    # genomic positions of the contacts, upper triangular
+    pos1 = np.random.randint(0, genome_length, n_pixels)
+    pos2 = np.random.randint(0, genome_length, n_pixels)
+    pixels = (np.minimum(pos1, pos2), np.maximum(pos1, pos2),
+            np.random.randint(1, 10, n_pixels))
+
+    filename = op.join(directory, 'test.mcool')
+    with h5py.File(filename, 'w') as f:
+        for resolution in resolutions:
+            write_cooler(f.create_group('resolutions/{}'.format(resolution)),
+                    chromsizes, resolution, pixels)
+
+    return filename
 
 def test_cooler_info():
     filename = op.join('data', 'Dixon2012-J1-NcoI-R1-filtered.100kb.multires.cool')
@@ -24,3 +99,102 @@ def test_cooler_info():
 def test_cooler_tiles():
     filename = op.join('data', 'hic-resolutions.cool')
     hgco.tiles(filename, ['x.0.0.0'])
+
+def test_cached_handles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = make_mcool(td)
+
+        stats = hgco.mats.stats()
+        info = hgco.tileset_info(filename)
+        assert info['resolutions'] == (1000, 2000, 4000, 8000)
+
+        tiles = hgco.tiles(filename, ['x.0.0.0', 'x.3.0.0'])
+        assert len(tiles) == 2
+
+        new_stats = hgco.mats.stats()
+        assert new_stats['misses'] == stats['misses'] + 1
+        assert new_stats['hits'] == stats['hits'] + 1
+
+        hgco.mats.invalidate(filename)
+
+def test_bundled_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = make_mcool(td)
+
+        tile_ids = ['x.3.{}.{}'.format(x, y) for x in range(2) for y in range(2)]
+        bundled = dict(hgco.tiles(filename, tile_ids))
+
+        for tile_id in tile_ids:
+            single = hgco.tiles(filename, [tile_id])[0][1]
+            assert single == bundled[tile_id]
+
+        hgco.mats.invalidate(filename)
+
+def test_get_data_arrays():
+    with tempfile.TemporaryDirectory() as td:
+        filename = make_mcool(td)
+
+        with h5py.File(filename, 'r') as f:
+            grp = f['resolutions']['1000']
+            genome_length = int(sum(grp['chroms']['length'][:]))
+
+            (pixels, (bins1, bins2)) = hgco.get_data_arrays(grp,
+                    0, genome_length - 1, 0, genome_length - 1, 'none')
+            assert len(pixels['count']) == grp.attrs['nnz']
+            assert pixels['count'].sum() == grp['pixels']['count'][:].sum()
+            assert bins1 is None
+
+            (pixels, (bins1, bins2)) = hgco.get_data(grp, 0, 50000, 30000, 90000)
+            assert list(pixels.columns) == ['genome_start1', 'genome_start2', 'balanced']
+            assert (pixels['genome_start1'] < 51000).all()
+            assert (pixels['genome_start2'] >= 30000).all()
+            assert len(bins1) == 51 and len(bins2) == 61
+
+def test_bin_table_cache():
+    with tempfile.TemporaryDirectory() as td:
+        filename = make_mcool(td)
+
+        with h5py.File(filename, 'r') as f:
+            grp = f['resolutions']['2000']
+            bin_table = hgco.get_bin_table(grp)
+
+            assert hgco.get_bin_table(grp, 'weight') is bin_table
+            assert len(bin_table['genome_start']) == grp.attrs['nbins']
+            assert bin_table['genome_end'][-1] == 140500
+            # the weights are stored contiguously so they can be mapped
+            assert isinstance(bin_table['weight'], np.memmap)
+
+            assert hgco.get_bin_table(grp, 'none')['weight'] is None
+
+        hgco.bin_tables.clear()
+
+def test_threaded_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = make_mcool(td)
+
+        tile_ids = ['x.3.0.0', 'x.0.0.0', 'x.2.0.0.none', 'x.3.2.2', 'x.1.0.0']
+        single_threaded = hgco.tiles(filename, tile_ids)
+        multi_threaded = hgco.tiles(filename, tile_ids, num_workers=4)
+
+        assert [t[0] for t in single_threaded] == tile_ids
+        assert single_threaded == multi_threaded
+
+        # every thread reads through its own handle, which is
+        # reused by later requests
+        thread_ids = set(t.ident for t in hgco.get_executor(4)._threads)
+        worker_keys = [(filename, i) for i in thread_ids if (filename, i) in hgco.worker_files]
+        assert len(worker_keys) > 0
+
+        stats = hgco.worker_files.stats()
+        assert hgco.tiles(filename, tile_ids, num_workers=4) == single_threaded
+        assert hgco.worker_files.stats()['misses'] == stats['misses']
+
+        # concurrent requests don't share handles
+        import concurrent.futures as cf
+        with cf.ThreadPoolExecutor(max_workers=2) as requests:
+            results = list(requests.map(lambda i: hgco.tiles(filename, tile_ids,
+                num_workers=4), range(4)))
+        assert all(r == single_threaded for r in results)
+
+        hgco.mats.invalidate(filename)
+        hgco.worker_files.clear()
@@ -0,0 +1,96 @@
+import cooler_test
+import hgtiles.cooler as hgco
+import hgtiles.dispatch as hgdi
+import tempfile
+
+
+def test_dispatch_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = cooler_test.make_mcool(td)
+
+        tile_ids = ['a.3.0.0', 'a.0.0.0', 'a.1.0.0.none']
+
+        try:
+            tiles = hgdi.tiles(tile_ids, {'a': filename}, num_workers=2)
+        finally:
+            hgdi.shutdown()
+
+        assert [t[0] for t in tiles] == tile_ids
+        assert tiles == hgco.tiles(filename, tile_ids)
+
+        hgco.mats.invalidate(filename)
+
+def test_dispatch_after_worker_died():
+    import os
+    import signal
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = cooler_test.make_mcool(td)
+        tile_ids = ['a.0.0.0', 'a.1.0.0']
+
+        try:
+            tiles = hgdi.tiles(tile_ids, {'a': filename}, num_workers=1)
+            pool = hgdi.pool
+
+            # e.g. killed for running out of memory
+            for process in list(pool._processes.values()):
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
+
+            assert hgdi.tiles(tile_ids, {'a': filename}, num_workers=1) == tiles
+            assert hgdi.pool is not pool
+        finally:
+            hgdi.shutdown()
+
+        hgco.mats.invalidate(filename)
+
+def test_dispatch_2d_annotations():
+    import bed2ddb_test
+    import geo_test
+    import hgtiles.bed2ddb as hgb2
+    import hgtiles.geo as hgge
+    import os.path as op
+
+    with tempfile.TemporaryDirectory() as td:
+        bed2ddb_filename = op.join(td, 'test.bed2ddb')
+        bed2ddb_test.make_bed2ddb(bed2ddb_filename)
+        geodb_filename = op.join(td, 'test.geodb')
+        geo_test.make_geodb(geodb_filename)
+
+        # two groups of adjacent tiles
+        tile_ids = ['a.2.0.0', 'a.2.1.0', 'a.2.3.3', 'b.2.1.1', 'b.2.1.2']
+
+        try:
+            tiles = dict(hgdi.tiles(tile_ids, {'a': bed2ddb_filename, 'b': geodb_filename},
+                filetypes={'a': 'bed2ddb', 'b': 'geodb'}, num_workers=1))
+        finally:
+            hgdi.shutdown()
+
+        bed2ddb_tiles = hgb2.get_2D_tiles(bed2ddb_filename, 2, 0, 0, 4, 4)
+        geodb_tiles = hgge.get_tiles(geodb_filename, 2, 0, 0, 4, 4)
+
+        assert len(tiles) == len(tile_ids)
+        for tile_id in tile_ids:
+            (uuid, z, x, y) = tile_id.split('.')
+            expected = (bed2ddb_tiles if uuid == 'a' else geodb_tiles)[(int(x), int(y))]
+            assert tiles[tile_id] == expected
+
+def test_dispatch_unknown_tileset():
+    import pytest
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = cooler_test.make_mcool(td)
+
+        # nothing is submitted when any of the tilesets can't be served
+        for tilesets in [{'a': filename}, {'a': filename, 'b': 'test.unknown'}]:
+            with pytest.raises(ValueError):
+                hgdi.tiles(['a.0.0.0', 'b.0.0'], tilesets)
+
+            assert hgdi.pool is None
+
+def test_pack_dense():
+    tiles = [('a.0.0', {'dense': 'AAAA', 'dtype': 'float32'}), ('a.0.1', [])]
+
+    (packed, shm_name) = hgdi.pack_dense(tiles)
+    assert packed[0][1]['dense'] == (0, 4)
+    assert hgdi.unpack_dense(packed, shm_name) == tiles
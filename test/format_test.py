@@ -0,0 +1,44 @@
+import hgtiles.format as hgfo
+import json
+
+def test_columnar_tile():
+    rows = [{'xStart': i * 3000000000, 'xEnd': i * 3000000000 + 10, 'chrOffset': 0,
+        'importance': i / 2, 'uid': 'uid{}'.format(i % 3),
+        'fields': ['chr1', str(i % 2), 'gene']} for i in range(10)]
+
+    for binary in [False, True]:
+        tile = hgfo.format_columnar_tile(rows,
+                ('xStart', 'xEnd', 'chrOffset', 'importance'), binary=binary)
+
+        # the tile can be serialized as is
+        tile = json.loads(json.dumps(tile))
+
+        assert tile['length'] == 10
+        assert tile['dtypes']['xStart'] == 'int64'
+        assert tile['dtypes']['chrOffset'] == 'int32'
+        assert tile['tables']['uid'] == ['uid0', 'uid1', 'uid2']
+        assert tile['tables']['fields'] == ['chr1', '0', 'gene', '1']
+
+        assert hgfo.columnar_tile_to_rows(tile) == rows
+
+    tile = hgfo.format_columnar_tile([], ('xStart',))
+    assert tile['length'] == 0
+    assert hgfo.columnar_tile_to_rows(tile) == []
+
+def test_envelope_tile():
+    import base64
+    import numpy as np
+
+    dense = np.array([1., 2., np.nan])
+    tile = hgfo.format_envelope_tile(dense, dense - 1, dense + 1, np.array([1., .5, np.nan]))
+    assert tile['dtype'] == 'float32'
+    assert np.array_equal(np.frombuffer(base64.b64decode(tile['maxs']), dtype='float32'),
+            [2., 3., np.nan], equal_nan=True)
+
+    # every array has to fit into float16 for the tile to use it
+    dense = np.array([1., 2.])
+    assert hgfo.format_envelope_tile(dense, dense, dense, dense)['dtype'] == 'float16'
+
+    tile = hgfo.format_envelope_tile(dense, np.array([-1e6, 0.]), dense, dense)
+    assert tile['dtype'] == 'float32'
+    assert np.array_equal(np.frombuffer(base64.b64decode(tile['dense']), dtype='float32'), dense)
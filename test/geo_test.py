@@ -0,0 +1,69 @@
+import hgtiles.format as hgfo
+import hgtiles.geo as hgge
+import json
+import os.path as op
+import sqlite3
+import tempfile
+
+def make_geodb(filename, num_polygons=500, max_zoom=4):
+    '''
+    Write a geo db file with small polygons, some of which
+    don't have valid geometries.
+    '''
+    conn = sqlite3.connect(filename)
+    conn.execute('''
+    CREATE TABLE tileset_info
+    (
+        zoom_step INT, tile_size INT, max_zoom INT, min_x REAL,
+        max_x REAL, min_y REAL, max_y REAL
+    )''')
+    conn.execute('INSERT INTO tileset_info VALUES (?,?,?,?,?,?,?)',
+            (1, 256, max_zoom, -180, 180, -90, 90))
+
+    conn.execute('''
+    CREATE TABLE intervals
+    (
+        id int PRIMARY KEY, zoomLevel int, importance real, minLng real,
+        maxLng real, maxLat real, minLat real, uid text, geometry text,
+        properties text
+    )''')
+    conn.execute('CREATE VIRTUAL TABLE position_index USING rtree('
+            'id, rMinLng, rMaxLng, rMinLat, rMaxLat)')
+
+    for i in range(num_polygons):
+        min_lng = -170 + (i * 7919) % 340
+        min_lat = -80 + (i * 31) % 140
+        size = 0.5 + (i % 20)
+        (max_lng, max_lat) = (min_lng + size, min_lat + size)
+
+        geometry = json.dumps({'type': 'Polygon', 'coordinates': [[[min_lng, min_lat],
+            [max_lng, min_lat], [max_lng, max_lat], [min_lng, min_lat]]]})
+
+        conn.execute('INSERT INTO intervals VALUES (?,?,?,?,?,?,?,?,?,?)',
+                (i, i % (max_zoom + 1), float(i), min_lng, max_lng, max_lat, min_lat,
+                    'uid{}'.format(i % 100), geometry if i % 10 else 'x',
+                    json.dumps({'name': 'polygon{}'.format(i)})))
+        conn.execute('INSERT INTO position_index VALUES (?,?,?,?,?)',
+                (i, min_lng, max_lng, min_lat, max_lat))
+
+    conn.commit()
+    conn.close()
+
+def test_columnar_tiles():
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.geodb')
+        make_geodb(filename)
+
+        tiles = hgge.get_tiles(filename, 2, 0, 0, 4, 4)
+
+        for columnar in [True, 'binary']:
+            columnar_tiles = hgge.get_tiles(filename, 2, 0, 0, 4, 4, columnar=columnar)
+            assert len(columnar_tiles) == 16
+
+            for pos, columnar_value in columnar_tiles.items():
+                assert columnar_value['binary'] == (columnar == 'binary')
+                assert hgfo.columnar_tile_to_rows(columnar_value) == tiles[pos]
+
+        # a tile without any polygons
+        assert hgfo.columnar_tile_to_rows(hgge.get_tiles(filename, 4, 0, 0,
+            columnar=True)[(0, 0)]) == []
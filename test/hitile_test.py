@@ -1,3 +1,4 @@
+import base64
 import dask.array as da
 import h5py
 import hgtiles.hitile as hghi
@@ -22,3 +23,126 @@ def test_hitile():
         with h5py.File(output_file, 'r') as f:
             (means, mins, maxs) = hghi.get_data(f, 0, 0)
         # print("means, mins:", means[:10], mins[:10], maxs[:10])
+
+def test_chunks_to_hitile():
+    length = 300001
+    data = np.random.random((length,))
+    data[np.random.random((length,)) < 0.1] = np.nan
+
+    with tempfile.TemporaryDirectory() as td:
+        output_file = op.join(td, 'blah.hitile')
+        hghi.chunks_to_hitile((data[i:i + 77777] for i in range(0, length, 77777)),
+                output_file, length, zoom_step=4)
+
+        with h5py.File(output_file, 'r') as f:
+            max_zoom = int(f['meta'].attrs['max-zoom'])
+            assert int(f['meta'].attrs['version']) == hghi.FORMAT_VERSION
+
+            # every zoom level is only as long as it needs to be
+            for z in range(0, max_zoom + 1, 4):
+                for prefix in hghi.DATASET_PREFIXES:
+                    assert len(f[prefix + str(z)]) == math.ceil(length / 2 ** z)
+
+            for z in range(max_zoom + 1):
+                bin_width = 2 ** (max_zoom - z)
+                tile_data = np.full(1024 * bin_width, np.nan)
+                tile_data[:length] = data[:1024 * bin_width]
+                tile_data = tile_data.reshape((1024, bin_width))
+
+                (means, mins, maxs) = hghi.get_data(f, z, 0)
+
+                assert np.allclose(means, np.nanmean(tile_data, axis=1),
+                        equal_nan=True, rtol=1e-5)
+                assert np.allclose(mins, np.nanmin(tile_data, axis=1), equal_nan=True)
+                assert np.allclose(maxs, np.nanmax(tile_data, axis=1), equal_nan=True)
+
+def test_unversioned_hitile():
+    # the layout written before the files were versioned: NaN-propagating
+    # sums, mins and maxs and NaN counts that were never filled in
+    length = 4096
+    data = np.random.random((length,))
+    data[[5, 1500, 3000]] = np.nan
+
+    with tempfile.TemporaryDirectory() as td:
+        output_file = op.join(td, 'old.hitile')
+
+        with h5py.File(output_file, 'w') as f:
+            meta = f.create_dataset('meta', (1,), dtype='f')
+            meta.attrs['tile-size'] = 1024
+            meta.attrs['zoom-step'] = 2
+            meta.attrs['max-length'] = length
+            meta.attrs['max-zoom'] = 2
+            meta.attrs['max-width'] = 4096
+
+            for z in (0, 2):
+                values = data.reshape((-1, 2 ** z)).sum(axis=1)
+                for prefix in ('values_', 'mins_', 'maxs_'):
+                    f.create_dataset(prefix + str(z), data=values, dtype='f')
+                f.create_dataset('nan_values_' + str(z), (length,), dtype='f')
+
+        with h5py.File(output_file, 'r') as f:
+            assert hghi.load_meta(f)['version'] == 1
+
+            for z in range(3):
+                bin_width = 2 ** (2 - z)
+                (means, mins, maxs) = hghi.get_data(f, z, 0)
+
+                # any NaN in a bin makes its average NaN
+                expected = data[:1024 * bin_width].reshape((1024, bin_width)).sum(axis=1) / bin_width
+                assert np.isnan(means).any()
+                assert np.allclose(means, expected, equal_nan=True, rtol=1e-5)
+
+def test_cached_files():
+    data = np.random.random((100000,))
+
+    with tempfile.TemporaryDirectory() as td:
+        output_file = op.join(td, 'blah.hitile')
+        hghi.array_to_hitile(data, output_file, zoom_step=4)
+
+        hghi.files.clear()
+        tile_ids = ['a.{}.{}'.format(z, x) for z in range(3) for x in range(2 ** z)]
+        tiles = hghi.tiles(output_file, tile_ids)
+
+        stats = hghi.files.stats()
+        assert stats['misses'] == 1
+        assert stats['size'] == 1
+
+        (f, meta) = hghi.files.get(output_file)
+        assert f.mode == 'r'
+        assert hghi.tileset_info(output_file)['max_zoom'] == meta['max_zoom']
+
+        # the tiles are the same as those read from a freshly opened file
+        with h5py.File(output_file, 'r') as f:
+            for tile_id, tile in zip(tile_ids, tiles):
+                (z, x) = map(int, tile_id.split('.')[1:3])
+                (means, mins, maxs) = hghi.get_data(f, z, x)
+                assert np.array_equal(np.frombuffer(base64.b64decode(tile[1]['dense']),
+                    dtype='float32'), means.astype('float32'), equal_nan=True)
+
+        hghi.files.invalidate(output_file)
+        assert hghi.files.stats()['size'] == 0
+
+def test_bundled_tiles():
+    data = np.random.random((300000,))
+    data[np.random.random((300000,)) < 0.1] = np.nan
+
+    with tempfile.TemporaryDirectory() as td:
+        output_file = op.join(td, 'blah.hitile')
+        hghi.array_to_hitile(data, output_file, zoom_step=4)
+
+        # a run of adjacent tiles past the end of the data, a repeated tile
+        # and a tile outside of the tileset
+        tile_ids = ['a.9.{}'.format(x) for x in range(290, 296)] + ['a.9.291', 'a.2.-1']
+        tiles = hghi.tiles(output_file, tile_ids)
+
+        assert [t[0] for t in tiles] == tile_ids[:-1]
+
+        with h5py.File(output_file, 'r') as f:
+            for tile_id, tile in tiles:
+                x = int(tile_id.split('.')[2])
+                (means, mins, maxs) = hghi.get_data(f, 9, x)
+
+                for key, values in [('dense', means), ('mins', mins), ('maxs', maxs)]:
+                    assert np.array_equal(np.frombuffer(base64.b64decode(tile[key]),
+                        dtype='float32'), values.astype('float32'), equal_nan=True)
+    hghi.files.clear()
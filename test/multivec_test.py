@@ -1,8 +1,181 @@
+import base64
+import h5py
+import math
+import numpy as np
 import os.path as op
 import hgtiles.multivec as hgmu
+import pytest
+import tempfile
 
 def test_multivec():
     filename = op.join('data', 'all.KL.bed.multires.mv5')
 
     tsinfo = hgmu.tileset_info(filename)
     # print(hgmu.tileset_info(filename))
+
+def write_multivec(filename, chromsizes, num_rows, base_resolution=1000,
+        num_resolutions=4, tile_size=256):
+    '''
+    Write a multivec file with random values.
+    '''
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('chroms/name', data=np.array([c[0] for c in chromsizes], dtype='S'))
+        f.create_dataset('chroms/length', data=np.array([c[1] for c in chromsizes]))
+        f.create_group('info').attrs['tile-size'] = tile_size
+
+        for i in range(num_resolutions):
+            resolution = base_resolution * 2 ** i
+            group = f.create_group('resolutions/{}'.format(resolution))
+            group.attrs['row_infos'] = np.array(['row{}'.format(j)
+                for j in range(num_rows)], dtype='S')
+
+            for chrom, length in chromsizes:
+                group.create_dataset('values/' + chrom, data=np.random.random(
+                    (math.ceil(length / resolution), num_rows)), compression='gzip')
+
+def test_tiles():
+    chromsizes = [('chr1', 1000000), ('chr2', 333333), ('chr3', 2500)] + [
+            ('scaffold{}'.format(i), 700) for i in range(20)]
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.mv5')
+        write_multivec(filename, chromsizes, 5)
+
+        tsinfo = hgmu.tileset_info(filename)
+        assert tsinfo['shape'] == [256, 5]
+        assert tsinfo['row_infos'] == ['row0', 'row1', 'row2', 'row3', 'row4']
+
+        with h5py.File(filename, 'r') as f:
+            file_chromsizes = list(zip(f['chroms']['name'][:], f['chroms']['length'][:]))
+
+            for zoom_level, resolution in enumerate(tsinfo['resolutions']):
+                tile_width = tsinfo['tile_size'] * resolution
+                num_tiles = math.ceil(tsinfo['max_pos'][0] / tile_width)
+
+                tile_ids = ['a.{}.{}'.format(zoom_level, x) for x in range(num_tiles)]
+                tiles = hgmu.tiles(filename, tile_ids + ['a.0.-1'])
+                assert [t[0] for t in tiles] == tile_ids
+
+                # adjacent tiles read together are the same as single tiles
+                for x, (tile_id, tile) in enumerate(tiles):
+                    expected = hgmu.get_tile(f, file_chromsizes, resolution,
+                            x * tile_width, (x + 1) * tile_width, tsinfo['shape'])
+
+                    assert tile['shape'] == list(expected.shape)
+                    assert np.array_equal(np.frombuffer(base64.b64decode(tile['dense']),
+                        dtype=tile['dtype']).reshape(tile['shape']),
+                        expected.astype(tile['dtype']))
+
+        hgmu.files.clear()
+
+def test_chromosome_boundaries():
+    chromsizes = [('a', 2500), ('b', 2500), ('c', 1200), ('d', 5000)]
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.mv5')
+
+        # the value of each bin is 100 * the chromosome index + the bin index
+        with h5py.File(filename, 'w') as f:
+            f.create_dataset('chroms/name', data=np.array([c[0] for c in chromsizes], dtype='S'))
+            f.create_dataset('chroms/length', data=np.array([c[1] for c in chromsizes]))
+            f.create_group('info').attrs['tile-size'] = 8
+
+            for i, (chrom, length) in enumerate(chromsizes):
+                f.create_dataset('resolutions/1000/values/' + chrom,
+                        data=(100 * i + np.arange(math.ceil(length / 1000)))[:, None])
+
+        assert list(hgmu.get_bin_offsets(chromsizes, 1000)) == [0, 3, 5, 7, 12]
+
+        # each bin takes its value from the chromosome bin that it starts
+        # in, so bins don't drift at the partial bins at chromosome ends
+        tiles = hgmu.tiles(filename, ['a.0.0', 'a.0.1'])
+        values = [np.frombuffer(base64.b64decode(t['dense']), dtype=t['dtype'])
+                for (_, t) in tiles]
+
+        assert list(values[0]) == [0, 1, 2, 100, 101, 200, 201, 300]
+        assert list(values[1]) == [301, 302, 303, 304, 0, 0, 0, 0]
+
+        hgmu.files.clear()
+
+def test_row_selection():
+    chromsizes = [('chr1', 1000000), ('chr2', 333333)]
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = op.join(td, 'test.mv5')
+        write_multivec(filename, chromsizes, 8)
+
+        tile_ids = ['a.2.{}'.format(x) for x in range(4)]
+        full = hgmu.tiles(filename, tile_ids)
+        selected = hgmu.tiles(filename, tile_ids, rows=[6, 1, 1])
+        grouped = hgmu.tiles(filename, tile_ids, row_groups=[[0, 1, 2], [7]])
+
+        def decode(tile):
+            return np.frombuffer(base64.b64decode(tile['dense']),
+                    dtype=tile['dtype']).reshape(tile['shape'])
+
+        for (_, f), (_, s), (_, g) in zip(full, selected, grouped):
+            values = decode(f)
+
+            assert s['shape'] == [values.shape[0], 3]
+            assert np.array_equal(decode(s), values[:, [6, 1, 1]])
+
+            assert g['shape'] == [values.shape[0], 2]
+            assert np.allclose(decode(g)[:, 0], values[:, :3].mean(axis=1), rtol=1e-3)
+            assert np.allclose(decode(g)[:, 1], values[:, 7], rtol=1e-3)
+
+        # empty selections are rejected before anything is read
+        for options in [{'rows': []}, {'row_groups': []}, {'row_groups': [[0], []]},
+                {'rows': [8]}, {'rows': [0], 'row_groups': [[0]]}]:
+            with pytest.raises(ValueError):
+                hgmu.tiles(filename, tile_ids, **options)
+
+        hgmu.files.clear()
+
+def test_build():
+    import hgtiles.multivec_build as hgmb
+
+    chromsizes = [('chr1', 10000), ('chr2', 2500), ('chr3', 1000)]
+
+    with tempfile.TemporaryDirectory() as td:
+        # chromosomes in a different order than chromsizes,
+        # with a gap and an interval spanning several bins
+        bedgraph = op.join(td, 'a.bedGraph')
+        with open(bedgraph, 'w') as f:
+            f.write('track type=bedGraph\n')
+            f.write('chr2\t0\t2500\t3\n')
+            f.write('chr1\t0\t500\t1\n')
+            f.write('chr1\t500\t3000\t2\n')
+            f.write('chr1\t4000\t4100\t5\n')
+
+        tsv = op.join(td, 'b.tsv')
+        with open(tsv, 'w') as f:
+            f.write('chrom\tstart\tend\tx\ty\n')
+            f.write('chr1\t0\t10000\t1\tnan\n')
+
+        filename = op.join(td, 'test.mv5')
+        hgmb.build(filename, [bedgraph, tsv], chromsizes, resolution=1000,
+                tile_size=4, chunk_bins=3)
+
+        tsinfo = hgmu.tileset_info(filename)
+        assert tsinfo['resolutions'] == [4000, 2000, 1000]
+        assert tsinfo['max_pos'] == [13500]
+        assert tsinfo['shape'] == [4, 3]
+        assert tsinfo['row_infos'] == ['a.bedGraph', 'x', 'y']
+
+        with h5py.File(filename, 'r') as f:
+            values = f['resolutions/1000/values/chr1'][:]
+            assert values.shape == (10, 3)
+            assert np.allclose(values[:5, 0], [1.5, 2, 2, np.nan, 5], equal_nan=True)
+            assert np.all(values[:, 1] == 1)
+            assert np.all(np.isnan(values[:, 2]))
+
+            # coarser resolutions are the mean of the base resolution bins
+            assert np.allclose(f['resolutions/2000/values/chr1'][:3, 0],
+                    [1.75, 2, 5])
+            assert np.allclose(f['resolutions/4000/values/chr1'][:, 0],
+                    [11 / 6, 5, np.nan], equal_nan=True)
+            assert np.allclose(f['resolutions/1000/values/chr2'][:, 0], [3, 3, 3])
+            assert np.all(np.isnan(f['resolutions/1000/values/chr3'][:, 0]))
+
+        assert len(hgmu.tiles(filename, ['a.0.0', 'a.2.3'])) == 2
+        hgmu.files.clear()
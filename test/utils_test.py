@@ -0,0 +1,6 @@
+import hgtiles.utils as hgut
+
+def test_consecutive_runs():
+    assert hgut.consecutive_runs([]) == []
+    assert hgut.consecutive_runs([3, 1, 2, 2, 7, 9, 8]) == [(1, 3), (7, 3)]
+    assert hgut.consecutive_runs([5]) == [(5, 1)]